@@ -0,0 +1,248 @@
+"""Offline batch mode for large answer and judgment runs.
+
+Requests are written in the OpenAI Batch JSONL format (one
+{"custom_id", "method", "url", "body"} line per chat completion), submitted
+through a backend, polled until the batch ends, and the outputs are mapped
+back by custom_id. Requests that failed or are missing from the output are
+resubmitted in a new batch up to max_retries times.
+
+Backends:
+- openai: the Batch API of OpenAI or Azure OpenAI, using the first endpoint
+  of the api_config.yaml entry
+- local: a file-based fake that answers every request with a fixed
+  completion, for testing the whole flow offline
+
+Everything lives under one work directory: the submitted inputs, the
+batches still in flight (state.json) and every result received so far
+(results.jsonl). Rerunning the same command resumes polling instead of
+resubmitting, and requests whose body has not changed are served from the
+saved results.
+"""
+import hashlib
+import json
+import os
+import random
+import shutil
+import time
+import uuid
+
+from utils import get_client
+
+
+BATCH_URL = "/v1/chat/completions"
+MAX_BATCH_REQUESTS = 50000
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def make_request(custom_id, model, messages, temperature, max_tokens):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_URL,
+        "body": {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+    }
+
+
+def get_body_hash(body):
+    return hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def parse_output_line(record):
+    """(custom_id, content or None, error message or None) of one output or error file line."""
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code", 200) != 200:
+        error = record.get("error") or response.get("body", {}).get("error") or response.get("status_code")
+        return record["custom_id"], None, str(error)
+    return record["custom_id"], response["body"]["choices"][0]["message"]["content"], None
+
+
+class OpenAIBatchBackend:
+    """Batch API of OpenAI (api_type openai) or Azure OpenAI (api_type azure)."""
+
+    def __init__(self, endpoint_info, completion_window="24h"):
+        endpoints = endpoint_info.get("endpoints") or [None]
+        api_type = "azure" if endpoint_info["api_type"] == "azure" else "openai"
+        self.client = get_client(api_type, endpoints[0])
+        self.completion_window = completion_window
+
+    def submit(self, input_file):
+        with open(input_file, "rb") as fin:
+            file = self.client.files.create(file=fin, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=file.id, endpoint=BATCH_URL, completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def poll(self, batch_id):
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines += self.client.files.content(file_id).text.splitlines()
+        return [parse_output_line(json.loads(line)) for line in lines if line.strip()]
+
+
+class LocalBatchBackend:
+    """File-based fake of the Batch API.
+
+    A batch completes `delay` seconds after submission. Every request is
+    answered with `completion`, except a `failure_rate` share that comes
+    back as a server error.
+    """
+
+    def __init__(self, directory, completion="mock answer", failure_rate=0.0, delay=0.0, seed=0):
+        self.directory = directory
+        self.completion = completion
+        self.failure_rate = failure_rate
+        self.delay = delay
+        self.seed = seed
+
+    def _path(self, batch_id, name):
+        return os.path.join(self.directory, batch_id, name)
+
+    def submit(self, input_file):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        shutil.copy(input_file, self._path(batch_id, "input.jsonl"))
+        with open(self._path(batch_id, "status.json"), "w") as fout:
+            json.dump({"status": "in_progress", "created_at": time.time()}, fout)
+        return batch_id
+
+    def poll(self, batch_id):
+        with open(self._path(batch_id, "status.json")) as fin:
+            status = json.load(fin)
+        if status["status"] == "in_progress" and time.time() - status["created_at"] >= self.delay:
+            self._run(batch_id)
+            status["status"] = "completed"
+            with open(self._path(batch_id, "status.json"), "w") as fout:
+                json.dump(status, fout)
+        return status["status"]
+
+    def _run(self, batch_id):
+        rng = random.Random(f"{self.seed}-{batch_id}")
+        with open(self._path(batch_id, "input.jsonl")) as fin, open(self._path(batch_id, "output.jsonl"), "w") as fout:
+            for line in fin:
+                request = json.loads(line)
+                if rng.random() < self.failure_rate:
+                    response = {"status_code": 500, "body": {"error": {"message": "local batch failure"}}}
+                else:
+                    response = {"status_code": 200, "body": {
+                        "object": "chat.completion",
+                        "model": request["body"]["model"],
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": self.completion}, "finish_reason": "stop"}],
+                    }}
+                fout.write(json.dumps({"id": uuid.uuid4().hex, "custom_id": request["custom_id"], "response": response, "error": None}) + "\n")
+
+    def results(self, batch_id):
+        with open(self._path(batch_id, "output.jsonl")) as fin:
+            return [parse_output_line(json.loads(line)) for line in fin if line.strip()]
+
+
+def get_batch_backend(name, endpoint_info, work_dir):
+    if name == "local":
+        return LocalBatchBackend(os.path.join(work_dir, "local_backend"), **endpoint_info.get("local_batch", {}))
+    assert endpoint_info["api_type"] in ("openai", "azure"), f"batch mode needs an openai or azure endpoint, not {endpoint_info['api_type']}"
+    return OpenAIBatchBackend(endpoint_info)
+
+
+class BatchRunner:
+    """Submits requests through a backend and keeps the results on disk under work_dir."""
+
+    def __init__(self, backend, work_dir, poll_interval=60, max_retries=2, max_batch_requests=MAX_BATCH_REQUESTS):
+        self.backend = backend
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.max_batch_requests = max_batch_requests
+        os.makedirs(work_dir, exist_ok=True)
+        self.state_file = os.path.join(work_dir, "state.json")
+        self.results_file = os.path.join(work_dir, "results.jsonl")
+
+        # custom_id -> {"body_hash", "content"}
+        self.results = {}
+        if os.path.exists(self.results_file):
+            with open(self.results_file) as fin:
+                for line in fin:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.results[record["custom_id"]] = record
+        # batch_id -> {"input_file", "body_hashes"} of batches submitted but not collected
+        self.state = {"batches": {}, "num_inputs": 0}
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as fin:
+                self.state = json.load(fin)
+
+    def _save_state(self):
+        with open(self.state_file + ".tmp", "w") as fout:
+            json.dump(self.state, fout)
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+    def _submit(self, requests):
+        for start in range(0, len(requests), self.max_batch_requests):
+            chunk = requests[start:start + self.max_batch_requests]
+            input_file = os.path.join(self.work_dir, f"input_{self.state['num_inputs']:05d}.jsonl")
+            self.state["num_inputs"] += 1
+            with open(input_file, "w") as fout:
+                for request in chunk:
+                    fout.write(json.dumps(request) + "\n")
+            batch_id = self.backend.submit(input_file)
+            body_hashes = {request["custom_id"]: get_body_hash(request["body"]) for request in chunk}
+            self.state["batches"][batch_id] = {"input_file": input_file, "body_hashes": body_hashes}
+            self._save_state()
+            print(f"submitted batch {batch_id} with {len(chunk)} requests")
+
+    def _wait(self):
+        """Poll every batch in flight until it ends and record its results."""
+        while self.state["batches"]:
+            for batch_id in list(self.state["batches"]):
+                status = self.backend.poll(batch_id)
+                if status not in TERMINAL_STATUSES:
+                    continue
+                body_hashes = self.state["batches"][batch_id]["body_hashes"]
+                errors = 0
+                with open(self.results_file, "a") as fout:
+                    for custom_id, content, error in (self.backend.results(batch_id) if status == "completed" else []):
+                        if error is not None or custom_id not in body_hashes:
+                            errors += error is not None
+                            continue
+                        record = {"custom_id": custom_id, "body_hash": body_hashes[custom_id], "content": content}
+                        self.results[custom_id] = record
+                        fout.write(json.dumps(record) + "\n")
+                print(f"batch {batch_id} {status}, {errors} failed requests")
+                del self.state["batches"][batch_id]
+                self._save_state()
+            if self.state["batches"]:
+                time.sleep(self.poll_interval)
+
+    def run(self, requests):
+        """custom_id -> completion text. Requests that failed on every retry are left out."""
+        body_hashes = {request["custom_id"]: get_body_hash(request["body"]) for request in requests}
+
+        def get_missing():
+            return [
+                request for request in requests
+                if self.results.get(request["custom_id"], {}).get("body_hash") != body_hashes[request["custom_id"]]
+            ]
+
+        # batches left by an interrupted run are collected before anything is resubmitted
+        self._wait()
+        for attempt in range(self.max_retries + 1):
+            missing = get_missing()
+            if not missing:
+                break
+            if attempt > 0:
+                print(f"retrying {len(missing)} failed requests")
+            self._submit(missing)
+            self._wait()
+
+        outputs = {}
+        for request in requests:
+            record = self.results.get(request["custom_id"])
+            if record is not None and record["body_hash"] == body_hashes[request["custom_id"]]:
+                outputs[request["custom_id"]] = record["content"]
+        if len(outputs) < len(requests):
+            print(f"{len(requests) - len(outputs)} requests failed after {self.max_retries} retries")
+        return outputs
@@ -0,0 +1,70 @@
+"""Simulate the early stopping of gen_judgment.py --adaptive on synthetic verdicts.
+
+Every model beats the baseline in each game with a fixed probability. The
+CI check of judge_adaptively is replayed on the verdicts in order, and the
+number of questions each model needed is reported. Models that win or
+lose every game must stop at the first check.
+
+Usage (from the repository root):
+python -m benchmark.bench_adaptive --num-questions 500 --target-ci-width 5
+"""
+import argparse
+import random
+
+from gen_judgment import get_win_rate_ci
+
+WIN_PROBABILITIES = [0.0, 0.05, 0.3, 0.5, 0.7, 0.95, 1.0]
+
+
+def make_verdicts(model, win_probability, num_questions, seed=0):
+    """Two games per question; the baseline is assistant A in game 1 and B in game 2."""
+    rng = random.Random(f"{seed}-{model}")
+    verdicts = []
+    for q in range(num_questions):
+        for game in range(2):
+            wins = rng.random() < win_probability
+            strong = rng.random() < 0.3
+            if game == 0:
+                score = ("B>>A" if strong else "B>A") if wins else ("A>>B" if strong else "A>B")
+            else:
+                score = ("A>>B" if strong else "A>B") if wins else ("B>>A" if strong else "B>A")
+            verdicts.append({"question_id": f"q{q:05d}", "model": model, "game": game, "score": score})
+    return verdicts
+
+
+def questions_needed(verdicts, model, baseline, num_questions, target_width, min_questions, check_every, num_round, seed):
+    """Questions judged when the model stops, and its last CI."""
+    judged, ci = min_questions, None
+    while True:
+        ci = get_win_rate_ci(verdicts[:2 * judged], model, baseline, num_round, seed)
+        if (ci is not None and ci[2] - ci[1] <= target_width) or judged >= num_questions:
+            return judged, ci
+        judged = min(judged + check_every, num_questions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-questions", type=int, default=500)
+    parser.add_argument("--target-ci-width", type=float, default=5.0)
+    parser.add_argument("--min-questions", type=int, default=50)
+    parser.add_argument("--check-every", type=int, default=25)
+    parser.add_argument("--num-rounds", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    baseline = "baseline"
+    total = 0
+    for i, win_probability in enumerate(WIN_PROBABILITIES):
+        model = f"model-{i}"
+        verdicts = make_verdicts(model, win_probability, args.num_questions)
+        judged, ci = questions_needed(verdicts, model, baseline, args.num_questions, args.target_ci_width,
+                                      args.min_questions, args.check_every, args.num_rounds, args.seed)
+        total += judged
+        print(f"win probability {win_probability:.2f}: stopped after {judged} questions, "
+              f"win rate {ci[0]:.1f} (95% CI {ci[1]:.1f} - {ci[2]:.1f})")
+        # a one-sided record of 2 * min_questions games has an exact CI this wide
+        one_sided_width = 100 * (1 - 0.025 ** (1 / (2 * args.min_questions)))
+        if win_probability in (0.0, 1.0) and one_sided_width <= args.target_ci_width:
+            assert judged == args.min_questions, f"{model} won or lost every game but did not stop at the first check"
+    print(f"{total} of {args.num_questions * len(WIN_PROBABILITIES)} questions judged "
+          f"({1 - total / (args.num_questions * len(WIN_PROBABILITIES)):.1%} saved)")
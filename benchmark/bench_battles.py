@@ -0,0 +1,94 @@
+"""Compare the row-wise and columnar battle builders of show_result.py.
+
+Usage (from the repository root):
+python -m benchmark.bench_battles --num-models 20 --num-questions 500
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+from glob import glob
+
+from show_result import get_battles_from_judgment
+
+VERDICTS = ["A>>B", "A>B", "A=B", "B>A", "B>>A", None]
+
+
+def legacy_get_battles_from_judgment(judge_name, first_game_only=False, WEIGHT=3):
+    """The original iterrows + pd.concat implementation, kept for reference."""
+    arena_hard_battles = pd.DataFrame()
+    directory = f"data/arena-hard-v0.1/model_judgment/{judge_name}"
+    for file in glob(f"{directory}/*jsonl"):
+        df = pd.read_json(file, lines=True, dtype={"question_id": str})
+        for _, row in df.iterrows():
+            for game_idx, swap in ((0, False), (1, True)):
+                if game_idx == 1 and first_game_only:
+                    break
+                output = {"question_id": row["question_id"], "model_a": "gpt-4-0314", "model_b": row["model"]}
+                score = row["games"][game_idx]["score"]
+                a_wins, b_wins = ("model_b", "model_a") if swap else ("model_a", "model_b")
+                weight = 1
+                if score == "A=B":
+                    output["winner"] = "tie"
+                elif score == "A>B":
+                    output["winner"] = a_wins
+                elif score == "A>>B":
+                    output["winner"] = a_wins
+                    weight = WEIGHT
+                elif score == "B>A":
+                    output["winner"] = b_wins
+                elif score == "B>>A":
+                    output["winner"] = b_wins
+                    weight = WEIGHT
+                else:
+                    weight = 0
+                if weight:
+                    arena_hard_battles = pd.concat([arena_hard_battles, pd.DataFrame([output] * weight)])
+    return arena_hard_battles
+
+
+def make_judgments(root, judge_name, num_models, num_questions, seed=0):
+    rng = random.Random(seed)
+    directory = os.path.join(root, "data", "arena-hard-v0.1", "model_judgment", judge_name)
+    os.makedirs(directory, exist_ok=True)
+    for m in range(num_models):
+        model = f"model-{m}"
+        with open(os.path.join(directory, f"{model}.jsonl"), "w") as fout:
+            for q in range(num_questions):
+                games = [{"user_prompt": "", "judgment": "", "score": rng.choice(VERDICTS)} for _ in range(2)]
+                fout.write(json.dumps({"question_id": f"q{q:05d}", "model": model, "judge": judge_name, "games": games}) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-models", type=int, default=10)
+    parser.add_argument("--num-questions", type=int, default=200)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    judge_name = "bench-judge"
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        make_judgments(root, judge_name, args.num_models, args.num_questions)
+        os.chdir(root)
+        try:
+            tic = time.perf_counter()
+            battles = get_battles_from_judgment(judge_name)
+            columnar = time.perf_counter() - tic
+            print(f"columnar: {len(battles)} battles in {columnar:.3f}s")
+
+            if not args.skip_legacy:
+                tic = time.perf_counter()
+                legacy = legacy_get_battles_from_judgment(judge_name)
+                elapsed = time.perf_counter() - tic
+                print(f"legacy:   {len(legacy)} battles in {elapsed:.3f}s ({elapsed / columnar:.1f}x slower)")
+                pd.testing.assert_frame_equal(
+                    battles.reset_index(drop=True), legacy.reset_index(drop=True), check_dtype=False
+                )
+                print("battle tables are identical")
+        finally:
+            os.chdir(cwd)
@@ -0,0 +1,90 @@
+"""Compare the thread and asyncio engines of gen_answer.py against a mock server.
+
+Reports both against the latency-bound time, ceil(questions / parallel) *
+latency, and fails if the async engine is more than --max-async-ratio
+times slower than the thread engine.
+
+Usage (from the repository root):
+python -m benchmark.bench_gen_answer --num-questions 2000 --parallel 512
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import urllib.request
+
+from benchmark.mock_openai_server import run_server
+from gen_answer import generate_answers, generate_answers_async
+from utils import load_model_answers
+
+
+def start_server(port, latency):
+    """Run the mock server in its own process so it does not share the GIL with the client."""
+    process = multiprocessing.Process(target=run_server, kwargs={"port": port, "latency": latency}, daemon=True)
+    process.start()
+    time.sleep(1)
+    return process
+
+
+def get_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats") as response:
+        return json.loads(response.read())
+
+
+def run(engine, pending, endpoint_info, settings, answer_file):
+    jobs = [(question, max_tokens, "mock-model", endpoint_info, answer_file) for question, max_tokens in pending]
+    tic = time.perf_counter()
+    if engine == "async":
+        asyncio.run(generate_answers_async(jobs, settings))
+    else:
+        generate_answers(jobs, settings)
+    return time.perf_counter() - tic
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-questions", type=int, default=1000)
+    parser.add_argument("--parallel", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=8019)
+    parser.add_argument("--max-async-ratio", type=float, default=1.0,
+                        help="fail when the async engine takes longer than this many times the thread engine")
+    args = parser.parse_args()
+
+    start_server(args.port, args.latency)
+    endpoint_info = {
+        "model_name": "mock-model",
+        "endpoints": [{"api_base": f"http://127.0.0.1:{args.port}/v1", "api_key": "token-abc123"}],
+        "api_type": "openai",
+        "parallel": args.parallel,
+    }
+    settings = {"num_choices": 1, "temperature": 0.0, "max_tokens": 16}
+    questions = [
+        {"question_id": f"q{i:06d}", "category": "arena-hard-v0.1", "turns": [{"content": f"question {i}"}]}
+        for i in range(args.num_questions)
+    ]
+    pending = [(question, settings["max_tokens"]) for question in questions]
+
+    elapsed = {}
+    with tempfile.TemporaryDirectory() as root:
+        for engine in ("thread", "async"):
+            answer_file = os.path.join(root, engine, "mock-model.jsonl")
+            before = get_stats(args.port)
+            elapsed[engine] = run(engine, pending, endpoint_info, settings, answer_file)
+            after = get_stats(args.port)
+            answers = load_model_answers(os.path.dirname(answer_file))["mock-model"]
+            assert len(answers) == args.num_questions
+            print(
+                f"{engine:>6}: {args.num_questions} answers in {elapsed[engine]:.2f}s "
+                f"({args.num_questions / elapsed[engine]:.0f} req/s, peak in-flight {after['max_in_flight']}, "
+                f"{after['num_connections'] - before['num_connections']} connections for "
+                f"{after['num_requests'] - before['num_requests']} requests)"
+            )
+
+    latency_bound = -(-args.num_questions // args.parallel) * args.latency
+    ratio = elapsed["async"] / elapsed["thread"]
+    print(f"latency bound {latency_bound:.2f}s, async / thread time {ratio:.2f}")
+    assert ratio <= args.max_async_ratio, f"async engine is {ratio:.2f}x the thread engine's time (limit {args.max_async_ratio})"
@@ -0,0 +1,101 @@
+"""Compare fixed `parallel` throttling with the adaptive rate limiter on a simulated endpoint.
+
+The simulated endpoint serves up to --capacity concurrent requests with a fixed
+latency and answers anything beyond that with a 429 carrying Retry-After.
+
+Usage (from the repository root):
+python -m benchmark.bench_rate_limiter --num-requests 2000 --capacity 16
+"""
+import argparse
+import concurrent.futures
+import threading
+import time
+
+from rate_limiter import AdaptiveRateLimiter
+
+
+class SimulatedRateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("simulated 429")
+        self.response = type("Response", (), {"headers": {"retry-after": str(retry_after)}})()
+
+
+class SimulatedEndpoint:
+    def __init__(self, capacity, latency, retry_after):
+        self.capacity = capacity
+        self.latency = latency
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.num_429 = 0
+        self._lock = threading.Lock()
+
+    def call(self):
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.num_429 += 1
+                raise SimulatedRateLimitError(self.retry_after)
+            self.in_flight += 1
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+
+
+def run_fixed(endpoint, num_requests, parallel, retry_sleep):
+    """Today's behavior: `parallel` threads, fixed sleep after every 429."""
+    def task():
+        while True:
+            try:
+                endpoint.call()
+                return
+            except SimulatedRateLimitError:
+                time.sleep(retry_sleep)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        list(executor.map(lambda _: task(), range(num_requests)))
+
+
+def run_adaptive(endpoint, num_requests, parallel, limiter):
+    def task():
+        while True:
+            try:
+                with limiter.request():
+                    endpoint.call()
+                return
+            except SimulatedRateLimitError as e:
+                time.sleep(limiter.retry_delay(e))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        list(executor.map(lambda _: task(), range(num_requests)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-requests", type=int, default=1000)
+    parser.add_argument("--capacity", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--retry-sleep", type=float, default=1.0, help="stand-in for API_RETRY_SLEEP")
+    parser.add_argument("--parallel", type=int, nargs="+", default=[4, 64])
+    args = parser.parse_args()
+
+    ideal = args.capacity / args.latency
+    print(f"endpoint capacity: {args.capacity} concurrent, {ideal:.0f} req/s at best")
+    for parallel in args.parallel:
+        endpoint = SimulatedEndpoint(args.capacity, args.latency, args.retry_after)
+        tic = time.perf_counter()
+        run_fixed(endpoint, args.num_requests, parallel, args.retry_sleep)
+        elapsed = time.perf_counter() - tic
+        print(f"fixed    parallel={parallel:<4}: {args.num_requests / elapsed:6.0f} req/s, {endpoint.num_429} 429s")
+
+    for parallel in args.parallel:
+        endpoint = SimulatedEndpoint(args.capacity, args.latency, args.retry_after)
+        limiter = AdaptiveRateLimiter(max_concurrency=parallel, backoff=args.retry_after)
+        tic = time.perf_counter()
+        run_adaptive(endpoint, args.num_requests, parallel, limiter)
+        elapsed = time.perf_counter() - tic
+        print(
+            f"adaptive parallel={parallel:<4}: {args.num_requests / elapsed:6.0f} req/s, {endpoint.num_429} 429s, "
+            f"final concurrency {limiter.concurrency:.1f}"
+        )
@@ -0,0 +1,75 @@
+"""Compare answering a model_list one model at a time with the single-pass scheduler of gen_answer.py.
+
+Every model gets its own mock endpoint, with latencies spread between
+--min-latency and --max-latency, so the sequential run pays the sum of the
+per-model times while the single pass should take about as long as the
+slowest model.
+
+Usage (from the repository root):
+python -m benchmark.bench_scheduler --num-models 10 --num-questions 200
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmark.mock_openai_server import run_server
+from gen_answer import generate_answers, interleave_jobs
+from utils import load_model_answers
+
+
+def start_servers(ports, latencies):
+    for port, latency in zip(ports, latencies):
+        multiprocessing.Process(target=run_server, kwargs={"port": port, "latency": latency}, daemon=True).start()
+    time.sleep(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-models", type=int, default=10)
+    parser.add_argument("--num-questions", type=int, default=200)
+    parser.add_argument("--parallel", type=int, default=16)
+    parser.add_argument("--min-latency", type=float, default=0.05)
+    parser.add_argument("--max-latency", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=8100, help="first port, one per model")
+    args = parser.parse_args()
+
+    ports = [args.port + i for i in range(args.num_models)]
+    step = (args.max_latency - args.min_latency) / max(1, args.num_models - 1)
+    start_servers(ports, [args.min_latency + i * step for i in range(args.num_models)])
+
+    endpoint_list = {
+        f"mock-model-{i}": {
+            "model_name": f"mock-model-{i}",
+            "endpoints": [{"api_base": f"http://127.0.0.1:{port}/v1", "api_key": "token-abc123"}],
+            "api_type": "openai",
+            "parallel": args.parallel,
+        }
+        for i, port in enumerate(ports)
+    }
+    settings = {"num_choices": 1, "temperature": 0.0, "max_tokens": 16}
+    questions = [
+        {"question_id": f"q{i:06d}", "category": "arena-hard-v0.1", "turns": [{"content": f"question {i}"}]}
+        for i in range(args.num_questions)
+    ]
+    pending = {model: [(question, settings["max_tokens"]) for question in questions] for model in endpoint_list}
+
+    with tempfile.TemporaryDirectory() as root:
+        for mode in ("sequential", "single-pass"):
+            answer_dir = os.path.join(root, mode)
+            answer_files = {model: os.path.join(answer_dir, f"{model}.jsonl") for model in endpoint_list}
+            tic = time.perf_counter()
+            if mode == "sequential":
+                per_model = []
+                for model in endpoint_list:
+                    started = time.perf_counter()
+                    generate_answers(interleave_jobs({model: pending[model]}, endpoint_list, answer_files), settings)
+                    per_model.append(time.perf_counter() - started)
+            else:
+                generate_answers(interleave_jobs(pending, endpoint_list, answer_files), settings)
+            elapsed = time.perf_counter() - tic
+            answers = load_model_answers(answer_dir)
+            assert all(len(answers[model]) == args.num_questions for model in endpoint_list)
+            print(f"{mode:>11}: {args.num_models} models x {args.num_questions} questions in {elapsed:.2f}s")
+        print(f"slowest single model: {max(per_model):.2f}s")
@@ -0,0 +1,75 @@
+"""Measure what a second_game policy would change on judgments that have both games.
+
+Drops the swapped game wherever the policy would have skipped it, then
+compares the judge calls saved and the resulting leaderboard against the
+full judgments.
+
+Usage (from the repository root):
+python -m benchmark.bench_second_game --judge-name gpt-4-1106-preview --policy skip_strong
+python -m benchmark.bench_second_game --judge-name gpt-4-1106-preview --policy sample --fraction 0.3
+"""
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from gen_judgment import STRONG_VERDICTS
+from show_result import get_battles_from_verdicts, get_bootstrap_result_batched, get_bootstrap_win_rates, get_position_consistency, load_judgment_verdicts
+
+
+def apply_policy(verdicts, policy, fraction=0.5):
+    """Verdicts without the game 2 rows the policy would not have played."""
+    first = verdicts[verdicts["game"] == 0].set_index(["question_id", "model"])["score"]
+    if policy == "skip_strong":
+        skipped = first[first.isin(STRONG_VERDICTS)].index
+    else:
+        keys = [f"{question_id}/{model}".encode("utf-8") for question_id, model in first.index]
+        draws = np.array([int(hashlib.sha1(key).hexdigest()[:8], 16) / 16 ** 8 for key in keys])
+        skipped = first.index[draws >= fraction]
+    keys = pd.MultiIndex.from_frame(verdicts[["question_id", "model"]])
+    return verdicts[~((verdicts["game"] == 1).to_numpy() & keys.isin(skipped))]
+
+
+def get_leaderboard(verdicts, baseline, num_round, seed):
+    """Win rate against the baseline and CI width per model."""
+    battles = get_battles_from_verdicts(verdicts, baseline=baseline)
+    bootstrap = get_bootstrap_result_batched(battles, num_round, seed=seed)
+    win_rate = get_bootstrap_win_rates(bootstrap, baseline)
+    return pd.DataFrame({
+        "score": win_rate.median(),
+        "width": win_rate.quantile(0.975) - win_rate.quantile(0.025),
+    }).drop(index=baseline)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench-name", type=str, default="arena-hard-v0.1")
+    parser.add_argument("--judge-name", type=str, default="gpt-4-1106-preview")
+    parser.add_argument("--baseline", type=str, default="gpt-4-0314")
+    parser.add_argument("--policy", type=str, default="skip_strong", choices=["skip_strong", "sample"])
+    parser.add_argument("--fraction", type=float, default=0.5, help="second_game_fraction of the sample policy")
+    parser.add_argument("--num-rounds", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    directory = os.path.join("data", args.bench_name, "model_judgment", args.judge_name)
+    verdicts = load_judgment_verdicts(directory)
+    if verdicts.empty:
+        print(f"No judgments found in {directory}")
+        raise SystemExit
+    reduced = apply_policy(verdicts, args.policy, args.fraction)
+
+    rate, num_both, num_single = get_position_consistency(verdicts)
+    if rate is not None:
+        print(f"position consistency of the full judgments: {rate:.1%} of {num_both} judgments")
+    saved = 1 - len(reduced) / len(verdicts)
+    print(f"{args.policy}: {len(verdicts) - len(reduced)} of {len(verdicts)} games skipped ({saved:.1%} of judge calls)")
+
+    full = get_leaderboard(verdicts, args.baseline, args.num_rounds, args.seed)
+    policy = get_leaderboard(reduced, args.baseline, args.num_rounds, args.seed).reindex(full.index)
+    diff = (policy["score"] - full["score"]).abs()
+    print(f"rank correlation (Spearman): {full['score'].corr(policy['score'], method='spearman'):.4f}")
+    print(f"score change: mean {diff.mean():.2f}, max {diff.max():.2f} ({diff.idxmax()})")
+    print(f"CI width: {full['width'].mean():.2f} -> {policy['width'].mean():.2f} on average")
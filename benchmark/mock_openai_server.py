@@ -0,0 +1,147 @@
+"""A minimal OpenAI-compatible chat completion server for load tests.
+
+Every request to /v1/chat/completions is answered after a fixed delay, so
+the number of requests a client keeps in flight directly sets throughput.
+Requests with "stream": true get one server-sent event per word of the
+completion, token_delay seconds apart, after the same first-token delay,
+and a final usage chunk when stream_options asks for include_usage.
+GET /stats returns request, connection and peak in-flight counters.
+
+Usage (from the repository root):
+python -m benchmark.mock_openai_server --port 8019 --latency 0.5 --token-delay 0.01
+"""
+import argparse
+import asyncio
+import json
+import time
+
+
+class MockOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=8019, latency=0.5, completion="mock answer", token_delay=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.token_delay = token_delay
+        self.completion = completion
+        self.num_requests = 0
+        self.num_connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, reader, writer):
+        self.num_connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if request_line.startswith(b"GET /stats"):
+                    response = json.dumps(self.stats()).encode()
+                    writer.write(
+                        b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                        + f"Content-Length: {len(response)}\r\n\r\n".encode()
+                        + response
+                    )
+                    await writer.drain()
+                    continue
+
+                self.num_requests += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                await asyncio.sleep(self.latency)
+
+                payload = json.loads(body or b"{}")
+                if payload.get("stream"):
+                    await self.stream(writer, payload)
+                    self.in_flight -= 1
+                    continue
+                self.in_flight -= 1
+
+                response = json.dumps({
+                    "id": f"chatcmpl-{self.num_requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", "mock"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": self.completion},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+                }).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(response)}\r\n\r\n".encode()
+                    + response
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    def _chunk(self, payload, delta, finish_reason=None):
+        return json.dumps({
+            "id": f"chatcmpl-{self.num_requests}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        })
+
+    async def stream(self, writer, payload):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        words = self.completion.split(" ")
+        events = [self._chunk(payload, {"role": "assistant", "content": ""})]
+        events += [self._chunk(payload, {"content": word if i == 0 else " " + word}) for i, word in enumerate(words)]
+        events += [self._chunk(payload, {}, "stop")]
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            usage = {"prompt_tokens": 1, "completion_tokens": len(words), "total_tokens": 1 + len(words)}
+            events.append(json.dumps({**json.loads(events[-1]), "choices": [], "usage": usage}))
+        events.append("[DONE]")
+        for i, event in enumerate(events):
+            if 1 < i < len(words) + 1 and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            data = f"data: {event}\n\n".encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def stats(self):
+        stats = {
+            "num_requests": self.num_requests,
+            "num_connections": self.num_connections,
+            "max_in_flight": self.max_in_flight,
+        }
+        self.max_in_flight = self.in_flight
+        return stats
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+
+def run_server(host="127.0.0.1", port=8019, latency=0.5, token_delay=0.0):
+    asyncio.run(MockOpenAIServer(host, port, latency, token_delay=token_delay).serve())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8019)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed words")
+    args = parser.parse_args()
+
+    run_server(args.host, args.port, args.latency, args.token_delay)
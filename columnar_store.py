@@ -0,0 +1,280 @@
+"""Optional Parquet copy of the answer and judgment JSONL files.
+
+The JSONL files stay the source of truth. `import` converts a directory of
+per-model JSONL files into one Parquet file under data/<bench>/columnar/,
+`export` writes the JSONL layout back. Readers only touch the columns they
+ask for, the files are memory-mapped, and filters on `model` and
+`question_id` are pushed down to the row groups, so show_result.py and
+qa_browser.py start without parsing every line.
+
+Layout:
+data/<bench>/columnar/model_answer.parquet
+data/<bench>/columnar/model_judgment/<judge>.parquet
+
+Every file keeps the size and mtime of the JSONL files it was built from,
+and is rebuilt by sync_* when they change. Requires pyarrow
+(requirements-optional.txt).
+
+Usage:
+python columnar_store.py import --bench-name arena-hard-v0.1 --judge-name gpt-4-1106-preview
+python columnar_store.py export --bench-name arena-hard-v0.1 --output-dir exported
+"""
+import argparse
+import json
+import os
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from utils import LazyModelAnswers
+
+
+ROW_GROUP_SIZE = 4096
+SOURCES_KEY = b"arena_hard_sources"
+VERSION_KEY = b"arena_hard_version"
+# bumped when the columns change, so older stores are rebuilt
+STORE_VERSION = b"3"
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("the columnar store needs pyarrow: pip install -r requirements-optional.txt")
+    return pyarrow
+
+
+def get_store_dir(bench_name):
+    return os.path.join("data", bench_name, "columnar")
+
+
+def get_answer_store(bench_name):
+    return os.path.join(get_store_dir(bench_name), "model_answer.parquet")
+
+
+def get_judgment_store(bench_name, judge_name):
+    return os.path.join(get_store_dir(bench_name), "model_judgment", f"{judge_name}.parquet")
+
+
+def _source_files(source_dir):
+    return sorted(glob(os.path.join(source_dir, "*.jsonl")))
+
+
+def _source_stamps(source_dir):
+    stamps = {}
+    for filename in _source_files(source_dir):
+        stat = os.stat(filename)
+        stamps[os.path.basename(filename)] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def is_stale(path, source_dir):
+    """Whether the store at `path` is missing or older than the JSONL files in source_dir."""
+    if not os.path.exists(path):
+        return True
+    pa = _pyarrow()
+    metadata = pa.parquet.read_schema(path).metadata or {}
+    if SOURCES_KEY not in metadata or metadata.get(VERSION_KEY) != STORE_VERSION:
+        return True
+    return json.loads(metadata[SOURCES_KEY]) != _source_stamps(source_dir)
+
+
+def _answer_row(model, record):
+    return {
+        "model": model,
+        "question_id": record["question_id"],
+        "token_len": record["choices"][0]["turns"][0].get("token_len"),
+        "record": json.dumps(record, ensure_ascii=False),
+    }
+
+
+def _judgment_row(model, record):
+    games = record.get("games", [])
+    row = {"model": model, "question_id": record["question_id"], "judge": record.get("judge"), "num_games": len(games)}
+    for game in range(2):
+        row[f"score_{game + 1}"] = games[game].get("score") if game < len(games) else None
+        row[f"judgment_{game + 1}"] = games[game].get("judgment") if game < len(games) else None
+    row["record"] = json.dumps(record, ensure_ascii=False)
+    return row
+
+
+def _schema(pa, question_id, columns):
+    fields = [("model", pa.string()), ("question_id", pa.int64() if isinstance(question_id, int) else pa.string())]
+    fields += [(name, pa.int64() if name in ("token_len", "num_games") else pa.string()) for name in columns]
+    return pa.schema(fields)
+
+
+def _import(source_dir, path, make_row, columns, keep_duplicates=False):
+    """Convert every <model>.jsonl of source_dir into one Parquet file, one file at a time.
+
+    Answers keep the last line of a question, as load_model_answers does.
+    With keep_duplicates every line is kept, as the JSONL judgment readers
+    count every line as a judgment.
+    """
+    pa = _pyarrow()
+    stamps = _source_stamps(source_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    writer = None
+    try:
+        for filename in _source_files(source_dir):
+            model = os.path.basename(filename)[:-6]
+            rows = {}
+            with open(filename) as fin:
+                for i, line in enumerate(fin):
+                    if line.strip():
+                        record = json.loads(line)
+                        rows[i if keep_duplicates else record["question_id"]] = make_row(model, record)
+            if not rows:
+                continue
+            if writer is None:
+                schema = _schema(pa, next(iter(rows.values()))["question_id"], columns)
+                schema = schema.with_metadata({SOURCES_KEY: json.dumps(stamps).encode(), VERSION_KEY: STORE_VERSION})
+                writer = pa.parquet.ParquetWriter(tmp_path, schema)
+            # rows of one model stay together, so a filter on model skips whole row groups
+            writer.write_table(pa.Table.from_pylist(list(rows.values()), schema=schema), row_group_size=ROW_GROUP_SIZE)
+        if writer is None:
+            schema = _schema(pa, "", columns).with_metadata({SOURCES_KEY: json.dumps(stamps).encode(), VERSION_KEY: STORE_VERSION})
+            writer = pa.parquet.ParquetWriter(tmp_path, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_path, path)
+
+
+def import_answers(answer_dir, path):
+    _import(answer_dir, path, _answer_row, ["token_len", "record"])
+
+
+def import_judgments(judgment_dir, path):
+    _import(judgment_dir, path, _judgment_row,
+            ["judge", "num_games", "score_1", "score_2", "judgment_1", "judgment_2", "record"], keep_duplicates=True)
+
+
+def sync_answers(answer_dir, path):
+    """Rebuild the answer store if the JSONL files changed since it was built."""
+    if is_stale(path, answer_dir):
+        import_answers(answer_dir, path)
+
+
+def sync_judgments(judgment_dir, path):
+    if is_stale(path, judgment_dir):
+        import_judgments(judgment_dir, path)
+
+
+def read_table(path, columns=None, models=None, question_ids=None):
+    """Read selected columns, keeping only rows of the given models and question_ids."""
+    pa = _pyarrow()
+    filters = []
+    if models is not None:
+        filters.append(("model", "in", list(models)))
+    if question_ids is not None:
+        filters.append(("question_id", "in", list(question_ids)))
+    return pa.parquet.read_table(path, columns=columns, filters=filters or None, memory_map=True)
+
+
+def read_records(path, models=None, question_ids=None):
+    """Map model -> question_id -> original JSONL record, like load_model_answers."""
+    table = read_table(path, ["model", "question_id", "record"], models, question_ids)
+    records = {}
+    for model, question_id, record in zip(*(table.column(name).to_pylist() for name in table.column_names)):
+        records.setdefault(model, {})[question_id] = json.loads(record)
+    return records
+
+
+def _export(path, output_dir, models=None, ensure_ascii=True):
+    """Write every stored row back to its <model>.jsonl, in stored order."""
+    os.makedirs(output_dir, exist_ok=True)
+    table = read_table(path, ["model", "record"], models)
+    files = {}
+    try:
+        for model, record in zip(table.column("model").to_pylist(), table.column("record").to_pylist()):
+            if model not in files:
+                files[model] = open(os.path.join(output_dir, f"{model}.jsonl"), "w")
+            files[model].write(json.dumps(json.loads(record), ensure_ascii=ensure_ascii) + "\n")
+    finally:
+        for fout in files.values():
+            fout.close()
+
+
+def export_answers(path, answer_dir, models=None):
+    _export(path, answer_dir, models)
+
+
+def export_judgments(path, judgment_dir, models=None):
+    # gen_judgment.py writes judgments without escaping non-ASCII characters
+    _export(path, judgment_dir, models, ensure_ascii=False)
+
+
+def read_avg_token_len(path, models=None):
+    """Average first-turn token_len per model, reading only two columns."""
+    df = read_table(path, ["model", "token_len"], models).to_pandas()
+    return df.groupby("model")["token_len"].mean().to_dict()
+
+
+def read_verdicts(path, first_game_only=False, models=None):
+    """Same table as show_result.load_judgment_verdicts: question_id, model, game, score."""
+    score_columns = ["score_1"] if first_game_only else ["score_1", "score_2"]
+    df = read_table(path, ["question_id", "model", "num_games"] + score_columns, models).to_pandas()
+    # game 1 of a judgment directly before its game 2, as in the JSONL reader
+    rows = np.repeat(np.arange(len(df)), len(score_columns))
+    games = np.tile(np.arange(len(score_columns)), len(df))
+    # judgments made with a second_game policy may have game 1 only
+    played = games < df["num_games"].to_numpy()[rows]
+    rows, games = rows[played], games[played]
+    return pd.DataFrame({
+        "question_id": df["question_id"].to_numpy()[rows],
+        "model": df["model"].to_numpy()[rows],
+        "game": games,
+        "score": df[score_columns].to_numpy()[rows, games],
+    })
+
+
+def read_judgment_texts(path, models=None):
+    """question_id -> model -> [game 1 judgment, game 2 judgment], as qa_browser expects."""
+    table = read_table(path, ["question_id", "model", "judgment_1", "judgment_2"], models)
+    judge_dict = {}
+    for question_id, model, judgment_1, judgment_2 in zip(*(table.column(name).to_pylist() for name in table.column_names)):
+        judge_dict.setdefault(question_id, {})[model] = [judgment for judgment in (judgment_1, judgment_2) if judgment is not None]
+    return judge_dict
+
+
+class ColumnarModelAnswers(LazyModelAnswers):
+    """LazyModelAnswers backed by the answer store, loading one model per access."""
+
+    def __init__(self, path, max_models=8):
+        self.path = path
+        super().__init__(None, max_models=max_models)
+
+    def _list_models(self, models):
+        return sorted(set(read_table(self.path, ["model"], models).column("model").to_pylist()))
+
+    def _load(self, model_name):
+        return read_records(self.path, [model_name]).get(model_name, {})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("--bench-name", type=str, default="arena-hard-v0.1")
+    parser.add_argument("--judge-name", type=str, default=None, help="also convert this judge's judgments")
+    parser.add_argument("--output-dir", type=str, default=None, help="export: write the JSONL layout here")
+    args = parser.parse_args()
+
+    answer_dir = os.path.join("data", args.bench_name, "model_answer")
+    judgment_dir = os.path.join("data", args.bench_name, "model_judgment", args.judge_name or "")
+    if args.action == "import":
+        import_answers(answer_dir, get_answer_store(args.bench_name))
+        print(f"Wrote {get_answer_store(args.bench_name)}")
+        if args.judge_name:
+            import_judgments(judgment_dir, get_judgment_store(args.bench_name, args.judge_name))
+            print(f"Wrote {get_judgment_store(args.bench_name, args.judge_name)}")
+    else:
+        assert args.output_dir, "export needs --output-dir"
+        export_answers(get_answer_store(args.bench_name), os.path.join(args.output_dir, "model_answer"))
+        if args.judge_name:
+            export_judgments(get_judgment_store(args.bench_name, args.judge_name),
+                             os.path.join(args.output_dir, "model_judgment", args.judge_name))
+        print(f"Exported to {args.output_dir}")
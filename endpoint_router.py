@@ -0,0 +1,135 @@
+"""Request-time endpoint selection for models served by several endpoints.
+
+The `routing` key of an api_config.yaml entry picks the policy:
+- random: uniform choice, the previous behavior of get_endpoint
+- least_outstanding: the endpoint with the fewest requests in flight
+- ewma: the endpoint with the lowest latency moving average, scaled by its
+  requests in flight
+Endpoints that fail `eject_after` times in a row (connection errors,
+timeouts, 429 and 5xx responses) are skipped for `eject_seconds`.
+"""
+import contextlib
+import random
+import threading
+import time
+
+
+ROUTING_POLICIES = ("random", "least_outstanding", "ewma")
+
+
+def is_endpoint_error(e):
+    """Whether a failure says something about the endpoint rather than the request."""
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(e).__name__
+    return "Connection" in name or "Timeout" in name
+
+
+class EndpointRouter:
+    def __init__(self, endpoints, policy="least_outstanding", eject_after=3, eject_seconds=30, alpha=0.3):
+        assert policy in ROUTING_POLICIES, f"unknown routing policy {policy}"
+        # a null endpoint list means the SDK defaults (e.g. OPENAI_API_KEY)
+        self.endpoints = list(endpoints) if endpoints else [None]
+        self.policy = policy
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.alpha = alpha
+
+        n = len(self.endpoints)
+        self.outstanding = [0] * n
+        self.latency = [None] * n
+        self.failures = [0] * n
+        self.ejected_until = [0.0] * n
+        self.requests = [0] * n
+        self._lock = threading.Lock()
+
+    def _score(self, i):
+        if self.policy == "ewma":
+            # unmeasured endpoints are tried first
+            return (self.latency[i] or 0.0) * (self.outstanding[i] + 1)
+        return self.outstanding[i]
+
+    def _pick(self):
+        now = time.monotonic()
+        candidates = [i for i in range(len(self.endpoints)) if self.ejected_until[i] <= now]
+        if not candidates:
+            # everything is ejected: use the endpoint that comes back first
+            return min(range(len(self.endpoints)), key=lambda i: self.ejected_until[i])
+        if self.policy == "random":
+            return random.choice(candidates)
+        best = min(self._score(i) for i in candidates)
+        return random.choice([i for i in candidates if self._score(i) == best])
+
+    def acquire(self):
+        with self._lock:
+            i = self._pick()
+            self.outstanding[i] += 1
+            self.requests[i] += 1
+        return i
+
+    def release(self, i, latency=None, error=False):
+        with self._lock:
+            self.outstanding[i] -= 1
+            if error:
+                self.failures[i] += 1
+                if self.failures[i] >= self.eject_after:
+                    self.ejected_until[i] = time.monotonic() + self.eject_seconds
+                    self.failures[i] = 0
+            else:
+                self.failures[i] = 0
+                if latency is not None:
+                    if self.latency[i] is None:
+                        self.latency[i] = latency
+                    else:
+                        self.latency[i] = (1 - self.alpha) * self.latency[i] + self.alpha * latency
+
+    @contextlib.contextmanager
+    def request(self):
+        """Pick an endpoint for one attempt and record how it went."""
+        i = self.acquire()
+        started = time.monotonic()
+        try:
+            yield self.endpoints[i]
+        except Exception as e:
+            self.release(i, error=is_endpoint_error(e))
+            raise
+        self.release(i, latency=time.monotonic() - started)
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "api_base": (endpoint or {}).get("api_base"),
+                    "requests": self.requests[i],
+                    "outstanding": self.outstanding[i],
+                    "ewma_latency": self.latency[i],
+                    "ejected": self.ejected_until[i] > time.monotonic(),
+                }
+                for i, endpoint in enumerate(self.endpoints)
+            ]
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_endpoint_router(endpoint_info):
+    """Shared router for an api_config.yaml entry."""
+    key = (endpoint_info["model_name"], endpoint_info.get("api_type"))
+    with _routers_lock:
+        if key not in _routers:
+            _routers[key] = EndpointRouter(
+                endpoint_info.get("endpoints"),
+                policy=endpoint_info.get("routing", "least_outstanding"),
+                eject_after=endpoint_info.get("eject_after", 3),
+                eject_seconds=endpoint_info.get("eject_seconds", 30),
+            )
+        return _routers[key]
+
+
+def route(router, api_dict=None):
+    """Context manager yielding the endpoint of one attempt, api_dict itself when there is no router."""
+    if router is None:
+        return contextlib.nullcontext(api_dict)
+    return router.request()
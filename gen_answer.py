@@ -4,58 +4,100 @@ Usage:
 python gen_api_answer --parallel 32
 """
 import argparse
-import json
+import asyncio
 import os
 import time
 import concurrent.futures
 
-import tiktoken
 import shortuuid
 import tqdm
 
 from utils import (
     load_questions,
-    load_model_answers,
     make_config,
-    get_endpoint,
     chat_completion_openai,
     chat_completion_anthropic,
     chat_completion_openai_azure,
     chat_completion_mistral,
     http_completion_gemini,
     chat_completion_cohere,
-    reorg_answer_file,
+    async_chat_completion_openai,
+    async_chat_completion_anthropic,
+    close_async_clients,
+    get_client_stats,
     OPENAI_MODEL_LIST,
     temperature_config,
 )
+from batch_api import BatchRunner, get_batch_backend, make_request
+from endpoint_router import get_endpoint_router
+from jsonl_writer import close_writer, close_writers, get_writer, load_completed_keys
+from rate_limiter import get_rate_limiter
+from response_cache import ResponseCache, get_response_cache, set_response_cache
+from tokenizer_service import count_tokens_batch, get_prompt_token_counts, set_cache_dir
+
+
+def get_conv_prefix(model: str, endpoint_info: dict):
+    conv = []
+
+    if "system_prompt" in endpoint_info.keys():
+        conv.append({"role": "system", "content": endpoint_info["system_prompt"]})
+    elif model in OPENAI_MODEL_LIST:
+        conv.append({"role": "system", "content": "You are a helpful assistant."})
+    return conv
+
+
+def add_token_len(choices: list):
+    """Fill in token_len of every turn with one batched encode."""
+    turns = [turn for choice in choices for turn in choice["turns"]]
+    for turn, count in zip(turns, count_tokens_batch([turn["content"] for turn in turns])):
+        turn["token_len"] = count
+
+
+def dump_answer(question: dict, model: str, choices: list, answer_file: str, latency: list = None):
+    ans = {
+        "question_id": question["question_id"],
+        "answer_id": shortuuid.uuid(),
+        "model_id": model,
+        "choices": choices,
+        "tstamp": time.time(),
+    }
+    if latency:
+        # one entry per streamed call: ttft, inter_token_latency, output_tokens, tokens_per_sec, latency,
+        # or cached=True for a call served from the response cache
+        ans["latency"] = latency
+
+    # a single writer thread per file appends, so concurrent workers never interleave lines
+    get_writer(answer_file).write(ans)
 
 
 def get_answer(
-    question: dict, model: str, endpoint_info: dict, num_choices: int, max_tokens: int, temperature: float, answer_file: str, api_dict: dict
+    question: dict, model: str, endpoint_info: dict, num_choices: int, max_tokens: int, temperature: float, answer_file: str, stream: bool = False
 ):
     if question["category"] in temperature_config:
         temperature = temperature_config[question["category"]]
 
     api_type = endpoint_info["api_type"]
+    limiter = get_rate_limiter(endpoint_info)
+    router = get_endpoint_router(endpoint_info)
 
-    conv = []
+    conv = get_conv_prefix(model, endpoint_info)
 
-    if "system_prompt" in endpoint_info.keys():
-        conv.append({"role": "system", "content": endpoint_info["system_prompt"]})
-    elif model in OPENAI_MODEL_LIST:
-        conv.append({"role": "system", "content": "You are a helpful assistant."})
-
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
     choices = []
+    latency = []
     for i in range(num_choices):
         turns = []
         for j in range(len(question["turns"])):
             conv.append({"role": "user", "content": question["turns"][j]["content"]})
+            metrics = {}
             if api_type == "anthropic":
                 output = chat_completion_anthropic(model=endpoint_info["model_name"],
                                                    messages=conv,
                                                    temperature=temperature,
-                                                   max_tokens=max_tokens)
+                                                   max_tokens=max_tokens,
+                                                   limiter=limiter,
+                                                   router=router,
+                                                   stream=stream,
+                                                   metrics=metrics)
             elif api_type == "mistral":
                 output = chat_completion_mistral(model=endpoint_info["model_name"],
                                                  messages=conv,
@@ -71,7 +113,10 @@ def get_answer(
                                                       messages=conv,
                                                       temperature=temperature,
                                                       max_tokens=max_tokens,
-                                                      api_dict=api_dict)
+                                                      limiter=limiter,
+                                                      router=router,
+                                                      stream=stream,
+                                                      metrics=metrics)
             elif api_type == "cohere":
                 output = chat_completion_cohere(model=endpoint_info["model_name"],
                                                 messages=conv,
@@ -82,24 +127,288 @@ def get_answer(
                                                 messages=conv, 
                                                 temperature=temperature, 
                                                 max_tokens=max_tokens, 
-                                                api_dict=api_dict)
+                                                limiter=limiter,
+                                                router=router,
+                                                stream=stream,
+                                                metrics=metrics)
             conv.append({"role": "assistant", "content": output})
+            if metrics:
+                latency.append({"choice": i, "turn": j, **metrics})
 
-            turns.append({"content": output, "token_len": len(encoding.encode(output))})
+            turns.append({"content": output})
         choices.append({"index": i, "turns": turns})
 
-    # Dump answers
-    ans = {
-        "question_id": question["question_id"],
-        "answer_id": shortuuid.uuid(),
-        "model_id": model,
-        "choices": choices,
-        "tstamp": time.time(),
-    }
+    add_token_len(choices)
+    dump_answer(question, model, choices, answer_file, latency)
+
+
+async def get_answer_async(
+    question: dict, model: str, endpoint_info: dict, num_choices: int, max_tokens: int, temperature: float, answer_file: str, semaphore: asyncio.Semaphore, stream: bool = False
+):
+    """Asyncio counterpart of get_answer.
+
+    OpenAI-compatible, Azure and Anthropic endpoints use the shared async
+    clients; the remaining api types run their blocking helper in a thread.
+    """
+    if question["category"] in temperature_config:
+        temperature = temperature_config[question["category"]]
+
+    api_type = endpoint_info["api_type"]
+    max_connections = endpoint_info.get("parallel", 1)
+    limiter = get_rate_limiter(endpoint_info)
+    router = get_endpoint_router(endpoint_info)
+
+    conv = get_conv_prefix(model, endpoint_info)
+
+    choices = []
+    latency = []
+    async with semaphore:
+        for i in range(num_choices):
+            turns = []
+            for j in range(len(question["turns"])):
+                conv.append({"role": "user", "content": question["turns"][j]["content"]})
+                metrics = {}
+                if api_type == "anthropic":
+                    output = await async_chat_completion_anthropic(model=endpoint_info["model_name"],
+                                                                   messages=conv,
+                                                                   temperature=temperature,
+                                                                   max_tokens=max_tokens,
+                                                                   max_connections=max_connections,
+                                                                   limiter=limiter,
+                                                                   router=router,
+                                                                   stream=stream,
+                                                                   metrics=metrics)
+                elif api_type == "mistral":
+                    output = await asyncio.to_thread(chat_completion_mistral,
+                                                     model=endpoint_info["model_name"],
+                                                     messages=conv,
+                                                     temperature=temperature,
+                                                     max_tokens=max_tokens)
+                elif api_type == "gemini":
+                    output = await asyncio.to_thread(http_completion_gemini,
+                                                     model=endpoint_info["model_name"],
+                                                     message=question["turns"][j]["content"],
+                                                     temperature=temperature,
+                                                     max_tokens=max_tokens)
+                elif api_type == "cohere":
+                    output = await asyncio.to_thread(chat_completion_cohere,
+                                                     model=endpoint_info["model_name"],
+                                                     messages=conv,
+                                                     temperature=temperature,
+                                                     max_tokens=max_tokens)
+                else:
+                    output = await async_chat_completion_openai(model=endpoint_info["model_name"],
+                                                                messages=conv,
+                                                                temperature=temperature,
+                                                                max_tokens=max_tokens,
+                                                                api_type=api_type,
+                                                                max_connections=max_connections,
+                                                                limiter=limiter,
+                                                                router=router,
+                                                                stream=stream,
+                                                                metrics=metrics)
+                conv.append({"role": "assistant", "content": output})
+                if metrics:
+                    latency.append({"choice": i, "turn": j, **metrics})
+
+                turns.append({"content": output})
+            choices.append({"index": i, "turns": turns})
+
+    add_token_len(choices)
+    dump_answer(question, model, choices, answer_file, latency)
+
+
+def get_max_tokens(questions: list, model: str, endpoint_info: dict, settings: dict):
+    # We want to maximizes the number of tokens generate per answer: max_tokens = specified token # - input tokens #
+    if "tokenizer" in endpoint_info:
+        question_list = [question["turns"][0]["content"] for question in questions]
+        if model in OPENAI_MODEL_LIST:
+            counts = get_prompt_token_counts(question_list, endpoint_info["model_name"], kind="tiktoken")
+            max_tokens = [(settings["max_tokens"] - count - 100) for count in counts]
+        else:
+            counts = get_prompt_token_counts(question_list, endpoint_info["tokenizer"], kind="hf")
+            max_tokens = [(settings["max_tokens"] - count - 300) for count in counts]
+    else:
+        max_tokens = [settings["max_tokens"]] * len(questions)
+    return max_tokens
+
+
+def get_pending_questions(questions: list, model: str, existing_answer: dict, max_tokens: list):
+    """Questions of a model that still need an answer, paired with their max_tokens."""
+    pending = []
+    count = 0
+    for index, question in enumerate(questions):
+        if model in existing_answer and question["question_id"] in existing_answer[model]:
+            count += 1
+            continue
+        pending.append((question, max_tokens[index]))
+    if count > 0:
+        print(f"{model}: {count} number of existing answers")
+    return pending
+
+
+def interleave_jobs(pending: dict, endpoint_list: dict, answer_files: dict):
+    """Round-robin the pending questions of every model into one list of jobs.
 
-    os.makedirs(os.path.dirname(answer_file), exist_ok=True)
-    with open(answer_file, "a") as fout:
-        fout.write(json.dumps(ans) + "\n")
+    pending maps a model to its (question, max_tokens) pairs; each job is
+    (question, max_tokens, model, endpoint_info, answer_file).
+    """
+    jobs = []
+    queues = {model: iter(items) for model, items in pending.items()}
+    while queues:
+        for model in list(queues):
+            item = next(queues[model], None)
+            if item is None:
+                del queues[model]
+                continue
+            jobs.append((*item, model, endpoint_list[model], answer_files[model]))
+    return jobs
+
+
+def get_endpoint_key(endpoint_info: dict):
+    # models served by the same deployment share one concurrency limit, like the rate limiter
+    return (endpoint_info["model_name"], endpoint_info.get("api_type"))
+
+
+class JobProgress:
+    """One progress bar over all models; closes a model's answer file as soon as its last job is done."""
+
+    def __init__(self, jobs: list):
+        self.remaining = {}
+        for job in jobs:
+            self.remaining[job[4]] = self.remaining.get(job[4], 0) + 1
+        self.bar = tqdm.tqdm(total=len(jobs))
+
+    def done(self, job):
+        answer_file = job[4]
+        self.remaining[answer_file] -= 1
+        if self.remaining[answer_file] == 0:
+            close_writer(answer_file)
+            self.bar.set_postfix_str(f"finished {job[2]}")
+        self.bar.update()
+
+    def close(self):
+        self.bar.close()
+
+
+def generate_answers(jobs: list, settings: dict):
+    """Run the jobs of all models at once, with one thread pool of `parallel` workers per endpoint."""
+    executors = {}
+    futures = {}
+    progress = JobProgress(jobs)
+    try:
+        for job in jobs:
+            question, max_tokens, model, endpoint_info, answer_file = job
+            key = get_endpoint_key(endpoint_info)
+            if key not in executors:
+                executors[key] = concurrent.futures.ThreadPoolExecutor(max_workers=endpoint_info.get("parallel", 1))
+            future = executors[key].submit(
+                get_answer,
+                question,
+                model,
+                endpoint_info,
+                settings["num_choices"],
+                max_tokens,
+                settings["temperature"],
+                answer_file,
+                settings.get("stream", False),
+            )
+            futures[future] = job
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+            progress.done(futures[future])
+    finally:
+        for executor in executors.values():
+            executor.shutdown(cancel_futures=True)
+        progress.close()
+
+
+async def generate_answers_async(jobs: list, settings: dict):
+    semaphores = {}
+    progress = JobProgress(jobs)
+
+    async def run(job):
+        question, max_tokens, model, endpoint_info, answer_file = job
+        key = get_endpoint_key(endpoint_info)
+        if key not in semaphores:
+            semaphores[key] = asyncio.Semaphore(endpoint_info.get("parallel", 1))
+        await get_answer_async(
+            question,
+            model,
+            endpoint_info,
+            settings["num_choices"],
+            max_tokens,
+            settings["temperature"],
+            answer_file,
+            semaphores[key],
+            settings.get("stream", False),
+        )
+        return job
+
+    try:
+        for task in asyncio.as_completed([run(job) for job in jobs]):
+            progress.done(await task)
+    finally:
+        progress.close()
+        await close_async_clients()
+
+
+def answer_in_batches(jobs: list, settings: dict, runner: BatchRunner):
+    """Batch mode for one model: round j sends turn j of every choice of every question.
+
+    Questions with a call that failed on every retry are not written, so the
+    next run answers them again.
+    """
+    calls = []
+    for job in jobs:
+        question, max_tokens, model, endpoint_info, answer_file = job
+        temperature = temperature_config.get(question["category"], settings["temperature"])
+        for i in range(settings["num_choices"]):
+            calls.append({"job": job, "choice": i, "temperature": temperature, "conv": get_conv_prefix(model, endpoint_info), "turns": []})
+
+    for j in range(max(len(job[0]["turns"]) for job in jobs)):
+        active = [call for call in calls if call["turns"] is not None and j < len(call["job"][0]["turns"])]
+        requests = []
+        for call in active:
+            question, max_tokens, model, endpoint_info, answer_file = call["job"]
+            call["conv"].append({"role": "user", "content": question["turns"][j]["content"]})
+            custom_id = f"{question['question_id']}/choice-{call['choice']}/turn-{j}"
+            requests.append(make_request(custom_id, endpoint_info["model_name"], call["conv"], call["temperature"], max_tokens))
+        outputs = runner.run(requests)
+        for call, request in zip(active, requests):
+            if request["custom_id"] in outputs:
+                call["conv"].append({"role": "assistant", "content": outputs[request["custom_id"]]})
+                call["turns"].append({"content": outputs[request["custom_id"]]})
+            else:
+                call["turns"] = None
+
+    choices = {}
+    for call in calls:
+        choices.setdefault(id(call["job"]), (call["job"], []))[1].append(call)
+    for job, job_calls in choices.values():
+        if any(call["turns"] is None for call in job_calls):
+            continue
+        question, max_tokens, model, endpoint_info, answer_file = job
+        job_choices = [{"index": call["choice"], "turns": call["turns"]} for call in job_calls]
+        add_token_len(job_choices)
+        dump_answer(question, model, job_choices, answer_file)
+
+
+def generate_answers_batch(jobs: list, settings: dict, backend: str, batch_dir: str, poll_interval: float, max_retries: int):
+    """Send every model's calls through a batch backend, polling the models' batches side by side."""
+    model_jobs = {}
+    for job in jobs:
+        model_jobs.setdefault(job[2], []).append(job)
+
+    def run(model):
+        work_dir = os.path.join(batch_dir, model)
+        runner = BatchRunner(get_batch_backend(backend, model_jobs[model][0][3], work_dir), work_dir,
+                             poll_interval=poll_interval, max_retries=max_retries)
+        answer_in_batches(model_jobs[model], settings, runner)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(model_jobs))) as executor:
+        for future in [executor.submit(run, model) for model in model_jobs]:
+            future.result()
 
 
 if __name__ == "__main__":
@@ -113,72 +422,91 @@ if __name__ == "__main__":
     parser.add_argument(
         "--question-file", type=str, default="question.jsonl"
     )
+    parser.add_argument(
+        "--engine", type=str, default="thread", choices=["thread", "async"],
+        help="thread runs blocking calls in a thread pool, async keeps up to `parallel` requests in flight on one event loop"
+    )
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="stream OpenAI-compatible, Azure and Anthropic responses and record time-to-first-token and tokens/sec"
+    )
+    parser.add_argument(
+        "--batch", type=str, default=None, choices=["openai", "local"],
+        help="send the requests through the OpenAI/Azure Batch API, or the local file-based fake"
+    )
+    parser.add_argument(
+        "--batch-dir", type=str, default=None, help="work directory of --batch, default data/<bench>/batch/answer"
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=60, help="seconds between batch status checks"
+    )
+    parser.add_argument(
+        "--batch-retries", type=int, default=2, help="resubmit failed batch requests this many times"
+    )
+    parser.add_argument(
+        "--fsync-interval", type=float, default=1.0, help="seconds between fsyncs of the answer files"
+    )
+    parser.add_argument(
+        "--token-cache-dir", type=str, default=None,
+        help="directory caching prompt token counts per tokenizer, defaults to data/<bench>/token_cache"
+    )
+    parser.add_argument(
+        "--response-cache", type=str, default=None, help="sqlite file caching temperature 0 responses across runs"
+    )
+    parser.add_argument(
+        "--cache-ttl", type=float, default=None, help="seconds after which cached responses expire"
+    )
+    parser.add_argument(
+        "--cache-max-mb", type=float, default=None, help="evict least recently used responses beyond this size"
+    )
     args = parser.parse_args()
 
+    if args.response_cache:
+        set_response_cache(ResponseCache(args.response_cache, ttl=args.cache_ttl, max_size_mb=args.cache_max_mb))
+
     settings = make_config(args.setting_file)
     endpoint_list = make_config(args.endpoint_file)
+    if args.stream:
+        settings["stream"] = True
+    set_cache_dir(args.token_cache_dir or os.path.join("data", settings["bench_name"], "token_cache"))
+
+    answer_dir = os.path.join("data", settings["bench_name"], "model_answer")
+    # the index next to each answer file gives the completed question_ids without parsing answers
+    existing_answer = {
+        model: load_completed_keys(os.path.join(answer_dir, f"{model}.jsonl")) for model in settings["model_list"]
+    }
 
-    existing_answer = load_model_answers(os.path.join("data", settings["bench_name"], "model_answer"))
-    
     print(settings)
 
+    # questions are loaded once and every model's work is scheduled in a single pass
+    question_file = os.path.join("data", settings["bench_name"], args.question_file)
+    questions = load_questions(question_file)
+
+    pending = {}
+    answer_files = {}
     for model in settings["model_list"]:
         assert model in endpoint_list
         endpoint_info = endpoint_list[model]
 
-        question_file = os.path.join("data", settings["bench_name"], args.question_file)
-        questions = load_questions(question_file)
+        answer_files[model] = os.path.join(answer_dir, f"{model}.jsonl")
+        print(f"Output to {answer_files[model]}")
+        get_writer(answer_files[model], fsync_interval=args.fsync_interval)
 
-        answer_file = os.path.join("data", settings["bench_name"], "model_answer", f"{model}.jsonl")
-        print(f"Output to {answer_file}")
+        max_tokens = get_max_tokens(questions, model, endpoint_info, settings)
+        pending[model] = get_pending_questions(questions, model, existing_answer, max_tokens)
 
-        if "parallel" in endpoint_info:
-            parallel = endpoint_info["parallel"]
-        else:
-            parallel = 1
-
-        # We want to maximizes the number of tokens generate per answer: max_tokens = specified token # - input tokens #
-        if "tokenizer" in endpoint_info:
-            question_list = [question["turns"][0]["content"] for question in questions]
-            if model in OPENAI_MODEL_LIST:
-                tokenizer = tiktoken.encoding_for_model(endpoint_info["model_name"])
-                tokens = [tokenizer.encode(prompt) for prompt in question_list]
-                max_tokens = [(settings["max_tokens"] - len(token) - 100) for token in tokens]
-            else:
-                from transformers import AutoTokenizer
-                
-                os.environ["TOKENIZERS_PARALLELISM"] = "false"
-                tokenizer = AutoTokenizer.from_pretrained(endpoint_info["tokenizer"])
+    jobs = interleave_jobs(pending, endpoint_list, answer_files)
+    if args.batch:
+        batch_dir = args.batch_dir or os.path.join("data", settings["bench_name"], "batch", "answer")
+        generate_answers_batch(jobs, settings, args.batch, batch_dir, args.poll_interval, args.batch_retries)
+    elif args.engine == "async":
+        asyncio.run(generate_answers_async(jobs, settings))
+    else:
+        generate_answers(jobs, settings)
 
-                tokens = tokenizer(question_list)
-                max_tokens = [(settings["max_tokens"] - len(prompt) - 300) for prompt in tokens["input_ids"]]
-        else:
-            max_tokens = [settings["max_tokens"]] * len(questions)
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
-            futures = []
-            count = 0
-            for index, question in enumerate(questions):
-                if model in existing_answer and question["question_id"] in existing_answer[model]:
-                    count += 1
-                    continue
-                future = executor.submit(
-                    get_answer,
-                    question,
-                    model,
-                    endpoint_info,
-                    settings["num_choices"],
-                    max_tokens[index],
-                    settings["temperature"],
-                    answer_file,
-                    get_endpoint(endpoint_info["endpoints"]),
-                )
-                futures.append(future)
-            if count > 0:
-                print(f"{count} number of existing answers")
-            for future in tqdm.tqdm(
-                concurrent.futures.as_completed(futures), total=len(futures)
-            ):
-                future.result()
-
-        reorg_answer_file(answer_file)
+    # merges each run's answers into the sorted file instead of rewriting it
+    close_writers()
+
+    print(f"client stats: {get_client_stats()}")
+    if get_response_cache():
+        print(f"response cache stats: {get_response_cache().stats()}")
@@ -1,10 +1,16 @@
 import json
 import yaml
 import argparse
+import hashlib
 import os
+import random
 import re
+import threading
 import concurrent.futures
+from collections import OrderedDict, deque
 
+import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
 from utils import (
@@ -14,9 +20,14 @@ from utils import (
     chat_completion_anthropic,
     load_questions,
     load_model_answers,
-    get_endpoint,
     make_config,
+    get_client_stats,
 )
+from batch_api import BatchRunner, get_batch_backend, make_request
+from endpoint_router import get_endpoint_router
+from jsonl_writer import close_writers, get_writer, load_completed_keys
+from rate_limiter import get_rate_limiter
+from response_cache import ResponseCache, get_response_cache, set_response_cache
 
 
 def get_score(judgment, pattern, pairwise=True):
@@ -34,103 +45,389 @@ def get_score(judgment, pattern, pairwise=True):
 
 # get answer from model
 def get_answer(model, conv, temperature, max_tokens, endpoint_dict=None):
-    api_dict = get_endpoint(endpoint_dict["endpoints"])
+    limiter = get_rate_limiter(endpoint_dict)
+    router = get_endpoint_router(endpoint_dict)
 
     if endpoint_dict["api_type"] == "anthropic":
-        output = chat_completion_anthropic(model, conv, temperature, max_tokens)
+        output = chat_completion_anthropic(model, conv, temperature, max_tokens, limiter=limiter, router=router)
     elif endpoint_dict["api_type"] == "azure":
-        output = chat_completion_openai_azure(model, conv, temperature, max_tokens, api_dict)
+        output = chat_completion_openai_azure(model, conv, temperature, max_tokens, limiter=limiter, router=router)
     else:
-        output = chat_completion_openai(model, conv, temperature, max_tokens, api_dict)
+        output = chat_completion_openai(model, conv, temperature, max_tokens, limiter=limiter, router=router)
     return output
 
 
-def judgment(**args):
-    question = args["question"]
-    answer = args["answer"]
-    reference = args["reference"]
-    baseline = args["baseline_answer"]
-    configs = args["configs"]
-    output_file = args["output_file"]
-    model = configs["judge_model"]
-
-    num_games = 2 if configs["pairwise"] else 1
-
-    output = {
-        "question_id":question["question_id"],
-        "model":answer["model_id"],
-        "judge": model,
-        "games":[]
-        }
-
-    for game in range(num_games):
-        conv = [{"role": "system", "content": configs["system_prompt"]}]
-
-        for template in configs["prompt_template"]:
-            prompt_args = {}
-
-            for i, turn in enumerate(question["turns"]):
-                prompt_args[f"question_{i+1}"] = turn["content"]
-            base = 1
-
-            if baseline:
-                if game % 2 == 1: # swap position
-                    temp = baseline
-                    baseline = answer
-                    answer = temp
-
-                for i, turn in enumerate(baseline["choices"][0]["turns"]):
-                    prompt_args[f"answer_{i+1}"] = turn["content"]
-                    base += 1
-            if answer:
-                for i, turn in enumerate(answer["choices"][0]["turns"]):
-                    prompt_args[f"answer_{i+base}"] = turn["content"]
-
-            if reference:
-                for j, ref_answer in enumerate(reference):
-                    for i, turn in enumerate(ref_answer["choices"][0]["turns"]):
-                        prompt_args[f"ref_answer_{i+j+1}"] = turn["content"]
-            
-            user_prompt = template.format(**prompt_args)
-            conv.append({"role": "user", "content": user_prompt})
-
-        judgment = ""
-        for _ in range(2):
-            new_judgment = get_answer(
-                endpoint_info["model_name"],
-                conv,
-                configs["temperature"],
-                configs["max_tokens"],
-                args["endpoint_dict"],
-            )
-
-            judgment += ("\n" + new_judgment)
-
-            score, try_again = get_score(judgment, args["regex_pattern"])
-
-            conv.append({"role": "assistant", "content": new_judgment})
-
-            if not try_again:
-                break
-
-            conv.append({"role": "user", "content": "continue your judgment and finish by outputting a final verdict label"})
-
-        result = {
-            "user_prompt": conv[1]["content"],
-            "judgment": judgment,
-            "score":score
-        }
-        output["games"].append(result)
-
-    with open(output_file, "a") as f:
-        f.write(json.dumps(output, ensure_ascii=False) + "\n")
+def make_judge_conv(question, answer, baseline, reference, configs, game):
+    """System prompt and filled templates of one game; odd games swap the answer positions."""
+    if baseline and game % 2 == 1:
+        baseline, answer = answer, baseline
+
+    conv = [{"role": "system", "content": configs["system_prompt"]}]
+    for template in configs["prompt_template"]:
+        prompt_args = {}
+
+        for i, turn in enumerate(question["turns"]):
+            prompt_args[f"question_{i+1}"] = turn["content"]
+        base = 1
+
+        if baseline:
+            for i, turn in enumerate(baseline["choices"][0]["turns"]):
+                prompt_args[f"answer_{i+1}"] = turn["content"]
+                base += 1
+        if answer:
+            for i, turn in enumerate(answer["choices"][0]["turns"]):
+                prompt_args[f"answer_{i+base}"] = turn["content"]
+
+        if reference:
+            for j, ref_answer in enumerate(reference):
+                for i, turn in enumerate(ref_answer["choices"][0]["turns"]):
+                    prompt_args[f"ref_answer_{i+j+1}"] = turn["content"]
+
+        user_prompt = template.format(**prompt_args)
+        conv.append({"role": "user", "content": user_prompt})
+    return conv
+
+
+SECOND_GAME_POLICIES = ("always", "skip_strong", "sample")
+STRONG_VERDICTS = ("A>>B", "B>>A")
+
+
+def get_first_games(job):
+    """Games a judgment starts with, following the second_game policy of judge_config.yaml.
+
+    always plays both games. skip_strong starts with game 1 alone and adds the
+    swapped game only when game 1 is not A>>B or B>>A. sample plays the
+    swapped game for a second_game_fraction share of (question, model) pairs,
+    chosen by hash so reruns pick the same pairs.
+    """
+    configs = job["configs"]
+    if not configs["pairwise"]:
+        return [0]
+    policy = configs.get("second_game", "always")
+    assert policy in SECOND_GAME_POLICIES, f"unknown second_game policy {policy}"
+    if policy == "always":
+        return [0, 1]
+    if policy == "sample":
+        key = f"{job['question']['question_id']}/{job['answer']['model_id']}".encode("utf-8")
+        draw = int(hashlib.sha1(key).hexdigest()[:8], 16) / 16 ** 8
+        return [0, 1] if draw < configs.get("second_game_fraction", 0.5) else [0]
+    return [0]
+
+
+def get_game_units(jobs, questions, schedule="model"):
+    """(job, game) pairs in submission order.
+
+    model keeps both games of a judgment next to each other. prefix is
+    question-major: game 1 of every model's judgment of a question, then
+    game 2. Game 1 puts the baseline answer first, so these requests share
+    the system prompt, the question and the baseline answer, which a judge
+    with automatic prefix caching (vLLM, SGLang) then computes once.
+    """
+    units = [(job, game) for job in jobs for game in get_first_games(job)]
+    if schedule == "model":
+        return units
+    question_index = {question["question_id"]: i for i, question in enumerate(questions)}
+    return sorted(units, key=lambda unit: (question_index[unit[0]["question"]["question_id"]], unit[1]))
+
+
+def get_judge_prompts(units):
+    """Prompt text of every game, in the order the units are submitted."""
+    for job, game in units:
+        conv = make_judge_conv(job["question"], job["answer"], job["baseline_answer"], job["reference"], job["configs"], game)
+        yield "\n".join(message["content"] for message in conv)
+
+
+def estimate_prefix_reuse(prompts, cache_chars, block_size=64):
+    """Share of prompt characters served from a prefix cache when prompts are sent in this order.
+
+    Mimics automatic prefix caching: a prompt is split into blocks keyed by
+    the hash of everything before them, blocks are kept in an LRU of
+    cache_chars, and reuse stops at the first block that is not cached.
+    """
+    cache = OrderedDict()
+    capacity = max(1, cache_chars // block_size)
+    reused = total = 0
+    for prompt in prompts:
+        key = None
+        hit = True
+        for start in range(0, len(prompt), block_size):
+            block = prompt[start:start + block_size]
+            key = hash((key, block))
+            total += len(block)
+            if hit and key in cache:
+                cache.move_to_end(key)
+                reused += len(block)
+                continue
+            hit = False
+            cache[key] = None
+            if len(cache) > capacity:
+                cache.popitem(last=False)
+    return reused / total if total else 0.0
+
+
+class PendingJudgment:
+    """Games of one (question, model) judgment, written once every game it plays has its verdict."""
+
+    def __init__(self, job):
+        self.job = job
+        self.results = {game: None for game in get_first_games(job)}
+        self.lock = threading.Lock()
+
+    @property
+    def games(self):
+        return [self.results[game] for game in sorted(self.results)]
+
+    def finish_game(self, game, result):
+        """Record a verdict; returns the swapped game as a new unit when skip_strong still needs it."""
+        configs = self.job["configs"]
+        if (game == 0 and configs["pairwise"] and configs.get("second_game", "always") == "skip_strong"
+                and result["score"] not in STRONG_VERDICTS):
+            with self.lock:
+                self.results[game] = result
+                self.results[1] = None
+            return (self, 1)
+        with self.lock:
+            self.results[game] = result
+            if any(result is None for result in self.results.values()):
+                return None
+        job = self.job
+        output = {
+            "question_id":job["question"]["question_id"],
+            "model":job["answer"]["model_id"],
+            "judge": job["configs"]["judge_model"],
+            "games":self.games,
+            }
+        get_writer(job["output_file"], ensure_ascii=False).write(output)
+        return None
+
+
+def judge_game(pending, game, conv=None, judgment="", attempt=0):
+    """One judge call of a game, returning the next unit of the judgment if there is one."""
+    job = pending.job
+    configs = job["configs"]
+    if conv is None:
+        conv = make_judge_conv(job["question"], job["answer"], job["baseline_answer"], job["reference"], configs, game)
+
+    new_judgment = get_answer(
+        job["endpoint_dict"]["model_name"],
+        conv,
+        configs["temperature"],
+        configs["max_tokens"],
+        job["endpoint_dict"],
+    )
+    return add_judge_output(pending, game, conv, judgment, attempt, new_judgment)
+
+
+def add_judge_output(pending, game, conv, judgment, attempt, new_judgment):
+    """Record one judge response. Returns the continuation call if no verdict was found yet,
+    or the swapped game if the policy still needs it."""
+    judgment += ("\n" + new_judgment)
+
+    score, try_again = get_score(judgment, pending.job["regex_pattern"])
+
+    conv.append({"role": "assistant", "content": new_judgment})
+
+    if try_again and attempt == 0:
+        conv.append({"role": "user", "content": "continue your judgment and finish by outputting a final verdict label"})
+        return (pending, game, conv, judgment, attempt + 1)
+
+    result = {
+        "user_prompt": conv[1]["content"],
+        "judgment": judgment,
+        "score":score
+    }
+    return pending.finish_game(game, result)
+
+
+def get_pending_judgments(units):
+    pending = {}
+    calls = []
+    for job, game in units:
+        if id(job) not in pending:
+            pending[id(job)] = PendingJudgment(job)
+        calls.append((pending[id(job)], game))
+    return calls
+
+
+def judge_in_batches(units, runner):
+    """Batch mode: one batch for the first call of every game, then one for the continuations
+    and the swapped games skip_strong still needs.
+
+    Judgments with a game that failed on every retry are not written, so the
+    next run judges them again.
+    """
+    calls = []
+    for pending, game in get_pending_judgments(units):
+        job = pending.job
+        conv = make_judge_conv(job["question"], job["answer"], job["baseline_answer"], job["reference"], job["configs"], game)
+        calls.append((pending, game, conv, "", 0))
+
+    while calls:
+        requests = []
+        for pending, game, conv, judgment, attempt in calls:
+            job = pending.job
+            custom_id = f"{job['answer']['model_id']}/{job['question']['question_id']}/game-{game}/call-{attempt}"
+            requests.append(make_request(
+                custom_id, job["endpoint_dict"]["model_name"], conv, job["configs"]["temperature"], job["configs"]["max_tokens"],
+            ))
+        outputs = runner.run(requests)
+
+        next_calls = []
+        for call, request in zip(calls, requests):
+            if request["custom_id"] in outputs:
+                unit = add_judge_output(*call, outputs[request["custom_id"]])
+                if unit is not None and len(unit) == 2:
+                    # the swapped game of a skip_strong judgment
+                    pending, game = unit
+                    job = pending.job
+                    conv = make_judge_conv(job["question"], job["answer"], job["baseline_answer"], job["reference"], job["configs"], game)
+                    unit = (pending, game, conv, "", 0)
+                if unit is not None:
+                    next_calls.append(unit)
+        calls = next_calls
+
+
+def run_judgments(units, parallel):
+    """Run every game as its own unit with at most `parallel` judge calls in flight.
+
+    A continuation call, or a swapped game added by skip_strong, is queued
+    ahead of new games, so a judgment is written as soon as its slower game
+    has a verdict. Returns the PendingJudgment of
+    every (question, model) pair.
+    """
+    queue = deque(get_pending_judgments(units))
+    judgments = list({id(pending): pending for pending, game in queue}.values())
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor, tqdm(total=len(queue)) as progress:
+        running = set()
+        while queue or running:
+            while queue and len(running) < parallel:
+                running.add(executor.submit(judge_game, *queue.popleft()))
+            done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                unit = future.result()
+                if unit is None or len(unit) == 2:
+                    progress.update(1)
+                if unit is not None:
+                    if len(unit) == 2:
+                        progress.total += 1
+                    queue.appendleft(unit)
+    return judgments
+
+
+def get_adaptive_order(questions, order="random", seed=42):
+    """Shuffled questions. With order set to a question field (category, cluster), every
+    group is spread evenly over the order, so any prefix is a stratified sample."""
+    rng = random.Random(seed)
+    questions = list(questions)
+    rng.shuffle(questions)
+    if order == "random":
+        return questions
+    groups = {}
+    for question in questions:
+        groups.setdefault(question.get(order), []).append(question)
+    position = {}
+    for group in groups.values():
+        offset = rng.random()
+        for i, question in enumerate(group):
+            position[question["question_id"]] = (i + offset) / len(group)
+    return sorted(questions, key=lambda question: position[question["question_id"]])
+
+
+def get_win_rate_ci(verdicts, model, baseline, num_round=100, seed=42):
+    """Win rate against the baseline with its 95% bootstrap interval, as show_result.py computes it."""
+    from show_result import get_battles_from_verdicts, get_bootstrap_result_batched, get_bootstrap_win_rates
+
+    battles = get_battles_from_verdicts(pd.DataFrame(verdicts), baseline=baseline)
+    if battles.empty:
+        return None
+    winners = battles["winner"].unique()
+    if len(winners) == 1 and winners[0] != "tie":
+        # the Bradley-Terry fit diverges when every decided game went one way;
+        # use the exact (Clopper-Pearson) 95% interval of n wins out of n instead
+        num_games = len(get_battles_from_verdicts(pd.DataFrame(verdicts), baseline=baseline, WEIGHT=1, single_game_weight=1))
+        bound = 100 * 0.025 ** (1 / num_games)
+        return (100.0, bound, 100.0) if winners[0] == "model_b" else (0.0, 0.0, 100 - bound)
+    bootstrap = get_bootstrap_result_batched(battles, num_round, seed=seed)
+    win_rate = get_bootstrap_win_rates(bootstrap, baseline)[model]
+    return win_rate.median(), np.percentile(win_rate, 2.5), np.percentile(win_rate, 97.5)
+
+
+def judge_adaptively(jobs, existing_verdicts, configs, parallel, schedule="model", target_width=5.0,
+                     min_questions=50, check_every=25, num_round=100, seed=42):
+    """Judge each model's questions in order, in chunks, until its win rate CI is narrow enough.
+
+    After every chunk the win rate against the baseline and its bootstrap
+    interval are recomputed from all of the model's judgments, and the model
+    stops once upper - lower <= target_width (in percentage points).
+    """
+    model_jobs = {}
+    for job in jobs:
+        model_jobs.setdefault(job["model"], deque()).append(job)
+    verdicts = {model: list(existing_verdicts.get(model, [])) for model in model_jobs}
+    num_judged = {model: len({row["question_id"] for row in verdicts[model]}) for model in model_jobs}
+
+    active = list(model_jobs)
+    while active:
+        chunk = []
+        for model in active:
+            size = max(min_questions - num_judged[model], check_every)
+            for _ in range(min(size, len(model_jobs[model]))):
+                chunk.append(model_jobs[model].popleft())
+        questions = [job["question"] for job in chunk]
+        for pending in run_judgments(get_game_units(chunk, questions, schedule), parallel):
+            model = pending.job["model"]
+            num_judged[model] += 1
+            for game, result in enumerate(pending.games):
+                verdicts[model].append({"question_id": pending.job["question"]["question_id"], "model": model, "game": game, "score": result["score"]})
+
+        for model in list(active):
+            if num_judged[model] < min_questions and model_jobs[model]:
+                continue
+            ci = get_win_rate_ci(verdicts[model], model, configs["baseline_model"], num_round, seed)
+            if ci is None:
+                print(f"{model}: {num_judged[model]} questions judged, no decided games yet")
+            else:
+                print(f"{model}: {num_judged[model]} questions judged, win rate {ci[0]:.1f} (95% CI {ci[1]:.1f} - {ci[2]:.1f})")
+            if ci is not None and ci[2] - ci[1] <= target_width:
+                print(f"{model}: CI width {ci[2] - ci[1]:.1f} <= {target_width}, skipping {len(model_jobs[model])} questions")
+                active.remove(model)
+            elif not model_jobs[model]:
+                active.remove(model)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--setting-file", type=str, default="config/judge_config.yaml")
     parser.add_argument("--endpoint-file", type=str, default="config/api_config.yaml")
+    parser.add_argument("--fsync-interval", type=float, default=1.0, help="seconds between fsyncs of the judgment files")
+    parser.add_argument("--response-cache", type=str, default=None, help="sqlite file caching temperature 0 responses across runs")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="seconds after which cached responses expire")
+    parser.add_argument("--cache-max-mb", type=float, default=None, help="evict least recently used responses beyond this size")
+    parser.add_argument("--schedule", type=str, default="model", choices=["model", "prefix"],
+                        help="model sends one model's judgments after another, prefix sends all judgments of a question together for judges with prefix caching")
+    parser.add_argument("--batch", type=str, default=None, choices=["openai", "local"],
+                        help="send the judge calls through the OpenAI/Azure Batch API, or the local file-based fake")
+    parser.add_argument("--batch-dir", type=str, default=None, help="work directory of --batch, default data/<bench>/batch/judgment/<judge>")
+    parser.add_argument("--poll-interval", type=float, default=60, help="seconds between batch status checks")
+    parser.add_argument("--batch-retries", type=int, default=2, help="resubmit failed batch requests this many times")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="judge questions in random order and stop a model once its win rate CI is narrower than --target-ci-width")
+    parser.add_argument("--target-ci-width", type=float, default=5.0, help="upper - lower of the 95%% win rate CI, in percentage points")
+    parser.add_argument("--adaptive-order", type=str, default="random",
+                        help="random, or a question field (category, cluster) to stratify the order by")
+    parser.add_argument("--min-questions", type=int, default=50, help="questions judged before the CI is first checked")
+    parser.add_argument("--check-every", type=int, default=25, help="questions judged between CI checks")
+    parser.add_argument("--num-rounds", type=int, default=100, help="bootstrap rounds of each CI check")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--estimate-prefix-reuse", action="store_true",
+                        help="before judging, print the share of prompt characters a prefix cache would serve in model and prefix order")
+    parser.add_argument("--prefix-cache-tokens", type=int, default=500000,
+                        help="prefix cache size of the judge server, used by --estimate-prefix-reuse")
     args = parser.parse_args()
+
+    if args.response_cache:
+        set_response_cache(ResponseCache(args.response_cache, ttl=args.cache_ttl, max_size_mb=args.cache_max_mb))
     print(args)
 
     configs = make_config(args.setting_file)
@@ -147,14 +444,21 @@ if __name__ == "__main__":
     ref_answer_dir = os.path.join("data", configs["bench_name"], "reference_answer")
 
     questions = load_questions(question_file)
-    model_answers = load_model_answers(answer_dir)
-    
+    if args.adaptive:
+        assert configs["baseline"] and configs["pairwise"], "adaptive judging needs a baseline and pairwise games"
+        assert not args.batch, "adaptive judging cannot be combined with --batch"
+        questions = get_adaptive_order(questions, args.adaptive_order, args.seed)
+
     # if user choose a set of models, only judge those models
     models = [model for model in configs["model_list"]]
-        
+
+    # only the judged models and the baseline are read, without fields the judge never sees
+    answer_models = models + ([configs["baseline_model"]] if configs["baseline"] else [])
+    model_answers = load_model_answers(answer_dir, models=answer_models, fields=["model_id", "choices"])
+
     ref_answers = None
     if configs["reference"]:
-        ref_answers = load_model_answers(ref_answer_dir)
+        ref_answers = load_model_answers(ref_answer_dir, models=configs["ref_model"], fields=["model_id", "choices"])
         ref_answers = [ref_answers[model] for model in configs["ref_model"]]
     
     output_files = {}
@@ -165,51 +469,76 @@ if __name__ == "__main__":
             f"{model}.jsonl",
         )
 
-    for output_file in output_files.values():
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-
-    existing_judgments = load_model_answers(output_dir)
+    existing_judgments = {}
+    for model, output_file in output_files.items():
+        existing_judgments[model] = load_completed_keys(output_file)
+        get_writer(output_file, fsync_interval=args.fsync_interval, ensure_ascii=False)
 
     endpoint_info = endpoint_list[configs["judge_model"]]
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=endpoint_info["parallel"]) as executor:
-        futures = []
-        for model in models:
-            count = 0
-            for question in questions:
-                question_id = question["question_id"]
-
-                kwargs = {}
-                kwargs["question"] = question
-                if model in model_answers and not question_id in model_answers[model]:
-                    print(f"Warning: {model} answer to {question['question_id']} cannot be found.")
-                    continue
-
-                if model in existing_judgments and question_id in existing_judgments[model]:
-                    count += 1
-                    continue
-
-                kwargs["answer"] = model_answers[model][question_id]
-                if ref_answers:
-                    kwargs["reference"] = [ref_answer[question_id] for ref_answer in ref_answers]
-                    assert len(kwargs["reference"]) == len(configs["ref_model"])
-                else:
-                    kwargs["reference"] = None
-                if configs["baseline"]:
-                    kwargs["baseline_answer"] = model_answers[configs["baseline_model"]][question_id]
-                else:
-                    kwargs["baseline_answer"] = None
-                kwargs["configs"] = configs
-                kwargs["endpoint_dict"] = endpoint_info
-                kwargs["output_file"] = output_files[model]
-                kwargs["regex_pattern"] = pattern
-                future = executor.submit(judgment, **kwargs)
-                futures.append(future)
-
-            if count > 0:
-                print(f"{count} number of existing judgments")
-
-        for future in tqdm(
-            concurrent.futures.as_completed(futures), total=len(futures)
-        ):
-            future.result()
+    jobs = []
+    for model in models:
+        count = 0
+        for question in questions:
+            question_id = question["question_id"]
+
+            kwargs = {}
+            kwargs["question"] = question
+            kwargs["model"] = model
+            if model in model_answers and not question_id in model_answers[model]:
+                print(f"Warning: {model} answer to {question['question_id']} cannot be found.")
+                continue
+
+            if model in existing_judgments and question_id in existing_judgments[model]:
+                count += 1
+                continue
+
+            kwargs["answer"] = model_answers[model][question_id]
+            if ref_answers:
+                kwargs["reference"] = [ref_answer[question_id] for ref_answer in ref_answers]
+                assert len(kwargs["reference"]) == len(configs["ref_model"])
+            else:
+                kwargs["reference"] = None
+            if configs["baseline"]:
+                kwargs["baseline_answer"] = model_answers[configs["baseline_model"]][question_id]
+            else:
+                kwargs["baseline_answer"] = None
+            kwargs["configs"] = configs
+            kwargs["endpoint_dict"] = endpoint_info
+            kwargs["output_file"] = output_files[model]
+            kwargs["regex_pattern"] = pattern
+            jobs.append(kwargs)
+
+        if count > 0:
+            print(f"{count} number of existing judgments")
+
+    units = get_game_units(jobs, questions, args.schedule)
+    if args.estimate_prefix_reuse:
+        # builds and hashes every prompt in Python, so only when asked for; about 4 characters per token
+        cache_chars = args.prefix_cache_tokens * 4
+        model_major = estimate_prefix_reuse(get_judge_prompts(get_game_units(jobs, questions, "model")), cache_chars)
+        prefix_major = estimate_prefix_reuse(get_judge_prompts(get_game_units(jobs, questions, "prefix")), cache_chars)
+        print(f"expected prefix reuse: {prefix_major:.1%} of prompt characters (model order: {model_major:.1%})")
+
+    if args.adaptive:
+        existing_verdicts = {}
+        for model, output_file in output_files.items():
+            if existing_judgments[model]:
+                from show_result import load_judgment_verdicts
+
+                existing_verdicts[model] = load_judgment_verdicts(output_dir, files=[output_file]).to_dict("records")
+        judge_adaptively(jobs, existing_verdicts, configs, endpoint_info["parallel"], args.schedule, args.target_ci_width,
+                         args.min_questions, args.check_every, args.num_rounds, args.seed)
+    elif args.batch:
+        batch_dir = args.batch_dir or os.path.join("data", configs["bench_name"], "batch", "judgment", configs["judge_model"])
+        runner = BatchRunner(get_batch_backend(args.batch, endpoint_info, batch_dir), batch_dir,
+                             poll_interval=args.poll_interval, max_retries=args.batch_retries)
+        judge_in_batches(units, runner)
+    else:
+        run_judgments(units, endpoint_info["parallel"])
+
+    close_writers()
+
+    print(f"client stats: {get_client_stats()}")
+    if get_response_cache():
+        print(f"response cache stats: {get_response_cache().stats()}")
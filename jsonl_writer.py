@@ -0,0 +1,306 @@
+"""Single-writer, crash-safe appends to answer and judgment JSONL files.
+
+Worker threads hand records to a JsonlWriter, whose own thread appends them
+in batches and fsyncs at a fixed interval, so lines from different workers
+can never interleave. Next to every output file an index
+(`<file>.index`) lists the key, byte offset and length of each line, which
+lets a resumed run find the completed question_ids without parsing the
+file. On close, the records appended during the run are merged into the
+sorted part of the file, replacing the old full rewrite (reorg_answer_file).
+
+Index format: the first line is {"sorted_upto": n, "size": s, "mtime_ns": t,
+"inode": i}, meaning bytes [0, n) of the data file are sorted by key without
+duplicates, and the data file had that size, mtime and inode when the index
+was written; every following line is [key, offset, length]. Entries are only
+trusted up to that size: lines appended after it are scanned again, and an
+index whose data file was replaced, shrunk, rewritten or deleted is rebuilt.
+"""
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+
+
+def _truncate_partial_line(path):
+    """Drop a trailing line without newline, left behind by a crash mid-write."""
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return size
+        pos = size
+        while pos > 0:
+            step = min(65536, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            cut = chunk.rfind(b"\n")
+            if cut >= 0:
+                pos = pos - step + cut + 1
+                break
+            pos -= step
+        f.truncate(pos)
+        return pos
+
+
+def _scan(path, key, start=0):
+    """Index entries of the lines from byte `start` on, parsing each line."""
+    entries = []
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if line.strip():
+                entries.append([json.loads(line)[key], offset, len(line)])
+            offset += len(line)
+    return entries
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+
+def load_index(path, key="question_id"):
+    """Return (sorted_upto, entries) for a data file, repairing a stale or missing index."""
+    index_path = path + ".index"
+    if not os.path.exists(path):
+        # an index left behind by a deleted data file describes nothing
+        for stale in (index_path, path + ".tail"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        return 0, []
+    if os.path.exists(path + ".tail"):
+        _finish_tail_rewrite(path)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+    _truncate_partial_line(path)
+    state = _file_state(path)
+
+    header, entries = None, []
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            lines = f.read().split("\n")
+        try:
+            header = json.loads(lines[0])
+            entries = [json.loads(line) for line in lines[1:] if line]
+        except ValueError:
+            # a torn last line of the index is dropped, anything worse rebuilds it
+            header, entries = None, []
+
+    sorted_upto, trusted = 0, 0
+    if header is not None and all(name in header for name in ("sorted_upto", *state)):
+        trusted = header["size"]
+        entries = [entry for entry in entries if entry[1] + entry[2] <= trusted]
+        end = entries[-1][1] + entries[-1][2] if entries else 0
+        same_file = header["inode"] == state["inode"] and trusted <= state["size"]
+        unchanged = trusted < state["size"] or header["mtime_ns"] == state["mtime_ns"]
+        if same_file and unchanged and end == trusted and header["sorted_upto"] <= trusted:
+            sorted_upto = header["sorted_upto"]
+        else:
+            trusted = 0
+    if trusted == 0:
+        entries = []
+    if header is None or trusted < state["size"] or header != {"sorted_upto": sorted_upto, **state}:
+        entries += _scan(path, key, start=trusted)
+        _write_index(path, sorted_upto, entries)
+    return sorted_upto, entries
+
+
+def load_completed_keys(path, key="question_id"):
+    """Keys (e.g. question_ids) already present in a JSONL output file."""
+    return {entry[0] for entry in load_index(path, key)[1]}
+
+
+def _write_index(path, sorted_upto, entries):
+    """Rewrite the index of a data file, stamped with the file's current size, mtime and inode."""
+    index_path = path + ".index"
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps({"sorted_upto": sorted_upto, **_file_state(path)}) + "\n")
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, index_path)
+
+
+def _sort_key(key):
+    # sorts ints and strings without comparing across types
+    return (isinstance(key, str), key)
+
+
+def _finish_tail_rewrite(path):
+    """Complete an in-place tail rewrite that was interrupted by a crash."""
+    tail_path = path + ".tail"
+    with open(tail_path, "rb") as f:
+        start = int(f.readline())
+        data = f.read()
+    with open(path, "rb+") as f:
+        f.seek(start)
+        f.write(data)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(tail_path)
+
+
+def merge_sorted(path, key="question_id"):
+    """Sort and de-duplicate a file written by JsonlWriter, rewriting as little as possible.
+
+    The tail appended since the last merge is sorted in memory (later lines
+    win, as in reorg_answer_file). When all tail keys sort after the sorted
+    prefix, only the tail is rewritten in place; otherwise prefix and tail
+    are streamed into a new file in key order.
+    """
+    sorted_upto, entries = load_index(path, key)
+    prefix = [entry for entry in entries if entry[1] < sorted_upto]
+    tail = {}
+    for entry in entries:
+        if entry[1] >= sorted_upto:
+            tail[_sort_key(entry[0])] = entry
+    if not tail:
+        return
+    tail = [tail[k] for k in sorted(tail)]
+
+    new_entries = []
+    offset = 0
+    with open(path, "rb") as f:
+        def read(entry):
+            f.seek(entry[1])
+            return f.read(entry[2])
+
+        if not prefix or _sort_key(prefix[-1][0]) < _sort_key(tail[0][0]):
+            lines = [read(entry) for entry in tail]
+            new_entries, offset = list(prefix), sorted_upto
+            # keep a copy of the new tail so a crash mid-rewrite can be finished later
+            tail_path = path + ".tail"
+            with open(tail_path, "wb") as out:
+                out.write(f"{sorted_upto}\n".encode())
+                out.writelines(lines)
+                out.flush()
+                os.fsync(out.fileno())
+        else:
+            tail_keys = {_sort_key(entry[0]) for entry in tail}
+            kept = [entry for entry in prefix if _sort_key(entry[0]) not in tail_keys]
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as out:
+                for entry in heapq.merge(kept, tail, key=lambda entry: _sort_key(entry[0])):
+                    out.write(read(entry))
+                    new_entries.append([entry[0], offset, entry[2]])
+                    offset += entry[2]
+                out.flush()
+                os.fsync(out.fileno())
+            lines = None
+
+    # the old index describes the old layout, and a reordered file of the same
+    # size would pass load_index's checks: drop it before the data changes, so
+    # a crash before the new index is written rebuilds it by scanning
+    if os.path.exists(path + ".index"):
+        os.remove(path + ".index")
+    if lines is None:
+        os.replace(tmp_path, path)
+    else:
+        for entry in tail:
+            new_entries.append([entry[0], offset, entry[2]])
+            offset += entry[2]
+        _finish_tail_rewrite(path)
+    _write_index(path, offset, new_entries)
+
+
+class JsonlWriter:
+    def __init__(self, path, key="question_id", fsync_interval=1.0, batch_size=64, ensure_ascii=True):
+        self.path = path
+        self.key = key
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.ensure_ascii = ensure_ascii
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # repairs a torn last line and brings the index up to date before appending
+        sorted_upto, entries = load_index(path, key)
+        self._offset = entries[-1][1] + entries[-1][2] if entries else 0
+        # the header then stamps the file as it is before this run appends to it
+        open(path, "ab").close()
+        _write_index(path, sorted_upto, entries)
+
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=f"writer:{os.path.basename(path)}", daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(record)
+
+    def _run(self):
+        last_sync = time.monotonic()
+        with open(self.path, "ab") as data, open(self.path + ".index", "a") as index:
+            done = False
+            while not done:
+                batch = [self._queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is None:
+                    batch.pop()
+                    done = True
+                try:
+                    for record in batch:
+                        line = (json.dumps(record, ensure_ascii=self.ensure_ascii) + "\n").encode("utf-8")
+                        data.write(line)
+                        index.write(json.dumps([record[self.key], self._offset, len(line)]) + "\n")
+                        self._offset += len(line)
+                    # data reaches the disk before the index that points at it
+                    data.flush()
+                    if done or time.monotonic() - last_sync >= self.fsync_interval:
+                        os.fsync(data.fileno())
+                        index.flush()
+                        os.fsync(index.fileno())
+                        last_sync = time.monotonic()
+                    else:
+                        index.flush()
+                except Exception as e:
+                    self._error = e
+                    raise
+
+    def close(self, merge=True):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        if merge:
+            merge_sorted(self.path, self.key)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path, **kwargs):
+    """Shared writer for an output file, started on first use."""
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = JsonlWriter(path, **kwargs)
+        return _writers[path]
+
+
+def close_writer(path, merge=True):
+    with _writers_lock:
+        writer = _writers.pop(path, None)
+    if writer is not None:
+        writer.close(merge=merge)
+    elif merge and os.path.exists(path):
+        merge_sorted(path)
+
+
+def close_writers(merge=True):
+    for path in list(_writers):
+        close_writer(path, merge=merge)
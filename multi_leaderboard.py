@@ -0,0 +1,186 @@
+"""Leaderboards of several judges and benches in one pass, for show_result.py --judge-names.
+
+Every (bench, judge) pair reads its verdict index (verdict_index.py). The
+changed judgment files of all pairs are parsed in one shared process pool,
+the pairs whose verdicts or settings changed are refitted in parallel,
+and the results are kept under data/<bench>/leaderboard_cache/multi/<judge>.npz.
+Prints one table with each judge's win rate and 95% CI per model, then the
+agreement between judges of the same bench.
+"""
+import concurrent.futures
+import datetime
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from show_result import (
+    GAME_1_WINNER,
+    GAME_2_WINNER,
+    compute_mle_elo,
+    get_battles_from_verdicts,
+    get_bootstrap_result_batched,
+    get_bootstrap_win_rates,
+    predict_win_rate,
+)
+from verdict_index import VerdictIndex, get_index_dir, update_indexes
+
+
+def get_targets(bench_names, judge_names, baselines):
+    """One target per (bench, judge) with judgments; baselines holds one model per bench, or one for all."""
+    assert len(baselines) in (1, len(bench_names)), "give one baseline, or one per bench"
+    targets = []
+    for bench_name, baseline in zip(bench_names, itertools.cycle(baselines) if len(baselines) == 1 else baselines):
+        for judge_name in judge_names:
+            directory = os.path.join("data", bench_name, "model_judgment", judge_name)
+            if not os.path.isdir(directory):
+                print(f"Skipping {bench_name}/{judge_name}: no judgments in {directory}")
+                continue
+            targets.append({
+                "bench": bench_name,
+                "judge": judge_name,
+                "baseline": baseline,
+                "directory": directory,
+                "index": VerdictIndex(get_index_dir(bench_name, judge_name)),
+                "cache_file": os.path.join("data", bench_name, "leaderboard_cache", "multi", f"{judge_name}.npz"),
+            })
+    return targets
+
+
+def get_cache_key(target, settings):
+    key = {"generation": target["index"].generation, "baseline": target["baseline"], **settings}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def load_cached_fit(target, key):
+    if not os.path.exists(target["cache_file"]):
+        return None
+    with np.load(target["cache_file"]) as cached:
+        if str(cached["key"]) != key:
+            return None
+        return {name: cached[name] for name in ("models", "ratings", "bootstrap")}
+
+
+def fit_target(index_dir, baseline, num_round, first_game_only, weight, seed):
+    """Ratings and bootstrap ratings of one (bench, judge), run in a worker process."""
+    verdicts = VerdictIndex(index_dir).verdicts(first_game_only)
+    battles = get_battles_from_verdicts(verdicts, baseline, weight, 1 if first_game_only else 2)
+    ratings = compute_mle_elo(battles)
+    bootstrap = get_bootstrap_result_batched(battles, num_round, seed=seed)[ratings.index]
+    return {"models": ratings.index.to_numpy(dtype=str), "ratings": ratings.to_numpy(), "bootstrap": bootstrap.to_numpy()}
+
+
+def fit_all(targets, settings, workers=None):
+    """Fit every target, reusing the cached fit of targets whose verdicts and settings did not change."""
+    fits, pending = {}, []
+    for i, target in enumerate(targets):
+        key = get_cache_key(target, settings)
+        cached = load_cached_fit(target, key)
+        if cached is None:
+            pending.append((i, key))
+        else:
+            fits[i] = cached
+    print(f"{len(targets) - len(pending)} cached fits, refitting {len(pending)}")
+
+    workers = min(workers or os.cpu_count() or 1, max(1, len(pending)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                fit_target, targets[i]["index"].index_dir, targets[i]["baseline"], settings["num_round"],
+                settings["first_game_only"], settings["weight"], settings["seed"],
+            ): (i, key)
+            for i, key in pending
+        }
+        for future in concurrent.futures.as_completed(futures):
+            i, key = futures[future]
+            fits[i] = future.result()
+            os.makedirs(os.path.dirname(targets[i]["cache_file"]), exist_ok=True)
+            with open(targets[i]["cache_file"] + ".tmp", "wb") as fout:
+                np.savez(fout, key=np.array(key), **fits[i])
+            os.replace(targets[i]["cache_file"] + ".tmp", targets[i]["cache_file"])
+    return [fits[i] for i in range(len(targets))]
+
+
+def get_win_rates(fit, baseline):
+    """Win rate against the baseline with the 2.5 and 97.5 percentiles over bootstrap rounds."""
+    ratings = pd.Series(fit["ratings"], index=fit["models"])
+    rounds = get_bootstrap_win_rates(pd.DataFrame(fit["bootstrap"], columns=fit["models"]), baseline)
+    return pd.DataFrame({
+        "score": predict_win_rate(ratings)[baseline].fillna(0.5) * 100,
+        "lower": rounds.quantile(0.025),
+        "upper": rounds.quantile(0.975),
+    }).reindex(ratings.index)
+
+
+def get_verdict_agreement(verdicts_1, verdicts_2):
+    """Share of games judged by both judges where they pick the same winner."""
+    def winners(verdicts):
+        winner = verdicts["score"].map(GAME_1_WINNER).where(verdicts["game"] == 0, verdicts["score"].map(GAME_2_WINNER))
+        return verdicts.assign(winner=winner).dropna(subset=["winner"]).drop_duplicates(["question_id", "model", "game"], keep="last")
+
+    both = winners(verdicts_1).merge(winners(verdicts_2), on=["question_id", "model", "game"])
+    if both.empty:
+        return None, 0
+    return (both["winner_x"] == both["winner_y"]).mean(), len(both)
+
+
+def get_agreement(targets, tables, settings):
+    """Rank correlation and verdict agreement of every pair of judges on the same bench."""
+    rows = []
+    for i, j in itertools.combinations(range(len(targets)), 2):
+        if targets[i]["bench"] != targets[j]["bench"]:
+            continue
+        common = tables[i].index.intersection(tables[j].index)
+        verdicts_i = targets[i]["index"].verdicts(settings["first_game_only"])
+        verdicts_j = targets[j]["index"].verdicts(settings["first_game_only"])
+        agreement, num_games = get_verdict_agreement(verdicts_i, verdicts_j)
+        rows.append({
+            "bench": targets[i]["bench"],
+            "judge_1": targets[i]["judge"],
+            "judge_2": targets[j]["judge"],
+            "models": len(common),
+            "spearman": tables[i].loc[common, "score"].corr(tables[j].loc[common, "score"], method="spearman"),
+            "verdict_agreement": agreement,
+            "games": num_games,
+        })
+    return pd.DataFrame(rows)
+
+
+def show_multi_leaderboard(bench_names, judge_names, baselines, num_round=100, first_game_only=False, weight=3, seed=42,
+                           workers=None, output=False):
+    targets = get_targets(bench_names, judge_names, baselines)
+    assert targets, "no judgments found"
+    changed = update_indexes([(target["directory"], target["index"]) for target in targets], workers)
+    print(f"Indexed {sum(len(files) for files in changed)} changed judgment files")
+
+    settings = {"num_round": num_round, "first_game_only": first_game_only, "weight": weight, "seed": seed,
+                "single_game_weight": 1 if first_game_only else 2}
+    fits = fit_all(targets, settings, workers)
+    tables = [get_win_rates(fit, target["baseline"]) for fit, target in zip(fits, targets)]
+
+    labels = [f"{target['bench']}/{target['judge']}" for target in targets]
+    combined = pd.concat(tables, axis=1, keys=labels)
+    display = pd.DataFrame({
+        label: [
+            f"{row['score']:.1f} ({row['lower'] - row['score']:+.1f}, {row['upper'] - row['score']:+.1f})" if pd.notna(row["score"]) else "-"
+            for _, row in combined[label].iterrows()
+        ]
+        for label in labels
+    }, index=combined.index)
+    display = display.loc[combined.xs("score", axis=1, level=1).mean(axis=1).sort_values(ascending=False).index]
+    print(display.to_string())
+
+    agreement = get_agreement(targets, tables, settings)
+    if not agreement.empty:
+        print("\nInter-judge agreement")
+        print(agreement.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+
+    if output:
+        date_str = datetime.datetime.now().strftime("%Y%m%d")
+        records = combined.stack(level=0, future_stack=True).reset_index(names=["model", "target"]).to_dict("records")
+        with open(f"multi_leaderboard_{date_str}.json", "w") as fout:
+            json.dump({"leaderboard": records, "agreement": agreement.to_dict("records")}, fout, indent=4)
+    return combined, agreement
@@ -10,7 +10,7 @@ import gradio as gr
 
 from utils import (
     load_questions,
-    load_model_answers,
+    LazyModelAnswers,
 )
 
 
@@ -344,6 +344,8 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int)
     parser.add_argument("--share", action="store_true")
     parser.add_argument("--config-file", type=str, default="config/judge_config.yaml")
+    parser.add_argument("--columnar", action="store_true",
+                        help="read answers and judgments from the Parquet store under data/<bench>/columnar")
     args = parser.parse_args()
     print(args)
 
@@ -361,11 +363,32 @@ if __name__ == "__main__":
     questions = load_questions(question_file)
 
     # Load answers
-    model_answers = load_model_answers(answer_dir)
+    if args.columnar:
+        from columnar_store import (
+            ColumnarModelAnswers,
+            get_answer_store,
+            get_judgment_store,
+            read_judgment_texts,
+            sync_answers,
+            sync_judgments,
+        )
+
+        answer_store = get_answer_store(configs["bench_name"])
+        judgment_store = get_judgment_store(configs["bench_name"], configs["judge_model"])
+        sync_answers(answer_dir, answer_store)
+        sync_judgments(pairwise_model_judgment_dir, judgment_store)
+
+        model_answers = ColumnarModelAnswers(answer_store)
+        model_judgments_normal_pairwise = (
+            model_judgments_math_pairwise
+        ) = read_judgment_texts(judgment_store)
+    else:
+        # answers are read per model when first displayed
+        model_answers = LazyModelAnswers(answer_dir)
 
-    model_judgments_normal_pairwise = (
-        model_judgments_math_pairwise
-    ) = load_pairwise_model_judgments(pairwise_model_judgment_dir)
+        model_judgments_normal_pairwise = (
+            model_judgments_math_pairwise
+        ) = load_pairwise_model_judgments(pairwise_model_judgment_dir)
 
     if configs["baseline"]:
         baseline_model = configs["baseline_model"]
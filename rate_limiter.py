@@ -0,0 +1,253 @@
+"""Adaptive per-endpoint rate limiting.
+
+Each endpoint in api_config.yaml may set `rpm` (requests per minute) and
+`tpm` (tokens per minute). Requests then go through a token bucket for both
+budgets and an AIMD concurrency window: the window grows by one request per
+window's worth of successes and shrinks multiplicatively on 429s and
+timeouts. The throttled request itself waits for its Retry-After (or an
+exponential backoff) before it competes for a slot again.
+"""
+import asyncio
+import contextlib
+import email.utils
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # requests larger than the bucket are let through once it is full
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+def is_throttled(e):
+    """Whether an SDK exception means the endpoint is overloaded (429 or timeout)."""
+    if getattr(e, "status_code", None) == 429:
+        return True
+    name = type(e).__name__
+    return "RateLimit" in name or "Timeout" in name
+
+
+def get_retry_after(e):
+    """Seconds to wait according to the Retry-After headers of a failed response, if any."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Slot:
+    def __init__(self, limiter=None, tokens=0):
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def record_usage(self, usage):
+        """Replace the token estimate with the usage reported by the API."""
+        if self.limiter is None or usage is None:
+            return
+        used = getattr(usage, "total_tokens", None)
+        if used is None:
+            used = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+        if used:
+            self.limiter.adjust_tokens(self.tokens - used)
+            self.tokens = used
+
+
+NULL_SLOT = _Slot()
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rpm=None, tpm=None, max_concurrency=1, initial_concurrency=None, min_concurrency=1,
+                 decrease_factor=0.7, backoff=1.0, max_backoff=60.0):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(initial_concurrency or max_concurrency)
+        self.decrease_factor = decrease_factor
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.in_flight = 0
+        self.backoff = backoff
+        self.last_decrease = 0.0
+        self.window_time = 0.0  # moving average of request latency
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0}
+        self._cond = threading.Condition()
+
+    def _try_acquire(self, tokens):
+        """Take a slot if possible, otherwise return how long to wait before trying again."""
+        now = time.monotonic()
+        if self.in_flight >= int(self.concurrency):
+            return None
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(amount))
+        if wait > 0:
+            return wait
+        if self.requests is not None:
+            self.requests.level -= 1
+        if self.tokens is not None:
+            self.tokens.level -= min(tokens, self.tokens.capacity)
+        self.in_flight += 1
+        self.stats["requests"] += 1
+        return 0.0
+
+    def acquire(self, tokens=0):
+        with self._cond:
+            while True:
+                wait = self._try_acquire(tokens)
+                if wait == 0.0:
+                    return
+                # None means waiting for a concurrency slot, which release() signals
+                self._cond.wait(timeout=wait)
+
+    async def acquire_async(self, tokens=0):
+        while True:
+            with self._cond:
+                wait = self._try_acquire(tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(0.05 if wait is None else wait)
+
+    def adjust_tokens(self, refund):
+        if self.tokens is None:
+            return
+        with self._cond:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + refund)
+
+    def retry_delay(self, e):
+        """How long a request that failed with a throttling error waits before retrying."""
+        retry_after = get_retry_after(e)
+        if retry_after is not None:
+            return retry_after
+        with self._cond:
+            delay = self.backoff
+            self.backoff = min(self.max_backoff, self.backoff * 2)
+        return delay
+
+    def release(self, throttled=False, error=False, latency=0.0):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.stats["throttled"] += 1
+                # requests admitted under the old window fail together, so only
+                # the first 429 of a window shrinks it
+                if now - self.last_decrease > self.window_time:
+                    self.concurrency = max(self.min_concurrency, self.concurrency * self.decrease_factor)
+                    self.last_decrease = now
+            elif error:
+                self.stats["errors"] += 1
+            else:
+                self.backoff = self.base_backoff
+                self.window_time = 0.9 * self.window_time + 0.1 * latency
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._cond.notify_all()
+
+    def _release_for(self, e, started):
+        if e is None:
+            self.release(latency=time.monotonic() - started)
+        elif is_throttled(e):
+            self.release(throttled=True)
+        else:
+            self.release(error=True)
+
+    @contextlib.contextmanager
+    def request(self, tokens=0):
+        self.acquire(tokens)
+        started = time.monotonic()
+        try:
+            yield _Slot(self, tokens)
+        except Exception as e:
+            self._release_for(e, started)
+            raise
+        self._release_for(None, started)
+
+    @contextlib.asynccontextmanager
+    async def request_async(self, tokens=0):
+        await self.acquire_async(tokens)
+        started = time.monotonic()
+        try:
+            yield _Slot(self, tokens)
+        except Exception as e:
+            self._release_for(e, started)
+            raise
+        self._release_for(None, started)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(endpoint_info):
+    """Shared limiter for an api_config.yaml entry.
+
+    Returns None unless the entry sets rpm, tpm or adaptive_parallel, so
+    endpoints without these keys keep the static `parallel` behavior.
+    """
+    if not endpoint_info or not any(endpoint_info.get(key) for key in ("rpm", "tpm", "adaptive_parallel")):
+        return None
+    key = (endpoint_info["model_name"], endpoint_info.get("api_type"))
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = AdaptiveRateLimiter(
+                rpm=endpoint_info.get("rpm"),
+                tpm=endpoint_info.get("tpm"),
+                max_concurrency=endpoint_info.get("parallel", 1),
+                initial_concurrency=endpoint_info.get("initial_parallel"),
+            )
+        return _limiters[key]
+
+
+def estimate_tokens(messages, max_tokens):
+    """Upper bound of the tokens a request uses: prompt tokens plus max_tokens."""
+    from tokenizer_service import count_tokens_batch
+
+    return sum(count_tokens_batch([message["content"] for message in messages])) + max_tokens
+
+
+def limit(limiter, messages, max_tokens):
+    """Context manager guarding one API call, a no-op when the endpoint has no limiter."""
+    if limiter is None:
+        return contextlib.nullcontext(NULL_SLOT)
+    tokens = estimate_tokens(messages, max_tokens) if limiter.tokens is not None else 0
+    return limiter.request(tokens)
+
+
+def limit_async(limiter, messages, max_tokens):
+    if limiter is None:
+        return contextlib.nullcontext(NULL_SLOT)
+    tokens = estimate_tokens(messages, max_tokens) if limiter.tokens is not None else 0
+    return limiter.request_async(tokens)
@@ -0,0 +1,218 @@
+"""Persistent, content-addressed cache of LLM responses.
+
+Responses are stored in a SQLite database keyed by a hash of
+(model_name, messages, temperature, max_tokens, seed), so rerunning
+gen_judgment.py or gen_answer.py after a crash or with a changed model_list
+does not send (and pay for) the same prompt twice. The database runs in WAL
+mode with a busy timeout, which makes it safe to share between concurrent
+processes; every thread uses its own connection.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def make_cache_key(model, messages, temperature, max_tokens, seed=None):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens, "seed": seed},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path, ttl=None, max_size_mb=None, deterministic_only=True):
+        """
+        ttl: seconds after which an entry is ignored and evicted (None keeps entries forever)
+        max_size_mb: evict least recently used entries beyond this size (None means unbounded)
+        deterministic_only: only cache temperature 0 calls, so sampled answers stay independent
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size_mb * 1024 * 1024 if max_size_mb else None
+        self.deterministic_only = deterministic_only
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, output TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            # lets the ttl eviction run on every put find the expired rows without a table scan
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+            # running total of the stored sizes, kept by triggers in the same
+            # transaction as every write, so eviction never has to sum the table
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER)")
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses "
+                "BEGIN UPDATE cache_size SET total = total + new.size; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses "
+                "BEGIN UPDATE cache_size SET total = total - old.size; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_resize AFTER UPDATE OF size ON responses "
+                "BEGIN UPDATE cache_size SET total = total + new.size - old.size; END"
+            )
+            conn.execute("INSERT OR REPLACE INTO cache_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM responses")
+            conn.execute("COMMIT")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def cacheable(self, temperature):
+        return not self.deterministic_only or not temperature
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT output, created FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+            self._count("misses")
+            return None
+        conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return row[0]
+
+    def put(self, key, model, output):
+        now = time.time()
+        conn = self._conn()
+        # an upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the size trigger
+        conn.execute(
+            "INSERT INTO responses (key, model, output, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET model = excluded.model, output = excluded.output, size = excluded.size, "
+            "created = excluded.created, accessed = excluded.accessed",
+            (key, model, output, len(output.encode("utf-8")), now, now),
+        )
+        self._count("writes")
+        if self.max_size is not None or self.ttl is not None:
+            self.evict()
+
+    def evict(self):
+        conn = self._conn()
+        removed = 0
+        if self.ttl is not None:
+            removed += conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)).rowcount
+        if self.max_size is not None:
+            total = conn.execute("SELECT total FROM cache_size").fetchone()[0]
+            if total > self.max_size:
+                # drop least recently used entries until 90% of the budget is left
+                excess = total - int(0.9 * self.max_size)
+                keys, freed = [], 0
+                for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                    if freed >= excess:
+                        break
+                    keys.append((key,))
+                    freed += size
+                conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+                removed += len(keys)
+        if removed:
+            self._count("evictions", removed)
+
+    def size(self):
+        """Bytes of stored responses."""
+        return self._conn().execute("SELECT total FROM cache_size").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_cache = None
+
+
+def set_response_cache(cache):
+    global _cache
+    _cache = cache
+
+
+def get_response_cache():
+    return _cache
+
+
+def cached_completion(seed=None, error_output=None):
+    """Decorator serving a chat_completion_* helper from the active cache.
+
+    The wrapped function must take model, temperature, max_tokens and either
+    messages or message. Outputs equal to error_output are never stored. On a
+    hit, a metrics dict passed by the caller gets cached=True instead of the
+    streaming timings, so latency reports can leave it out.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def lookup(args, kwargs):
+            cache = _cache
+            if cache is None:
+                return None, None
+            arguments = signature.bind(*args, **kwargs).arguments
+            if not cache.cacheable(arguments["temperature"]):
+                return None, None
+            messages = arguments.get("messages", arguments.get("message"))
+            key = make_cache_key(arguments["model"], messages, arguments["temperature"], arguments["max_tokens"], seed)
+            return cache, key
+
+        def mark_hit(args, kwargs):
+            metrics = signature.bind(*args, **kwargs).arguments.get("metrics")
+            if metrics is not None:
+                metrics["cached"] = True
+
+        def store(cache, key, args, kwargs, output):
+            if output is not None and output != error_output:
+                cache.put(key, signature.bind(*args, **kwargs).arguments["model"], output)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                cache, key = lookup(args, kwargs)
+                if cache is None:
+                    return await fn(*args, **kwargs)
+                output = cache.get(key)
+                if output is None:
+                    output = await fn(*args, **kwargs)
+                    store(cache, key, args, kwargs, output)
+                else:
+                    mark_hit(args, kwargs)
+                return output
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache, key = lookup(args, kwargs)
+            if cache is None:
+                return fn(*args, **kwargs)
+            output = cache.get(key)
+            if output is None:
+                output = fn(*args, **kwargs)
+                store(cache, key, args, kwargs, output)
+            else:
+                mark_hit(args, kwargs)
+            return output
+        return wrapper
+    return decorator
@@ -5,47 +5,128 @@ import plotly.express as px
 import tiktoken
 import datetime
 import argparse
+import hashlib
+import json
 import os
 import math
+import tempfile
+import concurrent.futures
 
 from glob import glob
 from tqdm import tqdm
 
-from sklearn.linear_model import LogisticRegression
-from collections import defaultdict
-from utils import load_model_answers
+from utils import iter_model_answers
+from verdict_index import SCORE_LABELS, get_index_dir, load_indexed_verdicts, parse_judgment_file
 
-def compute_mle_elo(df, SCALE=400, BASE=10, INIT_RATING=1000):
-    models = pd.concat([df["model_a"], df["model_b"]]).unique()
-    models = pd.Series(np.arange(len(models)), index=models)
+def get_pairwise_counts(df, models):
+    """Reduce battles to sufficient statistics for the Bradley-Terry fit.
+
+    Following the logistic regression formulation, every battle is two
+    comparisons: a win counts as two wins and a tie as one win for each side.
+    Returns, for each distinct (model_a, model_b, outcome), the model indices,
+    the number of model_a wins per battle and the number of battles.
+    """
+    idx_a = models[df["model_a"]].to_numpy()
+    idx_b = models[df["model_b"]].to_numpy()
+    a_wins = (df["winner"] == "model_a").to_numpy()
+    ties = ((df["winner"] == "tie") | (df["winner"] == "tie (bothbad)")).to_numpy()
 
-    # duplicate battles
-    df = pd.concat([df, df], ignore_index=True)
     p = len(models.index)
-    n = df.shape[0]
+    outcome = 2 * a_wins + ties
+    category = (idx_a * p + idx_b) * 3 + outcome
+    category_ids, counts = np.unique(category, return_counts=True)
+    pair_ids = category_ids // 3
+    return pair_ids // p, pair_ids % p, (category_ids % 3).astype(float), counts
+
+
+def fit_bradley_terry(idx_a, idx_b, wins, totals, p, init=None, tol=1e-8, max_iter=100):
+    """Maximum likelihood Bradley-Terry strengths from aggregated counts.
+
+    Uses Newton iterations on the log-likelihood, where the Hessian is the
+    weighted Laplacian of the comparison graph. wins and totals may carry a
+    leading batch axis, in which case every row is fitted independently and
+    a matrix of strengths is returned. Strengths are on the natural log-odds
+    scale and centered to zero mean, which is the solution an unpenalized
+    logistic regression started from zero converges to.
+    """
+    batched = np.ndim(wins) == 2
+    wins, totals = np.atleast_2d(wins), np.atleast_2d(totals)
+    r = wins.shape[0]
+
+    def log_likelihood(theta, sel=slice(None)):
+        d = theta[:, idx_a] - theta[:, idx_b]
+        log_prob = -np.logaddexp(0, -d)
+        return np.sum(totals[sel] * log_prob - (totals[sel] - wins[sel]) * d, axis=1)
+
+    theta = np.zeros((r, p))
+    if init is not None:
+        theta += np.asarray(init, dtype=float) - np.mean(init, axis=-1, keepdims=True)
+
+    # L + 11^T / p fixes the gauge: the Newton step keeps zero mean, and the
+    # tiny ridge covers models that do not appear in a bootstrap sample
+    gauge = np.ones((p, p)) / p + 1e-10 * np.eye(p)
+    # flat indices into the (r, p) gradient and (r, p, p) Hessian for bincount
+    rows = np.arange(r)[:, None]
+    grad_a, grad_b = (rows * p + idx_a).ravel(), (rows * p + idx_b).ravel()
+    hess_ab, hess_ba = (rows * p * p + idx_a * p + idx_b).ravel(), (rows * p * p + idx_b * p + idx_a).ravel()
+
+    ll = log_likelihood(theta)
+    for _ in range(max_iter):
+        prob = 1 / (1 + np.exp(theta[:, idx_b] - theta[:, idx_a]))
+        g = (wins - totals * prob).ravel()
+        grad = np.bincount(grad_a, weights=g, minlength=r * p) - np.bincount(grad_b, weights=g, minlength=r * p)
+        grad = grad.reshape(r, p)
+
+        h = (totals * prob * (1 - prob)).ravel()
+        hessian = -(np.bincount(hess_ab, weights=h, minlength=r * p * p) + np.bincount(hess_ba, weights=h, minlength=r * p * p))
+        hessian = hessian.reshape(r, p, p)
+        hessian[:, np.arange(p), np.arange(p)] -= hessian.sum(axis=2)
+
+        step = np.linalg.solve(hessian + gauge, grad[..., None])[..., 0]
+        # step halving keeps the iteration monotone when the data is nearly separable
+        new_ll = log_likelihood(theta + step)
+        for _ in range(20):
+            worse = new_ll < ll - 1e-10 * np.abs(ll)
+            if not worse.any():
+                break
+            step[worse] /= 2
+            new_ll[worse] = log_likelihood(theta[worse] + step[worse], worse)
+        theta += step
+        ll = new_ll
+        if np.max(np.abs(step)) < tol:
+            break
+
+    theta -= theta.mean(axis=1, keepdims=True)
+    return theta if batched else theta[0]
+
+
+def get_model_index(df):
+    models = pd.concat([df["model_a"], df["model_b"]]).unique()
+    return pd.Series(np.arange(len(models)), index=models)
 
-    X = np.zeros([n, p])
-    X[np.arange(n), models[df["model_a"]]] = +math.log(BASE)
-    X[np.arange(n), models[df["model_b"]]] = -math.log(BASE)
 
-    # one A win => two A win
-    Y = np.zeros(n)
-    Y[df["winner"] == "model_a"] = 1.0
+def strengths_to_elo(theta, models, SCALE=400, BASE=10, INIT_RATING=1000):
+    elo_scores = SCALE * theta / math.log(BASE) + INIT_RATING
 
-    # one tie => one A win + one B win
-    # find tie + tie (both bad) index
-    tie_idx = (df["winner"] == "tie") | (df["winner"] == "tie (bothbad)")
-    tie_idx[len(tie_idx)//2:] = False
-    Y[tie_idx] = 1.0
+    # set anchor as gpt-4-0314 = 1000
+    if "gpt-4-0314" in models.index:
+        elo_scores += 1000 - elo_scores[..., models["gpt-4-0314"], None]
+    return elo_scores
 
-    lr = LogisticRegression(fit_intercept=False, penalty=None, tol=1e-8)
-    lr.fit(X,Y)
 
-    elo_scores = SCALE * lr.coef_[0] + INIT_RATING
+def compute_mle_elo(df, SCALE=400, BASE=10, INIT_RATING=1000, init=None):
+    models = get_model_index(df)
+    p = len(models.index)
 
-    # set anchor as gpt-4-0314 = 1000
-    if "gpt-4-0314" in models.index:
-        elo_scores += 1000 - elo_scores[models["gpt-4-0314"]]
+    idx_a, idx_b, outcome, counts = get_pairwise_counts(df, models)
+
+    # warm start from previous ratings, e.g. the full-data fit when bootstrapping
+    theta_init = None
+    if init is not None:
+        theta_init = (init.reindex(models.index).fillna(INIT_RATING).to_numpy() - INIT_RATING) * math.log(BASE) / SCALE
+
+    theta = fit_bradley_terry(idx_a, idx_b, outcome * counts, 2.0 * counts, p, init=theta_init)
+    elo_scores = strengths_to_elo(theta[None], models, SCALE, BASE, INIT_RATING)[0]
     return pd.Series(elo_scores, index = models.index).sort_values(ascending=False)
 
 
@@ -57,6 +138,105 @@ def get_bootstrap_result(battles, func_compute_elo, num_round):
     return df[df.median().sort_values(ascending=False).index]
 
 
+def get_bootstrap_result_batched(battles, num_round, seed=42, batch_size=100, SCALE=400, BASE=10, INIT_RATING=1000):
+    """Bootstrap without materializing resampled battles.
+
+    Resampling battles with replacement only changes how many times each
+    (model_a, model_b, outcome) combination occurs, so every round is one
+    multinomial draw over those combinations. All rounds of a batch are then
+    fitted together, warm-started from the full-data fit.
+    """
+    models = get_model_index(battles)
+    p = len(models.index)
+    idx_a, idx_b, outcome, counts = get_pairwise_counts(battles, models)
+    theta_init = fit_bradley_terry(idx_a, idx_b, outcome * counts, 2.0 * counts, p)
+
+    rng = np.random.default_rng(seed)
+    sampled = rng.multinomial(counts.sum(), counts / counts.sum(), size=num_round)
+
+    thetas = []
+    for start in tqdm(range(0, num_round, batch_size), desc="bootstrap"):
+        batch = sampled[start:start + batch_size]
+        init = np.broadcast_to(theta_init, (len(batch), p))
+        thetas.append(fit_bradley_terry(idx_a, idx_b, outcome * batch, 2.0 * batch, p, init=init))
+
+    elo_scores = strengths_to_elo(np.concatenate(thetas), models, SCALE, BASE, INIT_RATING)
+    df = pd.DataFrame(elo_scores, columns=models.index)
+    return df[df.median().sort_values(ascending=False).index]
+
+
+# battle categories of the running get_bootstrap_result_parallel, memory-mapped by each worker
+_bootstrap_categories = None
+
+
+def _init_bootstrap_worker(path):
+    global _bootstrap_categories
+    _bootstrap_categories = np.load(path, mmap_mode="r")
+
+
+def _fit_bootstrap_rounds(seeds, idx_a, idx_b, outcome, p, theta_init):
+    """Resample the shared battles once per seed and fit all of these rounds together."""
+    n = len(_bootstrap_categories)
+    counts = np.stack([
+        np.bincount(_bootstrap_categories[np.random.default_rng(seed).integers(0, n, n)], minlength=len(outcome))
+        for seed in seeds
+    ])
+    init = np.broadcast_to(theta_init, (len(seeds), p))
+    return fit_bradley_terry(idx_a, idx_b, outcome * counts, 2.0 * counts, p, init=init)
+
+
+def get_bootstrap_result_parallel(battles, num_round, seed=42, workers=None, chunk_size=25, output_file=None,
+                                  SCALE=400, BASE=10, INIT_RATING=1000):
+    """Resampling bootstrap across a process pool.
+
+    Battles are encoded as one (model_a, model_b, outcome) category code
+    each and saved to a temporary .npy file that every worker memory-maps,
+    so the battles are neither pickled nor copied per worker. Every round
+    resamples the battles with its own child of SeedSequence(seed), so the
+    result does not depend on the number of workers or chunk_size. Rounds
+    are appended to output_file, in the bootstrapping_results.jsonl layout,
+    as soon as all earlier rounds are done.
+    """
+    models = get_model_index(battles)
+    p = len(models.index)
+    a_wins = (battles["winner"] == "model_a").to_numpy()
+    ties = ((battles["winner"] == "tie") | (battles["winner"] == "tie (bothbad)")).to_numpy()
+    category = (models[battles["model_a"]].to_numpy() * p + models[battles["model_b"]].to_numpy()) * 3 + 2 * a_wins + ties
+    category_ids, categories, counts = np.unique(category, return_inverse=True, return_counts=True)
+    idx_a, idx_b, outcome = category_ids // 3 // p, category_ids // 3 % p, (category_ids % 3).astype(float)
+    theta_init = fit_bradley_terry(idx_a, idx_b, outcome * counts, 2.0 * counts, p)
+
+    seeds = np.random.SeedSequence(seed).spawn(num_round)
+    starts = range(0, num_round, chunk_size)
+    workers = min(workers or os.cpu_count() or 1, len(starts))
+    names = list(models.index)
+    done, next_start = {}, 0
+    fout = open(output_file, "w") if output_file else None
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "battles.npy")
+            np.save(path, categories.astype(np.int32))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_bootstrap_worker, initargs=(path,)) as executor:
+                futures = {
+                    executor.submit(_fit_bootstrap_rounds, seeds[start:start + chunk_size], idx_a, idx_b, outcome, p, theta_init): start
+                    for start in starts
+                }
+                for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="bootstrap"):
+                    done[futures[future]] = strengths_to_elo(future.result(), models, SCALE, BASE, INIT_RATING)
+                    while next_start in done:
+                        if fout is not None:
+                            for row in done[next_start]:
+                                fout.write(json.dumps(dict(zip(names, row.tolist()))) + "\n")
+                            fout.flush()
+                        next_start += chunk_size
+    finally:
+        if fout is not None:
+            fout.close()
+
+    df = pd.DataFrame(np.concatenate([done[start] for start in starts]), columns=models.index)
+    return df[df.median().sort_values(ascending=False).index]
+
+
 def preety_print_two_ratings(ratings_1, ratings_2, column_names):
     df = pd.DataFrame([
         [n, ratings_1[n], ratings_2[n]] for n in ratings_1.keys()
@@ -84,98 +264,358 @@ def visualize_bootstrap_scores(df, title):
 
 
 def predict_win_rate(elo_ratings, SCALE=400, BASE=10, INIT_RATING=1000):
-    names = sorted(list(elo_ratings.keys()))
-    wins = defaultdict(lambda: defaultdict(lambda: 0))
-    for a in names:
-        for b in names:
-            ea = 1 / (1 + BASE ** ((elo_ratings[b] - elo_ratings[a]) / SCALE))
-            wins[a][b] = ea
-            wins[b][a] = 1 - ea
-
-    data = {
-        a: [wins[a][b] if a != b else np.NAN for b in names]
-        for a in names
-    }
-
-    df = pd.DataFrame(data, index=names)
+    """Pairwise win rate matrix of a dict or Series of ratings.
+
+    Entry [a, b] is the expected rate at which model a beats model b; the
+    diagonal is NaN.
+    """
+    ratings = pd.Series(elo_ratings, dtype=float).sort_index()
+    values = ratings.to_numpy()
+    win_rate = 1 / (1 + BASE ** ((values[None, :] - values[:, None]) / SCALE))
+    np.fill_diagonal(win_rate, np.nan)
+
+    df = pd.DataFrame(win_rate, index=ratings.index, columns=ratings.index)
     df.index.name = "model_a"
     df.columns.name = "model_b"
-    return df.T
+    return df
 
 
-def get_win_rate_column(df, column, baseline="gpt-4-0314"):
-    to_dict = df[["model", column]].set_index("model").to_dict()[column]
-    win_rate_table = predict_win_rate(to_dict)
-    return win_rate_table[baseline].fillna(0.5).apply(lambda x: round(x * 100, 2))
+def get_bootstrap_win_rates(bootstrap, baseline="gpt-4-0314", SCALE=400, BASE=10):
+    """Win rate in percent against the baseline for every bootstrap round (rows) and model (columns).
+
+    The baseline's own rating varies between rounds too, so percentiles of
+    these give the win rate CI directly instead of mapping the rating CI.
+    """
+    values = bootstrap.to_numpy()
+    win_rate = 100 / (1 + BASE ** ((bootstrap[baseline].to_numpy()[:, None] - values) / SCALE))
+    return pd.DataFrame(win_rate, index=bootstrap.index, columns=bootstrap.columns)
+
+
+def get_win_rate_matrix_ci(bootstrap, SCALE=400, BASE=10, max_elements=2 ** 24):
+    """2.5 and 97.5 percentiles of every pairwise win rate over the bootstrap rounds.
+
+    Same layout as predict_win_rate. Computed a block of columns at a time
+    to keep memory at about max_elements floats.
+    """
+    models = bootstrap.columns.sort_values()
+    values = bootstrap[models].to_numpy()
+    num_round, p = values.shape
+    lower, upper = np.empty((p, p)), np.empty((p, p))
+    step = max(1, max_elements // max(1, num_round * p))
+    for start in range(0, p, step):
+        block = values[:, start:start + step]
+        win_rate = 1 / (1 + BASE ** ((block[:, None, :] - values[:, :, None]) / SCALE))
+        lower[:, start:start + step], upper[:, start:start + step] = np.percentile(win_rate, [2.5, 97.5], axis=0)
+    np.fill_diagonal(lower, np.nan)
+    np.fill_diagonal(upper, np.nan)
+
+    def frame(matrix):
+        df = pd.DataFrame(matrix, index=models, columns=models)
+        df.index.name = "model_a"
+        df.columns.name = "model_b"
+        return df
+
+    return frame(lower), frame(upper)
+
+
+# verdict label -> winner for each game. The baseline is assistant A in game 1
+# and assistant B in game 2, so the winners are mirrored. Strong verdicts are
+# listed in STRONG_VERDICTS.
+GAME_1_WINNER = {"A>>B": "model_a", "A>B": "model_a", "A=B": "tie", "B>A": "model_b", "B>>A": "model_b"}
+GAME_2_WINNER = {"A>>B": "model_b", "A>B": "model_b", "A=B": "tie", "B>A": "model_a", "B>>A": "model_a"}
+STRONG_VERDICTS = ("A>>B", "B>>A")
+
+
+def load_judgment_verdicts(directory, first_game_only=False, files=None):
+    """Read the verdict of every game in a judgment directory (or only `files`).
+
+    Returns a DataFrame with columns question_id, model, game, score where
+    game is 0 or 1. Rows are in file order, game 1 before game 2. Judgments
+    without a second game have no game 1 row. Only the question_id, model and
+    score fields are extracted, the judgment text is never decoded.
+    """
+    question_ids, models, games, scores = [], [], [], []
+    if files is None:
+        files = glob(f"{directory}/*jsonl")
+    for file in tqdm(files, disable=len(files) < 2):
+        file_question_ids, file_models, file_games, file_scores = parse_judgment_file(file)
+        question_ids += file_question_ids
+        models += file_models
+        games += file_games
+        scores += file_scores
+    df = pd.DataFrame({
+        "question_id": question_ids,
+        "model": models,
+        "game": games,
+        "score": np.array(SCORE_LABELS + [None], dtype=object)[np.array(scores, dtype=np.int64)],
+    })
+    if first_game_only:
+        df = df[df["game"] == 0].reset_index(drop=True)
+    return df
 
 
-def get_battles_from_judgment(judge_name, first_game_only=False, WEIGHT=3):
-    arena_hard_battles = pd.DataFrame()
-    
+def get_battles_from_verdicts(verdicts, baseline="gpt-4-0314", WEIGHT=3, single_game_weight=2):
+    """Turn per-game verdicts into a battles table.
+
+    Strong verdicts are repeated WEIGHT times, unparsable verdicts are dropped.
+    The game of a judgment without its swapped game (second_game: skip_strong
+    or sample) is repeated single_game_weight times, so that it weighs as much
+    as the two games of a full judgment. Pass 1 when every judgment is read
+    with its first game only.
+    """
+    scores = verdicts["score"]
+    game = verdicts["game"].to_numpy()
+    winner = scores.map(GAME_1_WINNER).where(verdicts["game"] == 0, scores.map(GAME_2_WINNER))
+    weight = np.where(scores.isin(STRONG_VERDICTS), WEIGHT, 1)
+    if single_game_weight != 1:
+        keys = pd.MultiIndex.from_arrays([verdicts["question_id"], verdicts["model"]])
+        single = (game == 0) & ~keys.isin(keys[game == 1])
+        weight[single] *= single_game_weight
+    weight[winner.isna().to_numpy()] = 0
+
+    rows = np.repeat(np.arange(len(verdicts)), weight)
+    return pd.DataFrame({
+        "question_id": verdicts["question_id"].to_numpy()[rows],
+        "model_a": baseline,
+        "model_b": verdicts["model"].to_numpy()[rows],
+        "winner": winner.to_numpy()[rows],
+    })
+
+
+def get_position_consistency(verdicts):
+    """Share of judgments with both games whose two verdicts name the same winner.
+
+    Returns (rate, number of judgments with both games, number with game 1 only).
+    """
+    scores = verdicts["score"]
+    winner = scores.map(GAME_1_WINNER).where(verdicts["game"] == 0, scores.map(GAME_2_WINNER))
+    winners = pd.DataFrame({"key": verdicts["question_id"].astype(str) + "\0" + verdicts["model"], "game": verdicts["game"], "winner": winner})
+    winners = winners.drop_duplicates(["key", "game"], keep="last")
+    both = winners.groupby("key")["game"].max() == 1
+    winners = winners.pivot(index="key", columns="game", values="winner")
+    if 1 not in winners.columns:
+        return None, 0, len(winners)
+    decided = winners[0].notna() & winners[1].notna()
+    rate = (winners.loc[decided, 0] == winners.loc[decided, 1]).mean() if decided.any() else None
+    return rate, int(both.sum()), int((~both).sum())
+
+
+def get_battles_from_judgment(judge_name, first_game_only=False, WEIGHT=3, columnar=False, bench_name="arena-hard-v0.1", baseline="gpt-4-0314"):
     print("Turning judgment results into battles...")
 
-    directory = f"data/arena-hard-v0.1/model_judgment/{judge_name}"
+    directory = os.path.join("data", bench_name, "model_judgment", judge_name)
     assert os.path.exists(directory)
-    for file in tqdm(glob(f"{directory}/*jsonl")):
-        df = pd.read_json(file, lines=True)
-
-        for _, row in df.iterrows():
-            # game 1
-            output = {"question_id": row["question_id"],
-                    "model_a": "gpt-4-0314",
-                    "model_b": row["model"]}
-
-            game = row["games"][0]
-
-            weight = 1
-            if game["score"] == "A=B":
-                output["winner"] = "tie"
-            elif game["score"] == "A>B":
-                output["winner"] = "model_a"
-            elif game["score"] == "A>>B":
-                output["winner"] = "model_a"
-                weight = WEIGHT
-            elif game["score"] == "B>A":
-                output["winner"] = "model_b"
-            elif game["score"] == "B>>A":
-                output["winner"] = "model_b"
-                weight = WEIGHT
-            else:
-                weight = 0
-
-            if weight:
-                arena_hard_battles = pd.concat([arena_hard_battles, pd.DataFrame([output] * weight)])
-
-            if not first_game_only:
-                # game 2
-                output = {"question_id": row["question_id"],
-                        "model_a": "gpt-4-0314",
-                        "model_b": row["model"]}
-
-                game = row["games"][1]
-
-                weight = 1
-                if game["score"] == "A=B":
-                    output["winner"] = "tie"
-                elif game["score"] == "A>B":
-                    output["winner"] = "model_b"
-                elif game["score"] == "A>>B":
-                    output["winner"] = "model_b"
-                    weight = WEIGHT
-                elif game["score"] == "B>A":
-                    output["winner"] = "model_a"
-                elif game["score"] == "B>>A":
-                    output["winner"] = "model_a"
-                    weight = WEIGHT
-                else:
-                    weight = 0
-
-                if weight:
-                    arena_hard_battles = pd.concat([arena_hard_battles, pd.DataFrame([output] * weight)])
+    if columnar:
+        from columnar_store import get_judgment_store, read_verdicts, sync_judgments
+
+        store = get_judgment_store(bench_name, judge_name)
+        sync_judgments(directory, store)
+        verdicts = read_verdicts(store, first_game_only)
+    else:
+        # only files changed since the last run are parsed, across a process pool
+        verdicts = load_indexed_verdicts(directory, get_index_dir(bench_name, judge_name), first_game_only)
+    if not first_game_only:
+        rate, num_both, num_single = get_position_consistency(verdicts)
+        if rate is not None:
+            print(f"position consistency: {rate:.1%} of {num_both} judgments with both games")
+        if num_single:
+            print(f"{num_single} judgments have game 1 only")
+    arena_hard_battles = get_battles_from_verdicts(verdicts, baseline, WEIGHT, 1 if first_game_only else 2)
+
     arena_hard_battles.to_json("data/arena_hard_battles.jsonl", lines=True, orient="records")
     return arena_hard_battles
 
 
+def get_file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def poisson_bootstrap_counts(counts, start, stop, seed, file_hash, block=100):
+    """Bootstrap counts of one judgment file's battle categories for rounds [start, stop).
+
+    Every battle gets an independent Poisson(1) weight per round (the Poisson
+    bootstrap), so a category seen n times is drawn as Poisson(n). Draws are
+    seeded by (seed, file content, block of rounds), which lets a file's
+    contribution be recomputed, subtracted or extended to more rounds later.
+    """
+    counts = np.asarray(counts, dtype=float)
+    first = start // block
+    draws = [
+        np.random.default_rng([seed, int(file_hash[:15], 16), b]).poisson(counts, size=(block, len(counts)))
+        for b in range(first, (stop - 1) // block + 1)
+    ]
+    draws = np.concatenate(draws) if draws else np.zeros((0, len(counts)), dtype=int)
+    return draws[start - first * block:stop - first * block]
+
+
+def update_incremental_leaderboard(directory, cache_dir, num_round, first_game_only=False, WEIGHT=3, seed=42,
+                                   baseline="gpt-4-0314", SCALE=400, BASE=10, INIT_RATING=1000):
+    """Ratings and bootstrap results, reusing the state saved by the previous call.
+
+    Only judgment files whose size, mtime and then content hash changed are
+    parsed again. Each file is kept as counts of (model_a, model_b, winner),
+    the bootstrap as per-round counts built from Poisson draws, so a changed
+    file only has its own contribution replaced and extra rounds only need
+    new draws. The fits are warm-started from the saved ratings.
+    """
+    settings = {"first_game_only": first_game_only, "weight": WEIGHT, "single_game_weight": 1 if first_game_only else 2,
+                "seed": seed, "baseline": baseline}
+    state_file = os.path.join(cache_dir, "state.json")
+    counts_file = os.path.join(cache_dir, "bootstrap.npz")
+    state = {"settings": settings, "files": {}, "categories": [], "num_round": 0, "ratings": {}}
+    boot = np.zeros((0, 0))
+    boot_elo = None
+    if os.path.exists(state_file) and os.path.exists(counts_file):
+        with open(state_file) as fin:
+            saved = json.load(fin)
+        if saved["settings"] == settings:
+            state = saved
+            with np.load(counts_file) as data:
+                boot, boot_elo = data["counts"], data["elo"]
+        else:
+            print("Judgment settings changed, rebuilding the incremental cache")
+
+    categories = {tuple(category): i for i, category in enumerate(state["categories"])}
+    files = state["files"]
+
+    def column_index(entry):
+        for a, b, winner, _ in entry["counts"]:
+            if (a, b, winner) not in categories:
+                categories[(a, b, winner)] = len(categories)
+        return [categories[(a, b, winner)] for a, b, winner, _ in entry["counts"]]
+
+    def apply(entry, sign, start, stop):
+        if not entry["counts"]:
+            return
+        columns = column_index(entry)
+        draws = poisson_bootstrap_counts([c[3] for c in entry["counts"]], start, stop, seed, entry["sha1"])
+        np.add.at(boot, (slice(start, stop), columns), sign * draws)
+
+    current = {os.path.basename(file): file for file in sorted(glob(f"{directory}/*jsonl"))}
+    changed = []
+    for name in set(files) - set(current):
+        changed.append((files.pop(name), None))
+    for name, file in current.items():
+        stat = os.stat(file)
+        stamp = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        old = files.get(name)
+        if old is not None and all(old[key] == value for key, value in stamp.items()):
+            continue
+        sha1 = get_file_hash(file)
+        if old is not None and old["sha1"] == sha1:
+            old.update(stamp)
+            continue
+        verdicts = load_judgment_verdicts(directory, first_game_only, files=[file])
+        battles = get_battles_from_verdicts(verdicts, baseline, WEIGHT, 1 if first_game_only else 2)
+        grouped = battles.groupby(["model_a", "model_b", "winner"]).size()
+        entry = {**stamp, "sha1": sha1, "counts": [[a, b, winner, int(n)] for (a, b, winner), n in grouped.items()]}
+        files[name] = entry
+        changed.append((old, entry))
+    print(f"{len(changed)} of {len(current)} judgment files changed since the last run")
+
+    # bootstrap counts of the saved rounds: swap the contribution of every changed file
+    old_round = len(boot)
+    for old, new in changed:
+        for entry in (old, new):
+            if entry is not None:
+                column_index(entry)
+    boot = np.pad(boot, ((0, 0), (0, len(categories) - boot.shape[1])))
+    for old, new in changed:
+        if old is not None:
+            apply(old, -1, 0, old_round)
+        if new is not None:
+            apply(new, 1, 0, old_round)
+    # extra rounds are drawn for every file
+    if num_round > old_round:
+        boot = np.concatenate([boot, np.zeros((num_round - old_round, boot.shape[1]))])
+        for entry in files.values():
+            apply(entry, 1, old_round, num_round)
+
+    totals = np.zeros(len(categories))
+    for entry in files.values():
+        if entry["counts"]:
+            np.add.at(totals, column_index(entry), [c[3] for c in entry["counts"]])
+    # drop categories without battles, e.g. of a model whose file was removed
+    keep = totals > 0
+    category_list = [category for category, _ in sorted(categories.items(), key=lambda item: item[1])]
+    category_list = [category for category, kept in zip(category_list, keep) if kept]
+    totals, boot = totals[keep], boot[:, keep]
+
+    model_a = pd.Series([category[0] for category in category_list], dtype=object)
+    model_b = pd.Series([category[1] for category in category_list], dtype=object)
+    models = get_model_index(pd.DataFrame({"model_a": model_a, "model_b": model_b}))
+    p = len(models.index)
+    idx_a, idx_b = models[model_a].to_numpy(), models[model_b].to_numpy()
+    winner = np.array([category[2] for category in category_list], dtype=object)
+    outcome = 2.0 * (winner == "model_a") + ((winner == "tie") | (winner == "tie (bothbad)"))
+
+    def to_theta(elo_by_model):
+        elo = pd.Series(elo_by_model, dtype=float).reindex(models.index).fillna(INIT_RATING).to_numpy()
+        return (elo - INIT_RATING) * math.log(BASE) / SCALE
+
+    theta = fit_bradley_terry(idx_a, idx_b, outcome * totals, 2.0 * totals, p, init=to_theta(state["ratings"]))
+    elo = pd.Series(strengths_to_elo(theta[None], models, SCALE, BASE, INIT_RATING)[0], index=models.index)
+
+    init = np.tile(theta, (len(boot), 1))
+    if boot_elo is not None and len(boot_elo):
+        saved_models = state["models"]
+        for r in range(min(old_round, len(boot))):
+            init[r] = to_theta(dict(zip(saved_models, boot_elo[r])))
+    thetas = []
+    for start in tqdm(range(0, len(boot), 100), desc="bootstrap"):
+        batch = boot[start:start + 100]
+        thetas.append(fit_bradley_terry(idx_a, idx_b, outcome * batch, 2.0 * batch, p, init=init[start:start + 100]))
+    boot_elo = strengths_to_elo(np.concatenate(thetas), models, SCALE, BASE, INIT_RATING)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    state.update({
+        "categories": [list(category) for category in category_list],
+        "num_round": len(boot),
+        "ratings": elo.to_dict(),
+        "models": list(models.index),
+    })
+    np.savez(counts_file + ".tmp.npz", counts=boot, elo=boot_elo)
+    os.replace(counts_file + ".tmp.npz", counts_file)
+    with open(state_file + ".tmp", "w") as fout:
+        json.dump(state, fout)
+    os.replace(state_file + ".tmp", state_file)
+
+    bootstrap = pd.DataFrame(boot_elo[:num_round], columns=models.index)
+    bootstrap = bootstrap[bootstrap.median().sort_values(ascending=False).index]
+    return elo.sort_values(ascending=False), bootstrap
+
+
+def get_answer_stats(answer_dir, models):
+    """Average first-turn token_len and median streaming latency per model, in one pass over the answer files.
+
+    The latency summary (time-to-first-token and output tokens/sec) only covers
+    answers generated with gen_answer.py --stream, and leaves out calls served
+    from the response cache.
+    """
+    token_lens, latency = {}, {}
+    for model, question_id, answer in iter_model_answers(answer_dir, models=models, fields=["choices", "latency"]):
+        token_lens.setdefault(model, {})[question_id] = answer["choices"][0]["turns"][0]["token_len"]
+        if answer.get("latency"):
+            latency.setdefault(model, {})[question_id] = answer["latency"]
+        else:
+            latency.get(model, {}).pop(question_id, None)
+    avg_tokens = {model: sum(lens.values()) / len(lens) for model, lens in token_lens.items() if lens}
+    summary = {}
+    for model, answers in latency.items():
+        calls = [call for calls in answers.values() for call in calls if not call.get("cached")]
+        ttft = [call["ttft"] for call in calls if call.get("ttft") is not None]
+        tokens_per_sec = [call["tokens_per_sec"] for call in calls if call.get("tokens_per_sec") is not None]
+        summary[model] = {
+            "ttft": float(np.median(ttft)) if ttft else None,
+            "tokens_per_sec": float(np.median(tokens_per_sec)) if tokens_per_sec else None,
+        }
+    return avg_tokens, summary
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--bench-name", type=str, default="arena-hard-v0.1")
@@ -187,29 +627,93 @@ if __name__ == "__main__":
     parser.add_argument("--weight", type=int, default=3)
     parser.add_argument("--num-rounds", type=int, default=100)
     parser.add_argument("--output", action="store_true")
+    parser.add_argument("--win-rate-matrix", action="store_true",
+                        help="with --output, also save every pairwise win rate and its 95%% CI to arena_hard_win_rate_matrix_<date>.json")
     parser.add_argument("--first-game-only", action="store_true")
+    parser.add_argument("--bootstrap-mode", type=str, default="resample", choices=["resample", "batched", "parallel"],
+                        help="resample refits on resampled battles, batched draws multinomial pair counts and fits all rounds together, "
+                             "parallel resamples battles across --workers processes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--incremental", action="store_true",
+                        help="only parse judgment files changed since the last --incremental run and update the cached ratings and Poisson bootstrap")
+    parser.add_argument("--style-control", action="store_true",
+                        help="fit ratings with answer length and markdown style covariates, see style_control.py")
+    parser.add_argument("--judge-names", type=str, nargs="+", default=None,
+                        help="leaderboards of several judges (and --bench-names) in one table with inter-judge agreement")
+    parser.add_argument("--bench-names", type=str, nargs="+", default=None, help="benches of --judge-names, default --bench-name")
+    parser.add_argument("--baselines", type=str, nargs="+", default=None, help="baseline of each bench of --judge-names, default --baseline")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes for --bootstrap-mode parallel and for parsing judgments and fitting --judge-names leaderboards, default one per CPU")
+    parser.add_argument("--columnar", action="store_true",
+                        help="read answers and judgments from the Parquet store under data/<bench>/columnar, rebuilding it when the JSONL files changed")
     args = parser.parse_args()
     print(args)
+
+    if args.judge_names:
+        from multi_leaderboard import show_multi_leaderboard
+
+        show_multi_leaderboard(args.bench_names or [args.bench_name], args.judge_names, args.baselines or [args.baseline],
+                               args.num_rounds, args.first_game_only, args.weight, args.seed, args.workers, args.output)
+        raise SystemExit
+    assert not (args.style_control and args.incremental), "--style-control does not support --incremental"
+    assert not (args.columnar and args.incremental), "--columnar does not support --incremental"
+    assert not (args.incremental and args.bootstrap_mode != "resample"), "--incremental uses its own Poisson bootstrap, drop --bootstrap-mode"
+    assert not (args.incremental and (args.load_battles or args.load_bootstrap)), "--incremental does not support --load-battles or --load-bootstrap"
     assert not args.load_bootstrap or (args.load_battles and args.load_bootstrap), "If loading prexisting bootstrapping data, you must also load preexisting battles."
 
     answer_dir = os.path.join("data", args.bench_name, "model_answer")
-    model_answers = load_model_answers(answer_dir)
-    
-    if args.load_battles:
-        assert os.path.exists("data/arena_hard_battles.jsonl")
-        battles = pd.read_json("data/arena_hard_battles.jsonl", lines=True)
+
+    if args.incremental:
+        bootstrap_online_elo, bootstrap_elo_lu = update_incremental_leaderboard(
+            os.path.join("data", args.bench_name, "model_judgment", args.judge_name),
+            os.path.join("data", args.bench_name, "leaderboard_cache", args.judge_name),
+            args.num_rounds, args.first_game_only, args.weight, args.seed, args.baseline,
+        )
+        # also saves data/arena_hard_battles.jsonl, parsing only the files the verdict index has not seen
+        get_battles_from_judgment(args.judge_name, args.first_game_only, args.weight, False, args.bench_name, args.baseline)
+        bootstrap_elo_lu.to_json("data/bootstrapping_results.jsonl", lines=True, orient="records")
     else:
-        battles = get_battles_from_judgment(args.judge_name, args.first_game_only, args.weight)
-        
-    bootstrap_online_elo = compute_mle_elo(battles)
+        if args.load_battles:
+            assert os.path.exists("data/arena_hard_battles.jsonl")
+            battles = pd.read_json("data/arena_hard_battles.jsonl", lines=True)
+        else:
+            battles = get_battles_from_judgment(args.judge_name, args.first_game_only, args.weight, args.columnar,
+                                                args.bench_name, args.baseline)
+
+        if args.style_control:
+            from style_control import compute_style_elo, get_battle_covariates, get_bootstrap_result_style, get_style_cache_dir, load_style_features
+
+            features = load_style_features(answer_dir, get_style_cache_dir(args.bench_name))
+            covariates = get_battle_covariates(battles, features)
+            bootstrap_online_elo, style_coefs = compute_style_elo(battles, covariates)
+            print("style coefficients: " + ", ".join(f"{name} {coef:+.3f}" for name, coef in style_coefs.items()))
+        else:
+            bootstrap_online_elo = compute_mle_elo(battles)
+
+        if args.load_bootstrap:
+            bootstrap_elo_lu = pd.read_json("data/bootstrapping_results.jsonl", lines=True)
+        else:
+            if args.style_control:
+                bootstrap_elo_lu = get_bootstrap_result_style(battles, covariates, args.num_rounds, seed=args.seed)
+            elif args.bootstrap_mode == "batched":
+                bootstrap_elo_lu = get_bootstrap_result_batched(battles, args.num_rounds, seed=args.seed)
+            elif args.bootstrap_mode == "parallel":
+                bootstrap_elo_lu = get_bootstrap_result_parallel(battles, args.num_rounds, seed=args.seed, workers=args.workers,
+                                                                 output_file="data/bootstrapping_results.jsonl")
+            else:
+                np.random.seed(args.seed)
+                bootstrap_elo_lu = get_bootstrap_result(battles, compute_mle_elo, args.num_rounds)
+            if args.bootstrap_mode != "parallel" or args.style_control:
+                bootstrap_elo_lu.to_json("data/bootstrapping_results.jsonl", lines=True, orient="records")
 
+    if args.columnar:
+        from columnar_store import get_answer_store, read_avg_token_len, sync_answers
 
-    if args.load_bootstrap:
-        bootstrap_elo_lu = pd.read_json("data/bootstrapping_results.jsonl", lines=True)
+        sync_answers(answer_dir, get_answer_store(args.bench_name))
+        avg_tokens = read_avg_token_len(get_answer_store(args.bench_name), bootstrap_online_elo.index)
+        latency = {}
     else:
-        np.random.seed(42)
-        bootstrap_elo_lu = get_bootstrap_result(battles, compute_mle_elo, args.num_rounds)
-        bootstrap_elo_lu.to_json("data/bootstrapping_results.jsonl", lines=True, orient="records")
+        avg_tokens, latency = get_answer_stats(answer_dir, bootstrap_online_elo.index)
 
     stats = pd.DataFrame()
     stats["results"] = None
@@ -223,21 +727,17 @@ if __name__ == "__main__":
         stats.at[i, "lower"] = np.percentile(bootstrap_elo_lu[model], 2.5)
         stats.at[i, "upper"] = np.percentile(bootstrap_elo_lu[model], 97.5)
 
-        length = 0
-        if model in model_answers:
-            for _, row in model_answers[model].items():
-                turn = row["choices"][0]["turns"][0]
-                length += turn["token_len"]
-            length /= len(model_answers[model])
-
-        stats.at[i, "avg_tokens"] = int(length)
+        stats.at[i, "avg_tokens"] = int(avg_tokens.get(model, 0))
+        stats.at[i, "ttft"] = latency.get(model, {}).get("ttft")
+        stats.at[i, "tokens_per_sec"] = latency.get(model, {}).get("tokens_per_sec")
         stats.at[i, "results"] = bootstrap_elo_lu[model].tolist()
     
     if not args.show_elo:
-        stats.sort_values(by="model", inplace=True)
-        stats["score"] = get_win_rate_column(stats, "score", args.baseline).tolist()
-        stats["lower"] = get_win_rate_column(stats, "lower", args.baseline).tolist()
-        stats["upper"] = get_win_rate_column(stats, "upper", args.baseline).tolist()
+        win_rates = get_bootstrap_win_rates(bootstrap_elo_lu, args.baseline)
+        baseline_win_rate = predict_win_rate(bootstrap_online_elo)[args.baseline].fillna(0.5) * 100
+        stats["score"] = baseline_win_rate.reindex(stats["model"]).round(2).to_numpy()
+        stats["lower"] = win_rates.quantile(0.025).reindex(stats["model"]).round(2).to_numpy()
+        stats["upper"] = win_rates.quantile(0.975).reindex(stats["model"]).round(2).to_numpy()
         decimal = 1
     else:
         decimal = 0
@@ -246,9 +746,26 @@ if __name__ == "__main__":
     stats.sort_values(by="score", ascending=False, inplace=True)
     for _, row in stats.iterrows():
         interval = str((round(row['lower'] - row['score'], decimal), round(row['upper'] - row['score'], decimal)))
-        print(f"{row['model'] : <30} | score: {round(row['score'], decimal) : ^5} | 95% CI: {interval : ^12} | average #tokens: {int(row['avg_tokens'])}")
+        line = f"{row['model'] : <30} | score: {round(row['score'], decimal) : ^5} | 95% CI: {interval : ^12} | average #tokens: {int(row['avg_tokens'])}"
+        if pd.notna(row["ttft"]):
+            line += f" | TTFT: {row['ttft']:.2f}s"
+        if pd.notna(row["tokens_per_sec"]):
+            line += f" | tokens/s: {row['tokens_per_sec']:.1f}"
+        print(line)
 
     if args.output:
         cur_date = datetime.datetime.now()
         date_str = cur_date.strftime("%Y%m%d")
-        stats.to_json(f"arena_hard_leaderboard_{date_str}.json", orient="records", indent=4)
\ No newline at end of file
+        stats.to_json(f"arena_hard_leaderboard_{date_str}.json", orient="records", indent=4)
+        if args.win_rate_matrix:
+            win_rate = predict_win_rate(bootstrap_online_elo)
+            lower, upper = get_win_rate_matrix_ci(bootstrap_elo_lu[win_rate.index])
+            models = win_rate.index.to_numpy()
+            matrix = pd.DataFrame({
+                "model_a": np.repeat(models, len(models)),
+                "model_b": np.tile(models, len(models)),
+                "win_rate": win_rate.to_numpy().ravel(),
+                "lower": lower.to_numpy().ravel(),
+                "upper": upper.to_numpy().ravel(),
+            })
+            matrix.to_json(f"arena_hard_win_rate_matrix_{date_str}.json", orient="records", indent=4)
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""Style and length controlled ratings, for show_result.py --style-control.
+
+Every battle gets covariates for the answer length (token_len) and the
+markdown headers, list items and bold spans of the two answers, and the
+Bradley-Terry model is fitted with a coefficient for each. The model
+ratings are then what is left of the judge's preference once those styles
+are accounted for.
+
+Per-answer style counts are cached per answer file under
+data/<bench>/style_features/<model>.json and recomputed only when the file
+changes (by size and mtime).
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from show_result import get_model_index, strengths_to_elo
+from utils import get_answer_files
+
+
+STYLE_FEATURES = ["token_len", "header_count", "list_count", "bold_count"]
+MARKDOWN_PATTERNS = {
+    "header_count": r"(?m)^#{1,6} ",
+    "list_count": r"(?m)^[ \t]*(?:[-*+]|\d+\.) ",
+    "bold_count": r"\*\*[^*\n]+\*\*|__[^_\n]+__",
+}
+
+
+def get_style_cache_dir(bench_name):
+    return os.path.join("data", bench_name, "style_features")
+
+
+def count_markdown(texts):
+    """(len(texts), 3) header, list item and bold counts, one vectorized pass per pattern."""
+    texts = pd.Series(texts, dtype=object)
+    return np.stack([texts.str.count(pattern).to_numpy() for pattern in MARKDOWN_PATTERNS.values()], axis=1)
+
+
+def _read_answers(filename):
+    """question_ids, summed token_len and joined text of the first choice of every answer."""
+    question_ids, token_lens, texts = [], [], []
+    with open(filename) as fin:
+        for line in fin:
+            if not line.strip():
+                continue
+            answer = json.loads(line)
+            turns = answer["choices"][0]["turns"]
+            question_ids.append(answer["question_id"])
+            token_lens.append(sum(turn.get("token_len", 0) for turn in turns))
+            texts.append("\n".join(turn["content"] for turn in turns))
+    return question_ids, token_lens, texts
+
+
+def load_style_features(answer_dir, cache_dir, models=None):
+    """STYLE_FEATURES of every answer, indexed by (model, question_id).
+
+    Only answer files that changed since they were cached are read; the
+    markdown counts of all of them are computed together.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cached, changed = {}, {}
+    for model, filename in get_answer_files(answer_dir, models).items():
+        stat = os.stat(filename)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        cache_file = os.path.join(cache_dir, f"{model}.json")
+        if os.path.exists(cache_file):
+            with open(cache_file) as fin:
+                entry = json.load(fin)
+            if entry["stamp"] == stamp and entry["features"] == STYLE_FEATURES:
+                cached[model] = entry
+                continue
+        changed[model] = (filename, stamp)
+
+    if changed:
+        answers = {model: _read_answers(filename) for model, (filename, stamp) in tqdm(changed.items(), desc="style features")}
+        counts = count_markdown([text for question_ids, token_lens, texts in answers.values() for text in texts])
+        start = 0
+        for model, (question_ids, token_lens, texts) in answers.items():
+            values = np.column_stack([token_lens, counts[start:start + len(texts)]]) if texts else np.zeros((0, 4))
+            start += len(texts)
+            cached[model] = {"stamp": changed[model][1], "features": STYLE_FEATURES, "question_ids": question_ids, "values": values.tolist()}
+            with open(os.path.join(cache_dir, f"{model}.json"), "w") as fout:
+                json.dump(cached[model], fout)
+
+    index = pd.MultiIndex.from_tuples(
+        [(model, question_id) for model, entry in cached.items() for question_id in entry["question_ids"]],
+        names=["model", "question_id"],
+    )
+    values = [row for entry in cached.values() for row in entry["values"]]
+    features = pd.DataFrame(np.array(values, dtype=float).reshape(-1, len(STYLE_FEATURES)), index=index, columns=STYLE_FEATURES)
+    return features[~features.index.duplicated(keep="last")]
+
+
+def get_battle_covariates(battles, features):
+    """Standardized (model_a - model_b) / (model_a + model_b) of each style feature for every battle.
+
+    Battles with a missing answer or no such style in either answer get 0.
+    """
+    feature_a = features.reindex(pd.MultiIndex.from_arrays([battles["model_a"], battles["question_id"]])).to_numpy()
+    feature_b = features.reindex(pd.MultiIndex.from_arrays([battles["model_b"], battles["question_id"]])).to_numpy()
+    total = feature_a + feature_b
+    with np.errstate(divide="ignore", invalid="ignore"):
+        diff = np.where(total > 0, (feature_a - feature_b) / total, 0.0)
+    diff = np.nan_to_num(diff)
+    std = diff.std(axis=0)
+    return (diff - diff.mean(axis=0)) / np.where(std > 0, std, 1)
+
+
+def get_style_counts(battles, covariates, models):
+    """Like show_result.get_pairwise_counts, but keeping the battles of each question apart.
+
+    Battles of the same (question, model_a, model_b) share their covariates
+    and form one row of the fit. Returns the model indices and covariates of
+    every row, plus the row, model_a wins per battle and count of every
+    distinct (row, outcome), sorted by row.
+    """
+    keys = battles.groupby(["question_id", "model_a", "model_b"], sort=False).ngroup().to_numpy()
+    a_wins = (battles["winner"] == "model_a").to_numpy()
+    ties = battles["winner"].isin(["tie", "tie (bothbad)"]).to_numpy()
+    outcome = 2 * a_wins + ties
+    category_ids, first, counts = np.unique(keys.astype(np.int64) * 3 + outcome, return_index=True, return_counts=True)
+    rows = category_ids // 3
+    row_first = first[np.flatnonzero(np.diff(rows, prepend=-1))]
+    idx_a = models[battles["model_a"].to_numpy()[row_first]].to_numpy()
+    idx_b = models[battles["model_b"].to_numpy()[row_first]].to_numpy()
+    return idx_a, idx_b, covariates[row_first], rows, (category_ids % 3).astype(float), counts
+
+
+def sum_rows(rows, values):
+    """Sum values (last axis over the (row, outcome) categories of get_style_counts) per row."""
+    return np.add.reduceat(values, np.flatnonzero(np.diff(rows, prepend=-1)), axis=-1)
+
+
+def fit_bradley_terry_style(idx_a, idx_b, features, wins, totals, p, init=None, tol=1e-8, max_iter=100):
+    """Bradley-Terry strengths plus one coefficient per covariate column.
+
+    Same Newton iteration as show_result.fit_bradley_terry, with the log-odds
+    of model_a winning row i being theta[a] - theta[b] + features[i] @ beta.
+    Returns (theta, beta); wins and totals may carry a leading batch axis.
+    init is an optional (theta, beta) pair.
+    """
+    batched = np.ndim(wins) == 2
+    wins, totals = np.atleast_2d(wins), np.atleast_2d(totals)
+    r, k = wins.shape[0], features.shape[1]
+
+    # rows sorted by model pair: per-row terms are summed per pair with
+    # reduceat, and only the per-pair sums are scattered into the models
+    order = np.argsort(idx_a * p + idx_b, kind="stable")
+    features, wins, totals = features[order], wins[:, order], totals[:, order]
+    pair_ids = (idx_a * p + idx_b)[order]
+    starts = np.flatnonzero(np.diff(pair_ids, prepend=-1))
+    pair_a, pair_b = pair_ids[starts] // p, pair_ids[starts] % p
+    pair_sizes = np.diff(starts, append=len(pair_ids))
+
+    def get_logits(theta, beta):
+        return np.repeat(theta[:, pair_a] - theta[:, pair_b], pair_sizes, axis=1) + beta @ features.T
+
+    def log_likelihood(d, sel=slice(None)):
+        """Log-likelihood per batch row, and the probability of model_a winning each row."""
+        e = np.exp(-np.abs(d))
+        prob = np.where(d >= 0, 1, e) / (1 + e)
+        return np.sum(wins[sel] * d - totals[sel] * (np.maximum(d, 0) + np.log1p(e)), axis=1), prob
+
+    theta, beta = np.zeros((r, p)), np.zeros((r, k))
+    if init is not None:
+        theta += init[0] - np.mean(init[0], axis=-1, keepdims=True)
+        beta += init[1]
+
+    # the gauge only constrains the strengths, the covariates are identified
+    gauge = np.zeros((p + k, p + k))
+    gauge[:p, :p] = 1 / p
+    gauge += 1e-10 * np.eye(p + k)
+    outer = (features[:, :, None] * features[:, None, :]).reshape(-1, k * k)
+    rows = np.arange(r)[:, None]
+    grad_a, grad_b = (rows * p + pair_a).ravel(), (rows * p + pair_b).ravel()
+    hess_ab, hess_ba = (rows * p * p + pair_a * p + pair_b).ravel(), (rows * p * p + pair_b * p + pair_a).ravel()
+
+    def scatter(values):
+        """(r, pairs) per-pair sums -> (r, p) sum over the pairs of each model, + as model_a, - as model_b."""
+        values = values.ravel()
+        return (np.bincount(grad_a, weights=values, minlength=r * p) - np.bincount(grad_b, weights=values, minlength=r * p)).reshape(r, p)
+
+    ll, prob = log_likelihood(get_logits(theta, beta))
+    for _ in range(max_iter):
+        g = wins - totals * prob
+        grad = np.concatenate([scatter(np.add.reduceat(g, starts, axis=1)), g @ features], axis=1)
+
+        # negative Hessian: the comparison graph Laplacian, the covariate Gram
+        # matrix and the strength-covariate cross terms
+        h = totals * prob * (1 - prob)
+        h_pair = np.add.reduceat(h, starts, axis=1).ravel()
+        hessian = np.zeros((r, p + k, p + k))
+        laplacian = -(np.bincount(hess_ab, weights=h_pair, minlength=r * p * p) + np.bincount(hess_ba, weights=h_pair, minlength=r * p * p))
+        laplacian = laplacian.reshape(r, p, p)
+        laplacian[:, np.arange(p), np.arange(p)] -= laplacian.sum(axis=2)
+        hessian[:, :p, :p] = laplacian
+        hx_pair = np.add.reduceat(h[:, :, None] * features, starts, axis=1)
+        for c in range(k):
+            hessian[:, :p, p + c] = hessian[:, p + c, :p] = scatter(hx_pair[:, :, c])
+        hessian[:, p:, p:] = (h @ outer).reshape(r, k, k)
+
+        step = np.linalg.solve(hessian + gauge, grad[..., None])[..., 0]
+        theta_step, beta_step = step[:, :p], step[:, p:]
+        new_ll, new_prob = log_likelihood(get_logits(theta + theta_step, beta + beta_step))
+        for _ in range(20):
+            worse = new_ll < ll - 1e-10 * np.abs(ll)
+            if not worse.any():
+                break
+            theta_step[worse] /= 2
+            beta_step[worse] /= 2
+            new_ll[worse], new_prob[worse] = log_likelihood(get_logits(theta[worse] + theta_step[worse], beta[worse] + beta_step[worse]), worse)
+        theta += theta_step
+        beta += beta_step
+        ll, prob = new_ll, new_prob
+        if np.max(np.abs(step)) < tol:
+            break
+
+    theta -= theta.mean(axis=1, keepdims=True)
+    return (theta, beta) if batched else (theta[0], beta[0])
+
+
+def compute_style_elo(battles, covariates, SCALE=400, BASE=10, INIT_RATING=1000):
+    """Style controlled Elo ratings and the fitted coefficient of each style feature."""
+    models = get_model_index(battles)
+    idx_a, idx_b, features, rows, outcome, counts = get_style_counts(battles, covariates, models)
+    wins, totals = sum_rows(rows, outcome * counts), sum_rows(rows, 2.0 * counts)
+    theta, beta = fit_bradley_terry_style(idx_a, idx_b, features, wins, totals, len(models.index))
+    elo_scores = strengths_to_elo(theta[None], models, SCALE, BASE, INIT_RATING)[0]
+    return pd.Series(elo_scores, index=models.index).sort_values(ascending=False), pd.Series(beta, index=STYLE_FEATURES)
+
+
+def get_bootstrap_result_style(battles, covariates, num_round, seed=42, batch_size=20, SCALE=400, BASE=10, INIT_RATING=1000):
+    """Multinomial bootstrap of the style controlled fit, as in show_result.get_bootstrap_result_batched.
+
+    The rows are per question, so they are drawn one batch at a time to keep
+    memory at batch_size x rows.
+    """
+    models = get_model_index(battles)
+    p = len(models.index)
+    idx_a, idx_b, features, rows, outcome, counts = get_style_counts(battles, covariates, models)
+    init = fit_bradley_terry_style(idx_a, idx_b, features, sum_rows(rows, outcome * counts), sum_rows(rows, 2.0 * counts), p)
+
+    rng = np.random.default_rng(seed)
+    thetas = []
+    for start in tqdm(range(0, num_round, batch_size), desc="bootstrap"):
+        batch = rng.multinomial(counts.sum(), counts / counts.sum(), size=min(batch_size, num_round - start))
+        batch_init = (np.broadcast_to(init[0], (len(batch), p)), np.broadcast_to(init[1], (len(batch), len(init[1]))))
+        wins, totals = sum_rows(rows, outcome * batch), sum_rows(rows, 2.0 * batch)
+        theta, beta = fit_bradley_terry_style(idx_a, idx_b, features, wins, totals, p, init=batch_init)
+        thetas.append(theta)
+
+    elo_scores = strengths_to_elo(np.concatenate(thetas), models, SCALE, BASE, INIT_RATING)
+    df = pd.DataFrame(elo_scores, columns=models.index)
+    return df[df.median().sort_values(ascending=False).index]
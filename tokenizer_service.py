@@ -0,0 +1,122 @@
+"""Shared tokenizers and cached token counts.
+
+Every encoder (tiktoken or a Hugging Face fast tokenizer) is loaded once per
+process and texts are counted in batches. Prompt token counts can also be
+kept on disk, one JSON file per tokenizer keyed by the hash of the text, so
+the max_tokens computation of gen_answer.py only tokenizes new questions.
+"""
+import hashlib
+import json
+import os
+import threading
+
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+
+class TiktokenCounter:
+    def __init__(self, model):
+        import tiktoken
+
+        self.encoding = tiktoken.encoding_for_model(model)
+
+    def count_batch(self, texts):
+        # prompts and answers may quote special tokens such as <|endoftext|>; count them as text
+        return [len(tokens) for tokens in self.encoding.encode_batch(list(texts), disallowed_special=())]
+
+
+class HFCounter:
+    def __init__(self, name):
+        from transformers import AutoTokenizer
+
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+        self.tokenizer = AutoTokenizer.from_pretrained(name)
+
+    def count_batch(self, texts):
+        return [len(ids) for ids in self.tokenizer(list(texts))["input_ids"]]
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_counter(name=DEFAULT_MODEL, kind="tiktoken"):
+    """Shared counter for a tiktoken model name or a Hugging Face tokenizer path."""
+    key = (kind, name)
+    with _counters_lock:
+        if key not in _counters:
+            _counters[key] = TiktokenCounter(name) if kind == "tiktoken" else HFCounter(name)
+        return _counters[key]
+
+
+def count_tokens_batch(texts, name=DEFAULT_MODEL, kind="tiktoken"):
+    texts = list(texts)
+    if not texts:
+        return []
+    return get_counter(name, kind).count_batch(texts)
+
+
+def count_tokens(text, name=DEFAULT_MODEL, kind="tiktoken"):
+    return count_tokens_batch([text], name, kind)[0]
+
+
+class TokenCountCache:
+    """On-disk text hash -> token count map of one tokenizer."""
+
+    def __init__(self, path):
+        self.path = path
+        self.counts = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as fin:
+                self.counts = json.load(fin)
+
+    def get_counts(self, texts, counter):
+        keys = [hashlib.sha1(text.encode("utf-8")).hexdigest() for text in texts]
+        with self._lock:
+            missing = sorted({i for i, key in enumerate(keys) if key not in self.counts})
+        if missing:
+            counts = counter.count_batch([texts[i] for i in missing])
+            with self._lock:
+                self.counts.update({keys[i]: count for i, count in zip(missing, counts)})
+                self.dirty = True
+        with self._lock:
+            return [self.counts[key] for key in keys]
+
+    def flush(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w") as fout:
+                json.dump(self.counts, fout)
+            os.replace(self.path + ".tmp", self.path)
+            self.dirty = False
+
+
+_cache_dir = None
+_caches = {}
+
+
+def set_cache_dir(cache_dir):
+    """Keep prompt token counts under cache_dir (None disables the disk cache)."""
+    global _cache_dir
+    _cache_dir = cache_dir
+    _caches.clear()
+
+
+def get_prompt_token_counts(texts, name=DEFAULT_MODEL, kind="tiktoken"):
+    """Token counts of prompts, served from the disk cache when one is set."""
+    texts = list(texts)
+    if _cache_dir is None:
+        return count_tokens_batch(texts, name, kind)
+    key = (kind, name)
+    with _counters_lock:
+        if key not in _caches:
+            filename = f"{kind}--{name.replace('/', '--')}.json"
+            _caches[key] = TokenCountCache(os.path.join(_cache_dir, filename))
+        cache = _caches[key]
+    counts = cache.get_counts(texts, get_counter(name, kind))
+    cache.flush()
+    return counts
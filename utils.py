@@ -1,14 +1,23 @@
 import os
 import json
+import asyncio
+import threading
 import time
 import yaml
 import random
 import requests
 
+from collections import OrderedDict
+from collections.abc import Mapping
+from types import SimpleNamespace
 from typing import Optional
 from glob import glob
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 
+from endpoint_router import route
+from rate_limiter import is_throttled, limit, limit_async
+from response_cache import cached_completion
+
 # API setting constants
 API_MAX_RETRY = 16
 API_RETRY_SLEEP = 10
@@ -57,26 +66,87 @@ def load_questions(question_file: str):
     return questions
 
 
-def load_model_answers(answer_dir: str):
+def get_answer_files(answer_dir: str, models=None):
+    """Map model name -> answer file, optionally restricted to `models`."""
+    filenames = sorted(glob(os.path.join(answer_dir, "*.jsonl")))
+    files = {os.path.basename(filename)[:-6]: filename for filename in filenames}
+    if models is not None:
+        models = set(models)
+        files = {model: filename for model, filename in files.items() if model in models}
+    return files
+
+
+def iter_model_answers(answer_dir: str, models=None, fields=None):
+    """Stream answers one line at a time as (model_name, question_id, answer) tuples.
+
+    models: only read the files of these models
+    fields: only keep these top-level keys of every answer (question_id is always kept)
+    """
+    for model_name, filename in get_answer_files(answer_dir, models).items():
+        with open(filename) as fin:
+            for line in fin:
+                if not line.strip():
+                    continue
+                answer = json.loads(line)
+                if fields is not None:
+                    answer = {key: answer[key] for key in ("question_id", *fields) if key in answer}
+                yield model_name, answer["question_id"], answer
+
+
+def load_model_answers(answer_dir: str, models=None, fields=None):
     """Load model answers.
 
     The return value is a python dict of type:
     Dict[model_name: str -> Dict[question_id: int -> answer: dict]]
+
+    models and fields restrict what is loaded, see iter_model_answers.
     """
-    filenames = glob(os.path.join(answer_dir, "*.jsonl"))
-    filenames.sort()
-    model_answers = {}
+    model_answers = {model_name: {} for model_name in get_answer_files(answer_dir, models)}
+    for model_name, question_id, answer in iter_model_answers(answer_dir, models, fields):
+        model_answers[model_name][question_id] = answer
+    return model_answers
 
-    for filename in filenames:
-        model_name = os.path.basename(filename)[:-6]
-        answer = {}
-        with open(filename) as fin:
-            for line in fin:
-                line = json.loads(line)
-                answer[line["question_id"]] = line
-        model_answers[model_name] = answer
 
-    return model_answers
+class LazyModelAnswers(Mapping):
+    """Read-only model -> answers mapping that loads a model's file on first access.
+
+    At most `max_models` models stay in memory, least recently used first out,
+    so browsing hundreds of models does not load all of them.
+    """
+
+    def __init__(self, answer_dir: str, models=None, fields=None, max_models=8):
+        self.answer_dir = answer_dir
+        self.fields = fields
+        self.max_models = max_models
+        self._models = self._list_models(models)
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _list_models(self, models):
+        return list(get_answer_files(self.answer_dir, models))
+
+    def _load(self, model_name):
+        return load_model_answers(self.answer_dir, [model_name], self.fields)[model_name]
+
+    def __getitem__(self, model_name):
+        if model_name not in self._models:
+            raise KeyError(model_name)
+        with self._lock:
+            if model_name in self._loaded:
+                self._loaded.move_to_end(model_name)
+                return self._loaded[model_name]
+        answers = self._load(model_name)
+        with self._lock:
+            self._loaded[model_name] = answers
+            while len(self._loaded) > self.max_models:
+                self._loaded.popitem(last=False)
+        return answers
+
+    def __iter__(self):
+        return iter(self._models)
+
+    def __len__(self):
+        return len(self._models)
 
 
 def get_endpoint(endpoint_list):
@@ -99,99 +169,460 @@ def make_config(config_file: str) -> dict:
     return config_kwargs
 
 
-def chat_completion_openai(model, messages, temperature, max_tokens, api_dict=None):
-    import openai
-    if api_dict:
-        client = openai.OpenAI(
-            base_url=api_dict["api_base"],
-            api_key=api_dict["api_key"],
-        )
+def retry_sleep(e, limiter=None):
+    """Wait before retrying a failed call.
+
+    With a rate limiter, throttling errors wait for Retry-After or an
+    exponential backoff instead of the fixed API_RETRY_SLEEP.
+    """
+    if limiter is not None and is_throttled(e):
+        time.sleep(limiter.retry_delay(e))
     else:
-        client = openai.OpenAI()
-    
+        time.sleep(API_RETRY_SLEEP)
+
+
+async def async_retry_sleep(e, limiter=None):
+    if limiter is not None and is_throttled(e):
+        await asyncio.sleep(limiter.retry_delay(e))
+    else:
+        await asyncio.sleep(API_RETRY_SLEEP)
+
+
+class StreamTimer:
+    """Times the chunks of one streamed response.
+
+    Each content chunk is counted as one token, which is what OpenAI,
+    vLLM and Anthropic stream for text, unless the API reports usage.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.chunk_times = []
+        self.output_tokens = None
+        self.usage = None
+
+    def tick(self):
+        self.chunk_times.append(time.perf_counter())
+
+    def record_usage(self, slot, max_tokens):
+        """Correct the rate limiter's estimate once the stream is done.
+
+        Uses the usage reported in the stream, or else the prompt part of the
+        estimate plus the counted output tokens.
+        """
+        usage = self.usage
+        if usage is None and slot.tokens:
+            usage = SimpleNamespace(total_tokens=max(0, slot.tokens - max_tokens) + (self.output_tokens or len(self.chunk_times)))
+        slot.record_usage(usage)
+
+    def summary(self):
+        end = time.perf_counter()
+        times = self.chunk_times
+        output_tokens = self.output_tokens or len(times)
+        decode_time = times[-1] - times[0] if len(times) > 1 else 0.0
+        return {
+            "ttft": times[0] - self.start if times else None,
+            "inter_token_latency": decode_time / (len(times) - 1) if len(times) > 1 else None,
+            "output_tokens": output_tokens,
+            "tokens_per_sec": (output_tokens - 1) / decode_time if decode_time > 0 else None,
+            "latency": end - self.start,
+        }
+
+
+def _openai_stream_kwargs(slot, kwargs):
+    # the final chunk then carries the usage; only asked for when a tpm limit needs it
+    if slot.tokens:
+        kwargs = {**kwargs, "stream_options": {"include_usage": True}}
+    return kwargs
+
+
+def _openai_chunk(timer, parts, chunk):
+    if chunk.choices and chunk.choices[0].delta.content:
+        timer.tick()
+        parts.append(chunk.choices[0].delta.content)
+    if getattr(chunk, "usage", None) is not None:
+        timer.usage = chunk.usage
+        timer.output_tokens = chunk.usage.completion_tokens
+
+
+def stream_openai(client, metrics, slot, **kwargs):
+    timer = StreamTimer()
+    parts = []
+    for chunk in client.chat.completions.create(stream=True, **_openai_stream_kwargs(slot, kwargs)):
+        _openai_chunk(timer, parts, chunk)
+    timer.record_usage(slot, kwargs["max_tokens"])
+    metrics.update(timer.summary())
+    return "".join(parts)
+
+
+async def async_stream_openai(client, metrics, slot, **kwargs):
+    timer = StreamTimer()
+    parts = []
+    async for chunk in await client.chat.completions.create(stream=True, **_openai_stream_kwargs(slot, kwargs)):
+        _openai_chunk(timer, parts, chunk)
+    timer.record_usage(slot, kwargs["max_tokens"])
+    metrics.update(timer.summary())
+    return "".join(parts)
+
+
+def _anthropic_event(timer, parts, event):
+    if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+        timer.tick()
+        parts.append(event.delta.text)
+    elif event.type == "message_start" and event.message.usage is not None:
+        timer.usage = SimpleNamespace(input_tokens=event.message.usage.input_tokens, output_tokens=event.message.usage.output_tokens)
+    elif event.type == "message_delta" and event.usage is not None:
+        timer.output_tokens = event.usage.output_tokens
+        if timer.usage is not None:
+            timer.usage.output_tokens = event.usage.output_tokens
+
+
+def stream_anthropic(client, metrics, slot, **kwargs):
+    timer = StreamTimer()
+    parts = []
+    for event in client.messages.create(stream=True, **kwargs):
+        _anthropic_event(timer, parts, event)
+    timer.record_usage(slot, kwargs["max_tokens"])
+    metrics.update(timer.summary())
+    return "".join(parts)
+
+
+async def async_stream_anthropic(client, metrics, slot, **kwargs):
+    timer = StreamTimer()
+    parts = []
+    async for event in await client.messages.create(stream=True, **kwargs):
+        _anthropic_event(timer, parts, event)
+    timer.record_usage(slot, kwargs["max_tokens"])
+    metrics.update(timer.summary())
+    return "".join(parts)
+
+
+@cached_completion(error_output=API_ERROR_OUTPUT)
+def chat_completion_openai(model, messages, temperature, max_tokens, api_dict=None, limiter=None, router=None, stream=False, metrics=None):
+    import openai
+
     output = API_ERROR_OUTPUT
     for _ in range(API_MAX_RETRY):
         try:
-            completion = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                )
+            with limit(limiter, messages, max_tokens) as slot, route(router, api_dict) as endpoint:
+                client = get_client("openai", endpoint)
+                if stream:
+                    output = stream_openai(client, metrics if metrics is not None else {}, slot, model=model,
+                                           messages=messages, temperature=temperature, max_tokens=max_tokens)
+                    break
+                completion = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    )
+                slot.record_usage(completion.usage)
             output = completion.choices[0].message.content
             break
         except openai.RateLimitError as e:
             print(type(e), e)
-            time.sleep(API_RETRY_SLEEP)
+            retry_sleep(e, limiter)
         except openai.BadRequestError as e:
             print(messages)
             print(type(e), e)
         except openai.APITimeoutError as e:
             print(type(e), e)
-            time.sleep(API_RETRY_SLEEP)
+            retry_sleep(e, limiter)
         except openai.APIConnectionError as e:
             print(type(e), e)
             time.sleep(API_RETRY_SLEEP)
-        except KeyError:
+        except KeyError as e:
             print(type(e), e)
             break
     
     return output
 
 
-def chat_completion_openai_azure(model, messages, temperature, max_tokens, api_dict=None):
+# connections per async client shard. httpcore's async pool scans every
+# connection for every queued request, so one pool with hundreds of
+# connections spends more CPU assigning requests than the requests take.
+ASYNC_CONNECTIONS_PER_CLIENT = 16
+
+
+class ClientRegistry:
+    """Shared SDK clients, one per (api_type, api_base, api_key, api_version).
+
+    SDK clients are thread-safe, so every worker thread of gen_answer.py and
+    gen_judgment.py talks to an endpoint through the same keep-alive
+    connection pool instead of building a client (and a TLS session) per
+    request. Async clients for the asyncio engine are kept separately and
+    sharded: max_connections is split over several clients of at most
+    ASYNC_CONNECTIONS_PER_CLIENT connections, handed out round-robin.
+    """
+
+    def __init__(self, max_connections=256, keepalive_expiry=60, async_connections_per_client=ASYNC_CONNECTIONS_PER_CLIENT):
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.async_connections_per_client = async_connections_per_client
+        self._clients = {}
+        self._next_shard = {}
+        self._lock = threading.Lock()
+        self._stats = {"clients_created": 0, "client_lookups": 0, "requests": 0, "connections_opened": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Counters for client and connection reuse."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["connections_reused"] = stats["requests"] - stats["connections_opened"]
+        return stats
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self._count("connections_opened")
+
+    async def _async_trace(self, event_name, info):
+        self._trace(event_name, info)
+
+    def _on_request(self, request):
+        self._count("requests")
+        request.extensions["trace"] = self._trace
+
+    async def _on_async_request(self, request):
+        self._count("requests")
+        request.extensions["trace"] = self._async_trace
+
+    def _make_http_client(self, asynchronous, max_connections):
+        import httpx
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        timeout = httpx.Timeout(600, connect=10)
+        if asynchronous:
+            return httpx.AsyncClient(limits=limits, timeout=timeout, event_hooks={"request": [self._on_async_request]})
+        return httpx.Client(limits=limits, timeout=timeout, event_hooks={"request": [self._on_request]})
+
+    def _make_client(self, api_type, api_dict, asynchronous, max_connections):
+        if api_type == "cohere":
+            import cohere
+            return cohere.Client(api_dict.get("api_key", os.environ.get("COHERE_API_KEY")))
+
+        http_client = self._make_http_client(asynchronous, max_connections)
+        if api_type == "anthropic":
+            import anthropic
+            client_cls = anthropic.AsyncAnthropic if asynchronous else anthropic.Anthropic
+            return client_cls(
+                api_key=api_dict.get("api_key", os.environ.get("ANTHROPIC_API_KEY")),
+                http_client=http_client,
+            )
+        elif api_type == "azure":
+            import openai
+            client_cls = openai.AsyncAzureOpenAI if asynchronous else openai.AzureOpenAI
+            return client_cls(
+                azure_endpoint=api_dict["api_base"],
+                azure_ad_token_provider=azure_token_provider,
+                api_version=api_dict["api_version"],
+                timeout=240,
+                max_retries=2,
+                http_client=http_client,
+            )
+        else:
+            import openai
+            client_cls = openai.AsyncOpenAI if asynchronous else openai.OpenAI
+            return client_cls(
+                base_url=api_dict.get("api_base"),
+                api_key=api_dict.get("api_key"),
+                http_client=http_client,
+            )
+
+    def get(self, api_type, api_dict=None, asynchronous=False, max_connections=None):
+        """Return the shared client for an endpoint, creating it on first use."""
+        api_dict = api_dict or {}
+        key = (api_type, api_dict.get("api_base"), api_dict.get("api_key"), api_dict.get("api_version"), asynchronous)
+        max_connections = max_connections or self.max_connections
+        with self._lock:
+            self._stats["client_lookups"] += 1
+            if key not in self._clients:
+                if asynchronous:
+                    num_shards = -(-max_connections // self.async_connections_per_client)
+                    shard_connections = -(-max_connections // num_shards)
+                    self._clients[key] = [self._make_client(api_type, api_dict, True, shard_connections) for _ in range(num_shards)]
+                    self._next_shard[key] = 0
+                    self._stats["clients_created"] += num_shards
+                else:
+                    self._clients[key] = self._make_client(api_type, api_dict, False, max_connections)
+                    self._stats["clients_created"] += 1
+            if not asynchronous:
+                return self._clients[key]
+            shards = self._clients[key]
+            shard = self._next_shard[key]
+            self._next_shard[key] = (shard + 1) % len(shards)
+            return shards[shard]
+
+    async def aclose(self):
+        """Close the async clients, which are bound to the event loop that used them."""
+        with self._lock:
+            keys = [key for key in self._clients if key[-1]]
+            clients = [client for key in keys for client in self._clients.pop(key)]
+            for key in keys:
+                self._next_shard.pop(key, None)
+        for client in clients:
+            await client.close()
+
+
+client_registry = ClientRegistry()
+
+
+def get_client(api_type, api_dict=None):
+    return client_registry.get(api_type, api_dict)
+
+
+def get_async_client(api_type, api_dict=None, max_connections=None):
+    return client_registry.get(api_type, api_dict, asynchronous=True, max_connections=max_connections)
+
+
+async def close_async_clients():
+    await client_registry.aclose()
+
+
+def get_client_stats():
+    return client_registry.stats()
+
+
+@cached_completion(error_output=API_ERROR_OUTPUT)
+async def async_chat_completion_openai(model, messages, temperature, max_tokens, api_dict=None, api_type="openai", max_connections=100, limiter=None, router=None, stream=False, metrics=None):
     import openai
-    from openai import AzureOpenAI
 
-    api_base = api_dict["api_base"]
-    client = AzureOpenAI(
-        azure_endpoint = api_base,
-        azure_ad_token_provider = azure_token_provider,
-        api_version=api_dict["api_version"],
-        timeout=240,
-        max_retries=2
-    )
+    kwargs = {"seed": 42, "n": 1} if api_type == "azure" else {}
+    output = API_ERROR_OUTPUT
+    for _ in range(API_MAX_RETRY):
+        try:
+            async with limit_async(limiter, messages, max_tokens) as slot:
+                with route(router, api_dict) as endpoint:
+                    client = get_async_client(api_type, endpoint, max_connections)
+                    if stream:
+                        output = await async_stream_openai(client, metrics if metrics is not None else {}, slot, model=model,
+                                                           messages=messages, temperature=temperature,
+                                                           max_tokens=max_tokens, **kwargs)
+                        break
+                    completion = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        **kwargs,
+                        )
+                    slot.record_usage(completion.usage)
+            output = completion.choices[0].message.content
+            break
+        except openai.RateLimitError as e:
+            print(type(e), e)
+            await async_retry_sleep(e, limiter)
+        except openai.BadRequestError as e:
+            # as in the thread engine: chat_completion_openai retries, chat_completion_openai_azure gives up
+            if api_type == "azure":
+                print(type(e), e)
+                break
+            print(messages)
+            print(type(e), e)
+        except openai.APITimeoutError as e:
+            print(type(e), e)
+            await async_retry_sleep(e, limiter)
+        except openai.APIConnectionError as e:
+            print(type(e), e)
+            await asyncio.sleep(API_RETRY_SLEEP)
+        except KeyError as e:
+            print(type(e), e)
+            break
+
+    return output
+
+
+@cached_completion(error_output=API_ERROR_OUTPUT)
+async def async_chat_completion_anthropic(model, messages, temperature, max_tokens, api_dict=None, max_connections=100, limiter=None, router=None, stream=False, metrics=None):
+    import anthropic
+
+    sys_msg = ""
+    if messages[0]["role"] == "system":
+        sys_msg = messages[0]["content"]
+        messages = messages[1:]
 
     output = API_ERROR_OUTPUT
     for _ in range(API_MAX_RETRY):
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                n=1,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                seed=42,
-            )
+            async with limit_async(limiter, messages, max_tokens) as slot:
+                with route(router, api_dict) as endpoint:
+                    client = get_async_client("anthropic", endpoint, max_connections)
+                    if stream:
+                        output = await async_stream_anthropic(client, metrics if metrics is not None else {}, slot, model=model,
+                                                              messages=messages, stop_sequences=[anthropic.HUMAN_PROMPT],
+                                                              max_tokens=max_tokens, temperature=temperature, system=sys_msg)
+                        break
+                    response = await client.messages.create(
+                        model=model,
+                        messages=messages,
+                        stop_sequences=[anthropic.HUMAN_PROMPT],
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        system=sys_msg
+                    )
+                    slot.record_usage(response.usage)
+            output = response.content[0].text
+            break
+        except anthropic.APIError as e:
+            print(type(e), e)
+            await async_retry_sleep(e, limiter)
+    return output
+
+
+@cached_completion(seed=42, error_output=API_ERROR_OUTPUT)
+def chat_completion_openai_azure(model, messages, temperature, max_tokens, api_dict=None, limiter=None, router=None, stream=False, metrics=None):
+    import openai
+
+    output = API_ERROR_OUTPUT
+    for _ in range(API_MAX_RETRY):
+        try:
+            with limit(limiter, messages, max_tokens) as slot, route(router, api_dict) as endpoint:
+                client = get_client("azure", endpoint)
+                if stream:
+                    output = stream_openai(client, metrics if metrics is not None else {}, slot, model=model,
+                                           messages=messages, n=1, temperature=temperature,
+                                           max_tokens=max_tokens, seed=42)
+                    break
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    n=1,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    seed=42,
+                )
+                slot.record_usage(response.usage)
             output = response.choices[0].message.content
             break
         except openai.RateLimitError as e:
             print(type(e), e)
-            time.sleep(API_RETRY_SLEEP)
+            retry_sleep(e, limiter)
         except openai.BadRequestError as e:
             print(type(e), e)
             break
         except openai.APITimeoutError as e:
             print(type(e), e)
-            time.sleep(API_RETRY_SLEEP)
+            retry_sleep(e, limiter)
         except openai.APIConnectionError as e:
             print(type(e), e)
             time.sleep(API_RETRY_SLEEP)
-        except KeyError:
+        except KeyError as e:
             print(type(e), e)
             break
 
     return output
 
 
-def chat_completion_anthropic(model, messages, temperature, max_tokens, api_dict=None):
+@cached_completion(error_output=API_ERROR_OUTPUT)
+def chat_completion_anthropic(model, messages, temperature, max_tokens, api_dict=None, limiter=None, router=None, stream=False, metrics=None):
     import anthropic
 
-    if api_dict:
-        api_key = api_dict["api_key"]
-    else:
-        api_key = os.environ["ANTHROPIC_API_KEY"]
-
     sys_msg = ""
     if messages[0]["role"] == "system":
         sys_msg = messages[0]["content"]
@@ -200,23 +631,31 @@ def chat_completion_anthropic(model, messages, temperature, max_tokens, api_dict
     output = API_ERROR_OUTPUT
     for _ in range(API_MAX_RETRY):
         try:
-            c = anthropic.Anthropic(api_key=api_key)
-            response = c.messages.create(
-                model=model,
-                messages=messages,
-                stop_sequences=[anthropic.HUMAN_PROMPT],
-                max_tokens=max_tokens,
-                temperature=temperature,
-                system=sys_msg
-            )
+            with limit(limiter, messages, max_tokens) as slot, route(router, api_dict) as endpoint:
+                client = get_client("anthropic", endpoint)
+                if stream:
+                    output = stream_anthropic(client, metrics if metrics is not None else {}, slot, model=model,
+                                              messages=messages, stop_sequences=[anthropic.HUMAN_PROMPT],
+                                              max_tokens=max_tokens, temperature=temperature, system=sys_msg)
+                    break
+                response = client.messages.create(
+                    model=model,
+                    messages=messages,
+                    stop_sequences=[anthropic.HUMAN_PROMPT],
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    system=sys_msg
+                )
+                slot.record_usage(response.usage)
             output = response.content[0].text
             break
         except anthropic.APIError as e:
             print(type(e), e)
-            time.sleep(API_RETRY_SLEEP)
+            retry_sleep(e, limiter)
     return output
 
 
+@cached_completion(error_output=API_ERROR_OUTPUT)
 def chat_completion_mistral(model, messages, temperature, max_tokens):
     from mistralai.client import MistralClient
     from mistralai.models.chat_completion import ChatMessage
@@ -245,6 +684,7 @@ def chat_completion_mistral(model, messages, temperature, max_tokens):
     return output
 
 
+@cached_completion(error_output=API_ERROR_OUTPUT)
 def http_completion_gemini(model, message, temperature, max_tokens):
     api_key = os.environ["GEMINI_API_KEY"]
     
@@ -296,10 +736,11 @@ def http_completion_gemini(model, message, temperature, max_tokens):
     
 
 
+@cached_completion(error_output=API_ERROR_OUTPUT)
 def chat_completion_cohere(model, messages, temperature, max_tokens):
     import cohere
 
-    co = cohere.Client(os.environ["COHERE_API_KEY"])
+    co = get_client("cohere")
     assert len(messages) > 0
 
     template_map = {"system":"SYSTEM",
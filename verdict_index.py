@@ -0,0 +1,249 @@
+"""Compact integer-coded index of the verdicts in a judgment directory.
+
+show_result.py only needs (question_id, model, game, score) from each
+judgment, not the prompts and judgment texts that make up almost all of the
+bytes. This index keeps exactly that, as small-int arrays:
+
+data/<bench>/verdict_index/<judge>/verdicts.npz  source file, question, model, game, score codes
+data/<bench>/verdict_index/<judge>/tables.json   model, question_id and file tables, score labels
+
+Changed judgment files (by size and mtime) are parsed again across a
+process pool with a regex over the raw bytes, so the judgment text is never
+decoded; unchanged files keep their rows.
+
+Usage:
+python verdict_index.py --bench-name arena-hard-v0.1 --judge-name gpt-4-1106-preview
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import uuid
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+
+SCORE_LABELS = ["A>>B", "A>B", "A=B", "B>A", "B>>A"]
+SCORE_CODES = {label: i for i, label in enumerate(SCORE_LABELS)}
+# unparsable or unknown verdicts
+NO_SCORE = -1
+
+# keys of the judgment records; a quote inside a JSON string is always escaped,
+# so these cannot match inside the prompt or judgment text
+QUESTION_ID_PATTERN = re.compile(rb'"question_id":\s*("(?:[^"\\]|\\.)*"|-?\d+)')
+MODEL_PATTERN = re.compile(rb'"model":\s*("(?:[^"\\]|\\.)*")')
+SCORE_PATTERN = re.compile(rb'"score":\s*("(?:[^"\\]|\\.)*"|null)')
+
+
+def get_index_dir(bench_name, judge_name):
+    return os.path.join("data", bench_name, "verdict_index", judge_name)
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _decode(value):
+    """A captured JSON string, number or null, without the json module for the common cases."""
+    if value == b"null":
+        return None
+    if value[:1] == b'"':
+        if b"\\" not in value:
+            return value[1:-1].decode("utf-8")
+        return json.loads(value)
+    return int(value)
+
+
+def parse_judgment_file(path):
+    """question_ids, models and per-game score codes of one judgment file, in file order."""
+    question_ids, models, games, scores = [], [], [], []
+    with open(path, "rb") as fin:
+        for line in fin:
+            if not line.strip():
+                continue
+            question_id = QUESTION_ID_PATTERN.search(line)
+            model = MODEL_PATTERN.search(line)
+            if question_id is None or model is None:
+                # not in the layout gen_judgment.py writes, decode the whole record
+                record = json.loads(line)
+                question_id, model = record["question_id"], record["model"]
+                game_scores = [game.get("score") for game in record["games"]]
+            else:
+                question_id, model = _decode(question_id.group(1)), _decode(model.group(1))
+                game_scores = [_decode(score) for score in SCORE_PATTERN.findall(line)]
+            for game, score in enumerate(game_scores):
+                question_ids.append(question_id)
+                models.append(model)
+                games.append(game)
+                scores.append(SCORE_CODES.get(score, NO_SCORE))
+    return question_ids, models, games, scores
+
+
+class VerdictIndex:
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.tables_file = os.path.join(index_dir, "tables.json")
+        self.arrays_file = os.path.join(index_dir, "verdicts.npz")
+        self.models = []
+        self.question_ids = []
+        self.files = {}
+        self.generation = None
+        self.arrays = {
+            "source": np.zeros(0, np.int32),
+            "question": np.zeros(0, np.int32),
+            "model": np.zeros(0, np.int32),
+            "game": np.zeros(0, np.int8),
+            "score": np.zeros(0, np.int8),
+        }
+        self._load()
+
+    def _load(self):
+        if not (os.path.exists(self.tables_file) and os.path.exists(self.arrays_file)):
+            return
+        with open(self.tables_file) as fin:
+            tables = json.load(fin)
+        with np.load(self.arrays_file) as arrays:
+            # both files carry the token of the update that wrote them
+            if str(arrays["generation"]) != tables["generation"] or tables["score_labels"] != SCORE_LABELS:
+                return
+            self.arrays = {name: arrays[name] for name in self.arrays}
+        self.generation = tables["generation"]
+        self.models = tables["models"]
+        self.question_ids = tables["question_ids"]
+        self.files = tables["files"]
+
+    def _save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        generation = uuid.uuid4().hex
+        with open(self.arrays_file + ".tmp", "wb") as fout:
+            np.savez(fout, generation=np.array(generation), **self.arrays)
+        os.replace(self.arrays_file + ".tmp", self.arrays_file)
+        tables = {
+            "generation": generation,
+            "score_labels": SCORE_LABELS,
+            "models": self.models,
+            "question_ids": self.question_ids,
+            "files": self.files,
+        }
+        with open(self.tables_file + ".tmp", "w") as fout:
+            json.dump(tables, fout)
+        os.replace(self.tables_file + ".tmp", self.tables_file)
+        self.generation = generation
+
+    def _codes(self, table, values):
+        positions = {value: i for i, value in enumerate(table)}
+        codes = np.empty(len(values), np.int32)
+        for i, value in enumerate(values):
+            if value not in positions:
+                positions[value] = len(table)
+                table.append(value)
+            codes[i] = positions[value]
+        return codes
+
+    def get_changes(self, directory):
+        """(stamps, changed, removed) of the judgment files in directory against the index."""
+        stamps = {os.path.basename(path): _file_stamp(path) for path in glob(os.path.join(directory, "*.jsonl"))}
+        changed = sorted(name for name, stamp in stamps.items() if self.files.get(name, {}).get("stamp") != stamp)
+        removed = [name for name in self.files if name not in stamps]
+        return stamps, changed, removed
+
+    def apply(self, stamps, changed, removed, parsed):
+        """Replace the rows of changed and removed files with the parse_judgment_file output of the changed ones."""
+        if not changed and not removed and list(self.files) == list(stamps):
+            return
+        stale = [self.files[name]["code"] for name in changed + removed if name in self.files]
+        keep = ~np.isin(self.arrays["source"], stale)
+        arrays = {name: values[keep] for name, values in self.arrays.items()}
+
+        file_codes = {name: info["code"] for name, info in self.files.items() if name not in removed}
+        next_code = max(file_codes.values(), default=-1) + 1
+        parts = [arrays]
+        for name, (question_ids, models, games, scores) in zip(changed, parsed):
+            if name not in file_codes:
+                file_codes[name] = next_code
+                next_code += 1
+            parts.append({
+                "source": np.full(len(games), file_codes[name], np.int32),
+                "question": self._codes(self.question_ids, question_ids),
+                "model": self._codes(self.models, models),
+                "game": np.array(games, np.int8),
+                "score": np.array(scores, np.int8),
+            })
+        arrays = {name: np.concatenate([part[name] for part in parts]) for name in self.arrays}
+        # rows in the glob order of the directory (the order stamps was listed in,
+        # as load_judgment_verdicts reads it), then line, whatever order the
+        # files were updated in
+        rank = np.zeros(next_code, np.int32)
+        for i, name in enumerate(stamps):
+            rank[file_codes[name]] = i
+        order = np.argsort(rank[arrays["source"]], kind="stable")
+        self.arrays = {name: values[order] for name, values in arrays.items()}
+        self.files = {name: {"code": file_codes[name], "stamp": stamps[name]} for name in stamps}
+        self._save()
+
+    def update(self, directory, workers=None):
+        """Reparse the judgment files that changed since the last update. Returns their names."""
+        return update_indexes([(directory, self)], workers)[0]
+
+    def verdicts(self, first_game_only=False, models=None):
+        """Same table as show_result.load_judgment_verdicts: question_id, model, game, score."""
+        arrays = self.arrays
+        rows = np.ones(len(arrays["game"]), bool)
+        if first_game_only:
+            rows &= arrays["game"] == 0
+        if models is not None:
+            rows &= np.isin(arrays["model"], [i for i, model in enumerate(self.models) if model in set(models)])
+        labels = np.array(SCORE_LABELS + [None], dtype=object)
+        return pd.DataFrame({
+            "question_id": np.array(self.question_ids, dtype=object)[arrays["question"][rows]],
+            "model": np.array(self.models, dtype=object)[arrays["model"][rows]],
+            "game": arrays["game"][rows].astype(np.int64),
+            # NO_SCORE (-1) picks the trailing None
+            "score": labels[arrays["score"][rows]],
+        })
+
+
+def parse_judgment_files(paths, workers=None):
+    workers = workers or os.cpu_count() or 1
+    if len(paths) > 1 and workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(parse_judgment_file, paths, chunksize=max(1, len(paths) // (4 * workers))))
+    return [parse_judgment_file(path) for path in paths]
+
+
+def update_indexes(targets, workers=None):
+    """Update several (directory, VerdictIndex) pairs, parsing all their changed files in one pool.
+
+    Returns the changed file names of every target.
+    """
+    changes = [index.get_changes(directory) for directory, index in targets]
+    paths = [os.path.join(directory, name) for (directory, index), (stamps, changed, removed) in zip(targets, changes) for name in changed]
+    parsed = iter(parse_judgment_files(paths, workers))
+    for (directory, index), (stamps, changed, removed) in zip(targets, changes):
+        index.apply(stamps, changed, removed, [next(parsed) for _ in changed])
+    return [changed for stamps, changed, removed in changes]
+
+
+def load_indexed_verdicts(directory, index_dir, first_game_only=False, workers=None):
+    """Bring the index of a judgment directory up to date and return its verdicts."""
+    index = VerdictIndex(index_dir)
+    changed = index.update(directory, workers)
+    if changed:
+        print(f"Indexed {len(changed)} changed judgment files")
+    return index.verdicts(first_game_only)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench-name", type=str, default="arena-hard-v0.1")
+    parser.add_argument("--judge-name", type=str, default="gpt-4-1106-preview")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes, default one per CPU")
+    args = parser.parse_args()
+
+    index = VerdictIndex(get_index_dir(args.bench_name, args.judge_name))
+    changed = index.update(os.path.join("data", args.bench_name, "model_judgment", args.judge_name), args.workers)
+    print(f"{len(changed)} files updated, {len(index.arrays['game'])} games of {len(index.models)} models in {index.index_dir}")